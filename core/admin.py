@@ -1,19 +1,107 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Sum, Window
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe # Importação necessária para renderizar HTML no Admin
 from .models import (
     CustomUser, PlatformSettings, Level, BankDetails, Deposit, 
-    Withdrawal, Task, Roulette, RouletteSettings, UserLevel, PlatformBankDetails
+    Withdrawal, Task, Roulette, RoulettePrize, RoulettePrizeUsage, UserLevel, PlatformBankDetails, LedgerEntry,
+    CommissionEvent
 )
+from . import balances, deposits, withdrawals
 
 # ---
+# Changelists das tabelas grandes (tarefas e roletas têm milhões de linhas):
+# - sem filtros, o total vem da estimativa do PostgreSQL em vez de COUNT(*);
+# - sem o segundo COUNT(*) do total (show_full_result_count);
+# - list_select_related: o usuário (e o nível) vêm no mesmo SELECT da página;
+# - pesquisa por prefixo do telefone (startswith), que usa o índice
+#   varchar_pattern_ops criado pelo Django para o phone_number único;
+# - raw_id_fields: o formulário não carrega todos os usuários num <select>.
+# ---
+
+# Abaixo disto a contagem exata é barata o suficiente
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+def estimated_count(queryset):
+    # pg_class.reltuples (atualizado pelo ANALYZE/autovacuum); None noutras bases ou sem estatísticas
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        # Só a lista sem filtros nem pesquisa pode usar a estimativa da tabela inteira
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_select_related = ('user',)
+    search_fields = ('user__phone_number__startswith',)
+    raw_id_fields = ('user',)
+
 
 # Registrando os modelos com classes ModelAdmin personalizadas
 
+class CustomUserAdminForm(forms.ModelForm):
+    balance_adjustment = forms.DecimalField(
+        label='Ajuste de saldo (KZ)', required=False, max_digits=12, decimal_places=2,
+        help_text='Positivo credita, negativo debita o saldo disponível; fica registado no livro-razão.',
+    )
+
+    class Meta:
+        model = CustomUser
+        fields = '__all__'
+
+
 @admin.register(CustomUser)
 class CustomUserAdmin(admin.ModelAdmin):
+    form = CustomUserAdminForm
     list_display = ('phone_number', 'available_balance', 'subsidy_balance', 'is_staff', 'is_active', 'date_joined', 'roulette_spins')
-    search_fields = ('phone_number', 'invite_code')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_fields = ('phone_number__startswith', 'invite_code__exact')
+    raw_id_fields = ('invited_by',)
     list_filter = ('is_staff', 'is_active', 'level_active')
+    # Os saldos são uma projeção do livro-razão: só mudam pelo campo de ajuste
+    readonly_fields = ('available_balance', 'subsidy_balance')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            # Só regrava os campos alterados no formulário: os saldos lidos ao abrir
+            # a página não podem sobrepor movimentos feitos entretanto
+            concrete = {field.name for field in obj._meta.concrete_fields}
+            obj.save(update_fields=[name for name in form.changed_data if name in concrete])
+        else:
+            super().save_model(request, obj, form, change)
+
+        amount = form.cleaned_data.get('balance_adjustment')
+        if not amount:
+            return
+        try:
+            if amount > 0:
+                balances.credit(obj, LedgerEntry.ADJUSTMENT, amount)
+            else:
+                balances.debit(obj, LedgerEntry.ADJUSTMENT, -amount)
+        except balances.InsufficientBalance:
+            self.message_user(request, "Ajuste não aplicado: o saldo disponível não cobre o débito.", messages.ERROR)
 
 @admin.register(PlatformSettings)
 class PlatformSettingsAdmin(admin.ModelAdmin):
@@ -22,13 +110,13 @@ class PlatformSettingsAdmin(admin.ModelAdmin):
 
 @admin.register(Level)
 class LevelAdmin(admin.ModelAdmin):
-    list_display = ('name', 'deposit_value', 'daily_gain', 'monthly_gain', 'cycle_days')
+    list_display = ('name', 'deposit_value', 'daily_gain', 'monthly_gain', 'cycle_days', 'max_tasks')
     search_fields = ('name',)
 
 @admin.register(BankDetails)
-class BankDetailsAdmin(admin.ModelAdmin):
+class BankDetailsAdmin(LargeTableAdmin):
     list_display = ('user', 'bank_name', 'account_holder_name')
-    search_fields = ('user__phone_number', 'bank_name', 'account_holder_name')
+    search_fields = ('user__phone_number__startswith', 'bank_name', 'account_holder_name')
 
 @admin.register(PlatformBankDetails)
 class PlatformBankDetailsAdmin(admin.ModelAdmin):
@@ -36,19 +124,40 @@ class PlatformBankDetailsAdmin(admin.ModelAdmin):
     search_fields = ('bank_name', 'account_holder_name')
 
 @admin.register(Deposit)
-class DepositAdmin(admin.ModelAdmin):
-    # Adicionamos 'proof_link' para mostrar o link na lista de depósitos
+class DepositAdmin(LargeTableAdmin):
+    # Adicionamos 'proof_link' para mostrar a miniatura (com link) na lista de depósitos
     list_display = ('user', 'amount', 'is_approved', 'created_at', 'proof_link') 
-    search_fields = ('user__phone_number',)
     list_filter = ('is_approved',)
+    date_hierarchy = 'created_at'
+    actions = ('approve_selected',)
     
     # Campos que serão apenas de leitura na página de edição/criação
     readonly_fields = ('current_proof_display',)
 
+    # Ação em lote: aprova e credita todos os depósitos pendentes selecionados numa transação
+    def approve_selected(self, request, queryset):
+        stats = deposits.approve(queryset.values_list('pk', flat=True))
+        skipped = stats['requested'] - stats['approved']
+        self.message_user(
+            request,
+            f"{stats['approved']} depósitos aprovados ({stats['amount']} KZ para {stats['users']} usuários); "
+            f"{skipped} já aprovados ou em aprovação noutro pedido.",
+            messages.SUCCESS if stats['approved'] else messages.WARNING,
+        )
+
+    approve_selected.short_description = 'Aprovar depósitos selecionados'
+    approve_selected.allowed_permissions = ('change',)
+
     # Método para criar o link do comprovativo na LISTA de depósitos
     def proof_link(self, obj):
         if obj.proof_of_payment:
             # obj.proof_of_payment.url usa o Cloudinary Storage para obter o URL completo.
+            if obj.proof_thumbnail:
+                # Só a miniatura é carregada na lista; a imagem completa abre no link
+                return mark_safe(
+                    f'<a href="{obj.proof_of_payment.url}" target="_blank">'
+                    f'<img src="{obj.proof_thumbnail.url}" style="max-height:60px; width:auto;" loading="lazy" /></a>'
+                )
             return mark_safe(f'<a href="{obj.proof_of_payment.url}" target="_blank">Ver Comprovativo</a>')
         return "Nenhum"
         
@@ -57,40 +166,162 @@ class DepositAdmin(admin.ModelAdmin):
     # Método para exibir a imagem/link na PÁGINA DE EDIÇÃO/MODIFICAÇÃO
     def current_proof_display(self, obj):
         if obj.proof_of_payment:
-            # Exibe a imagem diretamente e fornece um link para visualização
+            # Exibe a miniatura e fornece um link para a imagem completa
+            # (comprovativos antigos sem miniatura: ver o comando generate_proof_thumbnails)
+            preview = obj.proof_thumbnail.url if obj.proof_thumbnail else obj.proof_of_payment.url
             return mark_safe(f'''
                 <a href="{obj.proof_of_payment.url}" target="_blank">Ver Imagem em Tamanho Real</a><br/>
-                <img src="{obj.proof_of_payment.url}" style="max-width:300px; height:auto; margin-top: 10px;" />
+                <a href="{obj.proof_of_payment.url}" target="_blank">
+                    <img src="{preview}" style="max-width:300px; height:auto; margin-top: 10px;" />
+                </a>
             ''')
         return "Nenhum Comprovativo Carregado"
     
     current_proof_display.short_description = 'Comprovativo Atual'
 
 @admin.register(Withdrawal)
-class WithdrawalAdmin(admin.ModelAdmin):
-    list_display = ('user', 'amount', 'status', 'created_at')
-    search_fields = ('user__phone_number',)
-    list_filter = ('status',)
+class WithdrawalAdmin(LargeTableAdmin):
+    list_display = ('user', 'amount', 'status', 'created_at', 'exported_at')
+    list_filter = ('status', 'exported_at')
+    date_hierarchy = 'created_at'
+    # O estado só muda pelas ações (transições válidas e devolução do saldo ao rejeitar)
+    readonly_fields = ('status', 'exported_at')
+    actions = ('approve_and_export', 'export_payouts', 'reexport_payouts', 'mark_paid', 'reject')
+
+    def _transition(self, request, queryset, target):
+        try:
+            stats = withdrawals.transition(queryset.values_list('pk', flat=True), target)
+        except withdrawals.ConcurrentProcessing:
+            self.message_user(request, "Outro pedido alterou estes saques ao mesmo tempo. Tente de novo.", messages.ERROR)
+            return None
+        skipped = stats['requested'] - stats['changed']
+        label = dict(Withdrawal.STATUS_CHOICES)[target]
+        self.message_user(
+            request,
+            f"{stats['changed']} saques passaram a {label} ({stats['amount']} KZ); "
+            f"{skipped} ignorados (estado incompatível ou em processamento noutro pedido).",
+            messages.SUCCESS if stats['changed'] else messages.WARNING,
+        )
+        return stats
+
+    def _payout_file(self, request, queryset):
+        # Só os aprovados ainda não exportados: um saque nunca entra em dois ficheiros
+        claimed, batch = withdrawals.claim_for_export(queryset)
+        if not claimed:
+            self.message_user(request, "Nenhum saque aprovado por exportar nesta seleção.", messages.WARNING)
+            return None
+        return self._stream(batch)
+
+    def _stream(self, batch):
+        # Streaming: as linhas são geradas à medida que a resposta é enviada
+        response = StreamingHttpResponse(withdrawals.payout_csv(batch), content_type='text/csv; charset=utf-8')
+        filename = timezone.localtime().strftime('pagamentos-%Y%m%d-%H%M.csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def approve_and_export(self, request, queryset):
+        if self._transition(request, queryset, Withdrawal.APPROVED) is None:
+            return None
+        return self._payout_file(request, queryset)
+
+    approve_and_export.short_description = 'Aprovar e exportar ficheiro de pagamentos (CSV)'
+    approve_and_export.allowed_permissions = ('change',)
+
+    def export_payouts(self, request, queryset):
+        return self._payout_file(request, queryset)
+
+    export_payouts.short_description = 'Exportar ficheiro de pagamentos dos aprovados ainda não exportados (CSV)'
+    # O ficheiro tem os IBANs: exige a mesma permissão que aprovar
+    export_payouts.allowed_permissions = ('change',)
+
+    def reexport_payouts(self, request, queryset):
+        # Download falhado ou interrompido: gera de novo o ficheiro dos lotes já marcados
+        batch = withdrawals.exported_batches(queryset)
+        if not batch.exists():
+            self.message_user(request, "Nenhum saque aprovado já exportado nesta seleção.", messages.WARNING)
+            return None
+        return self._stream(batch)
+
+    reexport_payouts.short_description = 'Reexportar o ficheiro de pagamentos dos lotes já exportados (CSV)'
+    reexport_payouts.allowed_permissions = ('change',)
+
+    def mark_paid(self, request, queryset):
+        self._transition(request, queryset, Withdrawal.PAID)
+
+    mark_paid.short_description = 'Marcar como pagos'
+    mark_paid.allowed_permissions = ('change',)
+
+    def reject(self, request, queryset):
+        self._transition(request, queryset, Withdrawal.REJECTED)
+
+    reject.short_description = 'Rejeitar (devolve o valor ao saldo)'
+    reject.allowed_permissions = ('change',)
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
+class TaskAdmin(LargeTableAdmin):
     list_display = ('user', 'earnings', 'completed_at')
-    search_fields = ('user__phone_number',)
+    date_hierarchy = 'completed_at'
 
 @admin.register(Roulette)
-class RouletteAdmin(admin.ModelAdmin):
+class RouletteAdmin(LargeTableAdmin):
     list_display = ('user', 'prize', 'is_approved', 'spin_date')
-    search_fields = ('user__phone_number',)
     list_filter = ('is_approved',)
+    date_hierarchy = 'spin_date'
+
+@admin.register(RoulettePrize)
+class RoulettePrizeAdmin(admin.ModelAdmin):
+    list_display = ('amount', 'weight', 'odds', 'daily_budget')
+    list_editable = ('weight', 'daily_budget')
+
+    def get_queryset(self, request):
+        # Soma dos pesos no mesmo SELECT, para mostrar a probabilidade de cada prêmio
+        return super().get_queryset(request).annotate(total_weight=Window(Sum('weight')))
 
-@admin.register(RouletteSettings)
-class RouletteSettingsAdmin(admin.ModelAdmin):
-    list_display = ('id', 'prizes')
+    def odds(self, obj):
+        if not obj.total_weight:
+            return '-'
+        return f'{obj.weight * 100 / obj.total_weight:.1f}%'
+    odds.short_description = 'Probabilidade'
+
+@admin.register(RoulettePrizeUsage)
+class RoulettePrizeUsageAdmin(admin.ModelAdmin):
+    list_display = ('prize', 'day', 'paid')
+    list_select_related = ('prize',)
+    date_hierarchy = 'day'
 
 @admin.register(UserLevel)
-class UserLevelAdmin(admin.ModelAdmin):
+class UserLevelAdmin(LargeTableAdmin):
     list_display = ('user', 'level', 'purchase_date', 'is_active')
-    search_fields = ('user__phone_number', 'level__name')
+    # UserLevel.__str__ também lê o nível
+    list_select_related = ('user', 'level')
+    search_fields = ('user__phone_number__startswith', 'level__name')
     list_filter = ('is_active',)
 
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(LargeTableAdmin):
+    list_display = ('user', 'entry_type', 'amount', 'subsidy_amount', 'created_at')
+    list_filter = ('entry_type',)
+    date_hierarchy = 'created_at'
+    # O livro-razão é apenas de acréscimo (core/ledger.py): no admin só se consulta
+    readonly_fields = ('user', 'entry_type', 'amount', 'subsidy_amount', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(CommissionEvent)
+class CommissionEventAdmin(LargeTableAdmin):
+    list_display = ('sponsor', 'source_user', 'kind', 'amount', 'status', 'created_at', 'processed_at')
+    list_select_related = ('sponsor', 'source_user')
+    search_fields = ('sponsor__phone_number__startswith',)
+    raw_id_fields = ()
+    list_filter = ('kind', 'status')
+    # Os eventos são aplicados pelo worker process_commissions
+    readonly_fields = ('sponsor', 'source_user', 'kind', 'amount', 'status', 'created_at', 'processed_at')
+
 # ---
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Liga os sinais que mantêm os resumos dos usuários atualizados
+        from . import signals  # noqa: F401
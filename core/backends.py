@@ -0,0 +1,11 @@
+from django.contrib.auth.backends import ModelBackend
+
+from . import user_cache
+
+
+class CachedModelBackend(ModelBackend):
+    # ModelBackend que carrega request.user do cache (ver core/user_cache.py)
+
+    def get_user(self, user_id):
+        user = user_cache.get(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,125 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from . import user_cache
+from .models import CustomUser, LedgerEntry
+
+# ---
+# Serviço de mutação atómica de saldos.
+# Cada operação é um único UPDATE condicional (saldo = saldo + valor) que
+# devolve o novo saldo na mesma ida à base de dados, dentro de
+# transaction.atomic junto com o lançamento no livro-razão. Não há leitura
+# prévia da linha do usuário, logo pedidos concorrentes não perdem updates.
+# ---
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+class NoSpinsAvailable(Exception):
+    pass
+
+
+def _user_table():
+    return connection.ops.quote_name(CustomUser._meta.db_table)
+
+
+def _supports_update_returning():
+    # PostgreSQL e SQLite >= 3.35 suportam UPDATE ... RETURNING
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+    )
+
+
+def _to_decimal(value):
+    # O SQLite devolve int/float para colunas decimais
+    field = CustomUser._meta.get_field('available_balance')
+    return field.to_python(value).quantize(Decimal('0.01'))
+
+
+def _update_balance(user_id, amount, subsidy_amount, require_funds):
+    sql = (
+        f"UPDATE {_user_table()} "
+        "SET available_balance = available_balance + %s, subsidy_balance = subsidy_balance + %s "
+        "WHERE id = %s"
+    )
+    params = [amount, subsidy_amount, user_id]
+    if require_funds:
+        # O débito só acontece se o saldo cobrir o valor (sem saldo negativo)
+        sql += " AND available_balance >= %s"
+        params.append(-amount)
+
+    with connection.cursor() as cursor:
+        if _supports_update_returning():
+            cursor.execute(sql + " RETURNING available_balance, subsidy_balance", params)
+            row = cursor.fetchone()
+            return None if row is None else (_to_decimal(row[0]), _to_decimal(row[1]))
+
+        cursor.execute(sql, params)
+        if cursor.rowcount == 0:
+            return None
+    # Bases sem RETURNING: lê os valores dentro da mesma transação
+    return CustomUser.objects.filter(pk=user_id).values_list('available_balance', 'subsidy_balance').get()
+
+
+def apply(user, entry_type, amount, subsidy_amount=0, require_funds=False):
+    user_id = getattr(user, 'pk', user)
+    amount = Decimal(amount)
+    subsidy_amount = Decimal(subsidy_amount)
+
+    with transaction.atomic():
+        row = _update_balance(user_id, amount, subsidy_amount, require_funds)
+        if row is None:
+            raise InsufficientBalance()
+        new_balance, new_subsidy_balance = row
+        LedgerEntry.objects.create(
+            user_id=user_id,
+            entry_type=entry_type,
+            amount=amount,
+            subsidy_amount=subsidy_amount,
+        )
+        user_cache.invalidate([user_id])
+
+    # Mantém a instância em memória coerente com a base de dados
+    if isinstance(user, CustomUser):
+        user.available_balance = new_balance
+        user.subsidy_balance = new_subsidy_balance
+    return new_balance
+
+
+def credit(user, entry_type, amount, subsidy_amount=0):
+    return apply(user, entry_type, amount, subsidy_amount)
+
+
+def debit(user, entry_type, amount):
+    # Levanta InsufficientBalance se o saldo não cobrir o valor
+    return apply(user, entry_type, -Decimal(amount), require_funds=True)
+
+
+def consume_spin(user, count=1):
+    # Consome `count` giros de uma vez, ou nenhum se não houver giros suficientes
+    user_id = getattr(user, 'pk', user)
+    sql = (
+        f"UPDATE {_user_table()} SET roulette_spins = roulette_spins - %s "
+        "WHERE id = %s AND roulette_spins >= %s"
+    )
+    params = [count, user_id, count]
+    with connection.cursor() as cursor:
+        if _supports_update_returning():
+            cursor.execute(sql + " RETURNING roulette_spins", params)
+            row = cursor.fetchone()
+            remaining = None if row is None else row[0]
+        else:
+            cursor.execute(sql, params)
+            remaining = None
+            if cursor.rowcount:
+                remaining = CustomUser.objects.filter(pk=user_id).values_list('roulette_spins', flat=True).get()
+
+    if remaining is None:
+        raise NoSpinsAvailable()
+    user_cache.invalidate([user_id])
+    if isinstance(user, CustomUser):
+        user.roulette_spins = remaining
+    return remaining
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import ledger
+from .models import CommissionEvent, LedgerEntry, UserLevel
+
+# ---
+# Comissões de patrocinador fora do caminho do pedido. Os views apenas gravam
+# um CommissionEvent (INSERT na mesma transação da tarefa/compra); o worker
+# (process_commissions) aplica os eventos em lote, com um único UPDATE de
+# saldo por patrocinador, e marca-os como processados na mesma transação.
+# O motor diário (core/daily_earnings.py) usa a mesma caixa de saída, em bulk.
+# ---
+
+# Subsídio do patrocinador por tarefa concluída pelo subordinado
+TASK_SUBSIDY_AMOUNT = Decimal('100.00')
+
+
+class ConcurrentProcessing(Exception):
+    # Outro worker processou parte do lote ao mesmo tempo: a transação é desfeita
+    pass
+
+
+def emit(sponsor_id, source_user, kind, amount):
+    return CommissionEvent.objects.create(
+        sponsor_id=sponsor_id,
+        source_user_id=getattr(source_user, 'pk', source_user),
+        kind=kind,
+        amount=amount,
+    )
+
+
+def emit_many(events, batch_size=1000):
+    # Vários eventos (patrocinador, subordinado, tipo, valor) em INSERTs por lote
+    return CommissionEvent.objects.bulk_create(
+        [
+            CommissionEvent(sponsor_id=sponsor_id, source_user_id=source_user_id, kind=kind, amount=amount)
+            for sponsor_id, source_user_id, kind, amount in events
+        ],
+        batch_size=batch_size,
+    )
+
+
+def process_batch(batch_size=1000):
+    with transaction.atomic():
+        events = list(
+            CommissionEvent.objects.filter(status=CommissionEvent.PENDING)
+            .order_by('pk')
+            .select_for_update(skip_locked=True)
+            .values_list('pk', 'sponsor_id', 'amount')[:batch_size]
+        )
+        if not events:
+            return {'events': 0, 'credited': 0, 'skipped': 0, 'sponsors': 0}
+
+        # Elegibilidade: o patrocinador precisa de um nível ativo no momento do crédito
+        sponsor_ids = {sponsor_id for _, sponsor_id, _ in events}
+        eligible = set(
+            UserLevel.objects.filter(user_id__in=sponsor_ids, is_active=True).values_list('user_id', flat=True)
+        )
+
+        credited, skipped = [], []
+        totals = defaultdict(lambda: 0)
+        for pk, sponsor_id, amount in events:
+            if sponsor_id in eligible:
+                credited.append(pk)
+                totals[sponsor_id] += amount
+            else:
+                skipped.append(pk)
+
+        # Marca os eventos apenas se ainda estiverem pendentes: garante que cada
+        # evento é aplicado uma única vez mesmo sem bloqueio de linhas (SQLite)
+        now = timezone.now()
+        marked = CommissionEvent.objects.filter(pk__in=credited, status=CommissionEvent.PENDING).update(
+            status=CommissionEvent.CREDITED, processed_at=now,
+        )
+        marked += CommissionEvent.objects.filter(pk__in=skipped, status=CommissionEvent.PENDING).update(
+            status=CommissionEvent.SKIPPED, processed_at=now,
+        )
+        if marked != len(events):
+            raise ConcurrentProcessing()
+
+        # Um lançamento e um UPDATE de saldo por patrocinador, com a soma dos seus eventos
+        ledger.post_many(
+            ledger.entry(sponsor_id, LedgerEntry.REFERRAL_SUBSIDY, total, total)
+            for sponsor_id, total in totals.items()
+        )
+
+    return {'events': len(events), 'credited': len(credited), 'skipped': len(skipped), 'sponsors': len(totals)}
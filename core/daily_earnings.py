@@ -0,0 +1,138 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from . import commissions, dashboard, ledger, user_cache
+from .dates import day_bounds
+from .models import CommissionEvent, CustomUser, LedgerEntry, Task, UserLevel
+
+# ---
+# Motor diário de ganhos. Percorre os níveis ativos em lotes (paginação por
+# chave), desativa os níveis cujo ciclo terminou e credita o ganho diário com
+# inserts em massa e UPDATEs agrupados. Pode ser executado várias vezes no
+# mesmo dia: quem já tem tarefa nesse dia não recebe de novo. Os subsídios
+# dos patrocinadores vão para a mesma caixa de saída que os cliques
+# (CommissionEvent) e são pagos pelo worker process_commissions.
+# ---
+
+
+def run(chunk_size=5000):
+    # As tarefas são sempre do dia corrente (Task.completed_at usa auto_now_add)
+    day = timezone.localdate()
+    day_start, _ = day_bounds(day)
+    stats = {'levels': 0, 'expired': 0, 'credited': 0, 'skipped': 0, 'subsidies': 0}
+
+    active_levels = UserLevel.objects.filter(is_active=True).order_by('pk').values_list(
+        'pk', 'user_id', 'purchase_date', 'level__daily_gain', 'level__cycle_days', 'user__invited_by_id',
+    )
+    last_pk = 0
+    while True:
+        rows = list(active_levels.filter(pk__gt=last_pk)[:chunk_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        stats['levels'] += len(rows)
+        with transaction.atomic():
+            _process_chunk(rows, day, day_start, stats)
+    return stats
+
+
+def _process_chunk(rows, day, day_start, stats):
+    expired = []
+    # Só o primeiro nível ativo de cada usuário gera ganho (como em process_task)
+    earning = {}
+    for pk, user_id, purchase_date, daily_gain, cycle_days, sponsor_id in rows:
+        if purchase_date + timedelta(days=cycle_days) <= day_start:
+            expired.append((pk, user_id))
+        elif user_id not in earning:
+            earning[user_id] = (daily_gain, sponsor_id)
+
+    if expired:
+        UserLevel.objects.filter(pk__in=[pk for pk, _ in expired]).update(is_active=False)
+        expired_users = {user_id for _, user_id in expired}
+        CustomUser.objects.filter(pk__in=expired_users).exclude(
+            userlevel__is_active=True,
+        ).update(level_active=False)
+        dashboard.refresh_active_levels(expired_users)
+        user_cache.invalidate(expired_users)
+        stats['expired'] += len(expired)
+
+    # Idempotência: ignora quem já tem tarefa neste dia (clique ou execução anterior)
+    done = set(
+        Task.objects.filter(user_id__in=list(earning), task_day=day)
+        .values_list('user_id', flat=True)
+    )
+    stats['skipped'] += len(done)
+    for user_id in done:
+        del earning[user_id]
+    if not earning:
+        return
+
+    # Um clique pode ter ocupado a primeira posição depois da consulta acima:
+    # esse usuário já recebeu pelo clique e sai do lote
+    inserted = _insert_tasks(earning, day)
+    stats['skipped'] += len(earning) - len(inserted)
+    earning = {user_id: earning[user_id] for user_id in inserted}
+    if not earning:
+        return
+
+    ledger.post_many(ledger.entry(user_id, LedgerEntry.TASK_EARNING, gain) for user_id, (gain, _) in earning.items())
+
+    # Subsídio do patrocinador: como em process_task, só regista o evento; o worker
+    # verifica se o patrocinador tem nível ativo e credita em lote
+    events = [
+        (sponsor_id, user_id, CommissionEvent.TASK_SUBSIDY, commissions.TASK_SUBSIDY_AMOUNT)
+        for user_id, (_, sponsor_id) in earning.items() if sponsor_id
+    ]
+    commissions.emit_many(events)
+    stats['subsidies'] += len(events)
+
+    by_gain = defaultdict(list)
+    for user_id, (gain, _) in earning.items():
+        by_gain[gain].append(user_id)
+    for gain, user_ids in by_gain.items():
+        dashboard.record_tasks(user_ids, gain, day)
+    stats['credited'] += len(earning)
+
+
+def _insert_tasks(earning, day):
+    # A tarefa do motor ocupa a primeira posição do dia. Devolve os usuários cuja
+    # tarefa foi mesmo inserida (INSERT ... ON CONFLICT DO NOTHING RETURNING)
+    tasks = [Task(user_id=user_id, earnings=gain, task_day=day, slot=0) for user_id, (gain, _) in earning.items()]
+    if not (connection.vendor == 'postgresql' or connection.features.can_return_columns_from_insert):
+        # Bases sem RETURNING: um savepoint por tarefa. bulk_create não envia o
+        # post_save, e o resumo é atualizado uma só vez por record_tasks (_process_chunk)
+        inserted = set()
+        for task in tasks:
+            try:
+                with transaction.atomic():
+                    Task.objects.bulk_create([task])
+            except IntegrityError:
+                continue
+            inserted.add(task.user_id)
+        return inserted
+
+    now = timezone.now()
+    fields = [Task._meta.get_field(name) for name in ('user', 'earnings', 'completed_at', 'task_day', 'slot')]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    conflict = ', '.join(quote(Task._meta.get_field(name).column) for name in ('user', 'task_day', 'slot'))
+    batch_size = min(1000, (connection.features.max_query_params or 5000) // len(fields))
+    inserted = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start:start + batch_size]
+            params = []
+            for task in batch:
+                task.completed_at = now
+                params.extend(field.get_db_prep_save(getattr(task, field.attname), connection) for field in fields)
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(batch))
+            cursor.execute(
+                f"INSERT INTO {quote(Task._meta.db_table)} ({columns}) VALUES {placeholders} "
+                f"ON CONFLICT ({conflict}) DO NOTHING RETURNING {quote(fields[0].column)}",
+                params,
+            )
+            inserted.update(row[0] for row in cursor.fetchall())
+    return inserted
@@ -0,0 +1,172 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .dates import day_filter
+from .models import CustomUser, Deposit, Task, UserDashboard, UserLevel, Withdrawal
+
+# ---
+# Resumo materializado por usuário para as páginas menu e renda.
+# As alterações feitas pelo ORM chegam pelos sinais em core/signals.py;
+# os serviços que usam queryset.update() chamam add() diretamente.
+# ---
+
+# Saques que contam para o total sacado
+APPROVED_WITHDRAWAL_STATUSES = Withdrawal.APPROVED_STATUSES
+
+ZERO = Decimal('0.00')
+
+
+def _sum(model, field, **filters):
+    # Subconsulta SUM(field) por usuário, correlacionada com CustomUser.pk
+    totals = (
+        model.objects.filter(user=OuterRef('pk'), **filters)
+        .order_by().values('user').annotate(total=Sum(field)).values('total')
+    )
+    return Coalesce(
+        Subquery(totals, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        Value(ZERO),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def _active_level():
+    return Subquery(
+        UserLevel.objects.filter(user=OuterRef('pk'), is_active=True).order_by('pk').values('pk')[:1]
+    )
+
+
+def rebuild(user_ids=None, batch_size=2000):
+    # Recalcula os resumos a partir das tabelas de origem, em lotes (upsert)
+    today = timezone.localdate()
+    users = CustomUser.objects.order_by('pk')
+    if user_ids is not None:
+        users = users.filter(pk__in=list(user_ids))
+    users = users.annotate(
+        active_level_pk=_active_level(),
+        deposits=_sum(Deposit, 'amount', is_approved=True),
+        withdrawals=_sum(Withdrawal, 'amount', status__in=APPROVED_WITHDRAWAL_STATUSES),
+        task_income=_sum(Task, 'earnings'),
+        daily_income=_sum(Task, 'earnings', **day_filter('completed_at', today)),
+    ).values_list('pk', 'active_level_pk', 'deposits', 'withdrawals', 'task_income', 'daily_income')
+
+    rebuilt = 0
+    last_pk = 0
+    while True:
+        rows = list(users.filter(pk__gt=last_pk)[:batch_size])
+        if not rows:
+            break
+        UserDashboard.objects.bulk_create(
+            [
+                UserDashboard(
+                    user_id=pk,
+                    active_level_id=active_level_pk,
+                    approved_deposit_total=deposits,
+                    approved_withdrawal_total=withdrawals,
+                    task_income_total=task_income,
+                    today_income=daily_income,
+                    today_date=today,
+                )
+                for pk, active_level_pk, deposits, withdrawals, task_income, daily_income in rows
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=[
+                'active_level', 'approved_deposit_total', 'approved_withdrawal_total',
+                'task_income_total', 'today_income', 'today_date',
+            ],
+        )
+        rebuilt += len(rows)
+        last_pk = rows[-1][0]
+    return rebuilt
+
+
+def create_empty(user_id):
+    # Resumo de um usuário acabado de criar: ainda não tem movimentos
+    UserDashboard.objects.create(user_id=user_id, today_date=timezone.localdate())
+
+
+def get(user):
+    # Uma única consulta; o resumo de usuários criados em massa (sem sinais) é
+    # criado na primeira visita
+    snapshot = UserDashboard.objects.select_related('active_level__level').filter(user=user).first()
+    if snapshot is None:
+        rebuild([user.pk])
+        snapshot = UserDashboard.objects.select_related('active_level__level').get(user=user)
+    if snapshot.today_date != timezone.localdate():
+        # Ainda não houve tarefas hoje: a renda do dia recomeça em zero
+        snapshot.today_income = ZERO
+    return snapshot
+
+
+def add(user_id, **deltas):
+    # Incrementos com F(): sem ler a linha do resumo
+    changes = {field: F(field) + amount for field, amount in deltas.items()}
+    if not UserDashboard.objects.filter(user_id=user_id).update(**changes):
+        rebuild([user_id])
+
+
+def add_many(field, totals):
+    # {user_id: variação}: usuários com a mesma variação partilham um único UPDATE.
+    # Resumos inexistentes são criados na próxima visita (get()).
+    groups = defaultdict(list)
+    for user_id, amount in totals.items():
+        groups[amount].append(user_id)
+    for amount, user_ids in groups.items():
+        UserDashboard.objects.filter(user_id__in=user_ids).update(**{field: F(field) + amount})
+
+
+def record_tasks(user_ids, earnings, day):
+    # Mesmo ganho para vários usuários: um único UPDATE.
+    # Resumos inexistentes são criados na próxima visita (get()).
+    return UserDashboard.objects.filter(user_id__in=user_ids).update(
+        task_income_total=F('task_income_total') + earnings,
+        # Se o resumo ainda for de outro dia, a renda do dia recomeça com esta tarefa
+        today_income=Case(
+            When(today_date=day, then=F('today_income') + earnings),
+            default=Value(earnings),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        today_date=day,
+    )
+
+
+def record_task(user_id, earnings, completed_at):
+    if not record_tasks([user_id], earnings, timezone.localdate(completed_at)):
+        rebuild([user_id])
+
+
+# Nas remoções (create=False) o resumo em falta não é recriado: o usuário
+# pode estar a ser apagado em cascata.
+
+def refresh_deposits(user_id, create=True):
+    total = Deposit.objects.filter(user_id=user_id, is_approved=True).aggregate(total=Sum('amount'))['total'] or ZERO
+    if not UserDashboard.objects.filter(user_id=user_id).update(approved_deposit_total=total) and create:
+        rebuild([user_id])
+
+
+def refresh_withdrawals(user_id, create=True):
+    total = Withdrawal.objects.filter(
+        user_id=user_id, status__in=APPROVED_WITHDRAWAL_STATUSES,
+    ).aggregate(total=Sum('amount'))['total'] or ZERO
+    if not UserDashboard.objects.filter(user_id=user_id).update(approved_withdrawal_total=total) and create:
+        rebuild([user_id])
+
+
+def refresh_active_level(user_id, create=True):
+    active_level_id = (
+        UserLevel.objects.filter(user_id=user_id, is_active=True).order_by('pk').values_list('pk', flat=True).first()
+    )
+    if not UserDashboard.objects.filter(user_id=user_id).update(active_level_id=active_level_id) and create:
+        rebuild([user_id])
+
+
+def refresh_active_levels(user_ids):
+    UserDashboard.objects.filter(user_id__in=user_ids).update(
+        active_level=Subquery(
+            UserLevel.objects.filter(user=OuterRef('user_id'), is_active=True).order_by('pk').values('pk')[:1]
+        )
+    )
@@ -0,0 +1,23 @@
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+# ---
+# Intervalos de datas para filtros. Em vez de campo__date=dia (que aplica uma
+# função à coluna e impede o uso de índices), filtra-se por um intervalo
+# semiaberto [início do dia, início do dia seguinte) no fuso local.
+# ---
+
+
+def day_bounds(day=None):
+    if day is None:
+        day = timezone.localdate()
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
+
+
+def day_filter(field, day=None):
+    # Ex.: Task.objects.filter(user=user, **day_filter('completed_at'))
+    start, end = day_bounds(day)
+    return {f'{field}__gte': start, f'{field}__lt': end}
@@ -0,0 +1,53 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+
+from . import dashboard, ledger
+from .models import Deposit, LedgerEntry
+
+# ---
+# Aprovação de depósitos em lote (ação do admin e comando approve_deposits).
+# Tudo numa transação: os depósitos pendentes são bloqueados com
+# SELECT ... FOR UPDATE SKIP LOCKED (os que outro processo está a aprovar
+# ficam de fora, sem espera), marcados como aprovados com um UPDATE, e os
+# saldos creditados pelo livro-razão (bulk_create dos lançamentos + no máximo
+# um UPDATE por usuário). Depósitos já aprovados são ignorados, por isso
+# repetir a operação não credita duas vezes.
+# ---
+
+BATCH_SIZE = 1000
+
+
+def approve(deposit_ids, batch_size=BATCH_SIZE):
+    deposit_ids = sorted(set(deposit_ids))
+    stats = {'requested': len(deposit_ids), 'approved': 0, 'users': 0, 'amount': Decimal('0.00')}
+    if not deposit_ids:
+        return stats
+
+    with transaction.atomic():
+        pending = []
+        for start in range(0, len(deposit_ids), batch_size):
+            pending += (
+                Deposit.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=deposit_ids[start:start + batch_size], is_approved=False)
+                .order_by('pk')
+                .values_list('pk', 'user_id', 'amount')
+            )
+        if not pending:
+            return stats
+
+        for start in range(0, len(pending), batch_size):
+            Deposit.objects.filter(
+                pk__in=[pk for pk, _, _ in pending[start:start + batch_size]],
+            ).update(is_approved=True)
+
+        totals = defaultdict(Decimal)
+        for _, user_id, amount in pending:
+            totals[user_id] += amount
+        # Um lançamento por depósito; o saldo recebe a soma de cada usuário
+        ledger.post_many([ledger.entry(user_id, LedgerEntry.DEPOSIT, amount) for _, user_id, amount in pending])
+        dashboard.add_many('approved_deposit_total', totals)
+
+    stats.update(approved=len(pending), users=len(totals), amount=sum(totals.values(), Decimal('0.00')))
+    return stats
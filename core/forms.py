@@ -1,5 +1,7 @@
 from django import forms
+from django.contrib.auth.forms import AuthenticationForm
 from .models import CustomUser, Deposit, BankDetails
+from . import images, throttling
 
 class RegisterForm(forms.ModelForm):
     password = forms.CharField(label="Senha", widget=forms.PasswordInput)
@@ -37,6 +39,26 @@ class RegisterForm(forms.ModelForm):
             user.save()
         return user
 
+class LoginForm(AuthenticationForm):
+    error_messages = {
+        **AuthenticationForm.error_messages,
+        'throttled': "Demasiadas tentativas falhadas. Aguarde alguns minutos e tente novamente.",
+    }
+
+    # Conta a tentativa antes de autenticar (acima do limite, sem calcular o hash da senha)
+    def clean(self):
+        phone = self.cleaned_data.get('username', '')
+        ip = throttling.client_ip(self.request) if self.request else ''
+        if not throttling.start_login_attempt(phone, ip):
+            raise forms.ValidationError(self.error_messages['throttled'], code='throttled')
+        succeeded = False
+        try:
+            cleaned_data = super().clean()
+            succeeded = True
+        finally:
+            throttling.finish_login_attempt(phone, ip, succeeded)
+        return cleaned_data
+
 class DepositForm(forms.ModelForm):
     amount = forms.DecimalField(max_digits=10, decimal_places=2, label="Valor do Depósito")
     proof_of_payment = forms.ImageField(label="Comprovativo de Pagamento")
@@ -45,6 +67,14 @@ class DepositForm(forms.ModelForm):
         model = Deposit
         fields = ['amount', 'proof_of_payment']
 
+    def save(self, commit=True):
+        # O comprovativo é gravado já comprimido, sem metadados, com a miniatura ao lado
+        deposit = super().save(commit=False)
+        deposit.proof_of_payment, deposit.proof_thumbnail = images.compress_proof(self.cleaned_data['proof_of_payment'])
+        if commit:
+            deposit.save()
+        return deposit
+
 class WithdrawalForm(forms.Form):
     amount = forms.DecimalField(max_digits=10, decimal_places=2, label="Valor a Sacar")
 
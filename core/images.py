@@ -0,0 +1,72 @@
+import io
+import math
+import uuid
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+# ---
+# Processamento dos comprovativos de depósito. A imagem enviada é
+# descodificada uma única vez (JPEG já em escala reduzida), a orientação
+# EXIF é aplicada e todos os metadados descartados, e o resultado é gravado
+# em WebP (ou JPEG, se o Pillow não tiver WebP) junto com uma miniatura.
+# ---
+
+PROOF_MAX_SIZE = (1600, 1600)
+THUMBNAIL_SIZE = (320, 320)
+PROOF_QUALITY = 80
+THUMBNAIL_QUALITY = 70
+# Esforço do codificador WebP (0-6): o 0 é ~3x mais rápido que o padrão (4)
+# com ficheiros praticamente do mesmo tamanho numa foto de 12 MP
+WEBP_METHOD = 0
+
+
+def output_format():
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def _decode(upload):
+    upload.seek(0)
+    image = Image.open(upload)
+    # Para JPEG, o descodificador reduz a escala (1/2, 1/4, 1/8) em vez de ler a
+    # imagem inteira. O draft usa a menor escala dos dois eixos, por isso recebe
+    # o tamanho final (lado maior = 1600) e não a caixa 1600x1600, que numa foto
+    # 4:3 de 12 MP obrigaria a descodificá-la por inteiro.
+    width, height = image.size
+    ratio = max(width / PROOF_MAX_SIZE[0], height / PROOF_MAX_SIZE[1], 1)
+    image.draft('RGB', (math.ceil(width / ratio), math.ceil(height / ratio)))
+    # in_place: sem uma segunda cópia da imagem descodificada
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # Fundo branco para as transparências (JPEG não as suporta)
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+        return background
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+def _encode(image, size, quality, name):
+    # Reduz a própria imagem (sem cópia), por isso a maior vem primeiro
+    image.thumbnail(size, Image.LANCZOS, reducing_gap=3.0)
+    pil_format, extension = output_format()
+    buffer = io.BytesIO()
+    # Sem exif=...: nenhum metadado da imagem original é gravado
+    image.save(buffer, pil_format, quality=quality, optimize=True, **({'method': WEBP_METHOD} if pil_format == 'WEBP' else {}))
+    return ContentFile(buffer.getvalue(), name=f'{name}.{extension}')
+
+
+def compress_proof(upload):
+    # Devolve (comprovativo, miniatura) prontos a atribuir aos ImageField
+    image = _decode(upload)
+    name = uuid.uuid4().hex
+    return (
+        _encode(image, PROOF_MAX_SIZE, PROOF_QUALITY, name),
+        _encode(image, THUMBNAIL_SIZE, THUMBNAIL_QUALITY, f'{name}_thumb'),
+    )
+
+
+def thumbnail_from(stored_file):
+    # Miniatura de um comprovativo já gravado (depósitos anteriores a este processamento)
+    with stored_file.open('rb') as handle:
+        image = _decode(handle)
+    return _encode(image, THUMBNAIL_SIZE, THUMBNAIL_QUALITY, f'{uuid.uuid4().hex}_thumb')
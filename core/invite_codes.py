@@ -0,0 +1,101 @@
+import threading
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import InviteCodeSequence
+
+# ---
+# Códigos de convite sem consulta de colisão.
+# Cada código é um número de uma sequência global passado por uma permutação
+# de 40 bits (rede de Feistel, bijetiva) e escrito em 8 caracteres base-32
+# (alfabeto de Crockford). Números diferentes dão sempre códigos diferentes e
+# consecutivos não parecem consecutivos. Cada processo reserva blocos da
+# sequência com um único UPDATE; a restrição unique de invite_code é a única
+# rede de segurança (por ex. contra os códigos hexadecimais antigos).
+# ---
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_LENGTH = 8
+BITS = 5 * CODE_LENGTH
+HALF_BITS = BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+
+# Chaves fixas das rondas: mudá-las altera todos os códigos futuros e pode colidir com os já emitidos
+ROUND_KEYS = (0x5DEEC, 0x3C6EF, 0xA54FF, 0x1F83D)
+
+BLOCK_SIZE = 1000
+
+
+def _round(value, key):
+    return ((value * 0x9E3779B1 + key) ^ (value >> 7)) & HALF_MASK
+
+
+def permute(number):
+    left, right = number >> HALF_BITS, number & HALF_MASK
+    for key in ROUND_KEYS:
+        left, right = right, left ^ _round(right, key)
+    return (left << HALF_BITS) | right
+
+
+def encode(number):
+    value = permute(number)
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def reserve(count):
+    # Reserva [início, início + count) na sequência global (linha bloqueada até ao commit)
+    with transaction.atomic():
+        if not InviteCodeSequence.objects.filter(pk=1).update(next_value=F('next_value') + count):
+            InviteCodeSequence.objects.get_or_create(pk=1)
+            InviteCodeSequence.objects.filter(pk=1).update(next_value=F('next_value') + count)
+        end = InviteCodeSequence.objects.values_list('next_value', flat=True).get(pk=1)
+    if end > 1 << BITS:
+        raise OverflowError('Sequência de códigos de convite esgotada.')
+    return range(end - count, end)
+
+
+def allocate(count):
+    # Para inserções em massa: uma única reserva para todos os códigos
+    return [encode(number) for number in reserve(count)]
+
+
+def assign(users):
+    # Preenche invite_code de instâncias ainda não gravadas (para bulk_create)
+    pending = [user for user in users if not user.invite_code]
+    for user, code in zip(pending, allocate(len(pending))):
+        user.invite_code = code
+    return users
+
+
+class _Block:
+    def __init__(self, numbers, confirmed):
+        self.numbers = iter(numbers)
+        # Um bloco reservado dentro de uma transação só é reutilizado depois do
+        # commit: se houver rollback, outro processo pode voltar a reservá-lo.
+        self.confirmed = confirmed
+
+    def confirm(self):
+        self.confirmed = True
+
+
+_lock = threading.Lock()
+_block = None
+
+
+def next_code():
+    global _block
+    with _lock:
+        if _block is not None and _block.confirmed:
+            number = next(_block.numbers, None)
+            if number is not None:
+                return encode(number)
+        in_transaction = transaction.get_connection().in_atomic_block
+        _block = _Block(reserve(BLOCK_SIZE), confirmed=not in_transaction)
+        if in_transaction:
+            transaction.on_commit(_block.confirm)
+        return encode(next(_block.numbers))
@@ -0,0 +1,68 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from . import user_cache
+from .models import CustomUser, LedgerEntry
+
+# ---
+# Livro-razão (append-only) de todos os movimentos de saldo.
+# Os saldos em CustomUser são apenas uma projeção materializada destes
+# movimentos, atualizada com expressões F() (sem ler/regravar a linha inteira).
+# ---
+
+# Quantos IDs de usuário vão em cada UPDATE ... WHERE id IN (...)
+UPDATE_BATCH_SIZE = 1000
+
+
+def entry(user, entry_type, amount, subsidy_amount=0):
+    # Aceita tanto uma instância de usuário como o seu ID
+    user_id = getattr(user, 'pk', user)
+    return LedgerEntry(
+        user_id=user_id,
+        entry_type=entry_type,
+        amount=Decimal(amount),
+        subsidy_amount=Decimal(subsidy_amount),
+    )
+
+
+def post(user, entry_type, amount, subsidy_amount=0):
+    post_many([entry(user, entry_type, amount, subsidy_amount)])
+
+
+def post_many(entries, batch_size=1000):
+    entries = list(entries)
+    if not entries:
+        return
+
+    # Soma as variações por usuário antes de tocar na tabela de usuários
+    totals = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+    for item in entries:
+        totals[item.user_id][0] += item.amount
+        totals[item.user_id][1] += item.subsidy_amount
+
+    with transaction.atomic():
+        LedgerEntry.objects.bulk_create(entries, batch_size=batch_size)
+        apply_totals(totals)
+
+
+def apply_totals(totals):
+    # Usuários com a mesma variação partilham um único UPDATE
+    groups = defaultdict(list)
+    for user_id, (amount, subsidy_amount) in totals.items():
+        groups[(amount, subsidy_amount)].append(user_id)
+
+    for (amount, subsidy_amount), user_ids in groups.items():
+        changes = {}
+        if amount:
+            changes['available_balance'] = F('available_balance') + amount
+        if subsidy_amount:
+            changes['subsidy_balance'] = F('subsidy_balance') + subsidy_amount
+        if not changes:
+            continue
+        for start in range(0, len(user_ids), UPDATE_BATCH_SIZE):
+            CustomUser.objects.filter(id__in=user_ids[start:start + UPDATE_BATCH_SIZE]).update(**changes)
+    user_cache.invalidate(totals)
+
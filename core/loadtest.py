@@ -0,0 +1,256 @@
+import random
+import re
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.messages import constants as message_levels
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.db import connection
+from django.http import HttpRequest
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import balances, invite_codes, ledger, user_cache
+from .bench import summarize
+from .models import BankDetails, CustomUser, Deposit, LedgerEntry, Level, Task, UserLevel
+
+# ---
+# Teste de carga dos fluxos principais. Os dados sintéticos usam um prefixo
+# próprio nos números de telefone e são apagados no fim (cleanup()).
+# ---
+
+FLOW_PASSWORD = 'LoadTest-2025!'
+WITHDRAWAL_AMOUNT = Decimal('2500')
+SEED_BALANCE = Decimal('10000.00')
+
+# Resposta de um passo bem-sucedido: (status, rota do redirect). As falhas de
+# validação dos formulários também redirecionam, por isso esses passos têm de
+# trazer uma mensagem de sucesso; as ações JSON têm de devolver success
+EXPECTED = {
+    'cadastro': (302, 'menu'),
+    'login': (302, 'menu'),
+    'menu': (200, None),
+    'nivel': (302, 'nivel'),
+    'tarefa': (200, None),
+    'process_task': (200, None),
+    'spin_roulette': (200, None),
+    'saque': (302, 'saque'),
+}
+SUCCESS_MESSAGE_STEPS = ('cadastro', 'nivel', 'saque')
+JSON_STEPS = ('process_task', 'spin_roulette')
+
+
+class Dataset:
+    def __init__(self, prefix, level, user_ids):
+        self.prefix = prefix
+        self.level = level
+        self.user_ids = user_ids
+
+
+def seed(users=1000, fanout=5, invested_ratio=0.5, deposits_per_user=1, tasks_per_user=5, seed=1, batch_size=2000):
+    rng = random.Random(seed)
+    prefix = f'lt{uuid.uuid4().hex[:6]}'
+    # Nível barato: os usuários criados pelo fluxo conseguem comprá-lo com o bônus de cadastro
+    level = Level.objects.create(
+        name=f'Carga {prefix}', deposit_value=Decimal('500.00'), daily_gain=Decimal('50.00'),
+        monthly_gain=Decimal('1500.00'), cycle_days=30, image='level_images/loadtest.png',
+    )
+    password = make_password(FLOW_PASSWORD)
+
+    # Árvore de indicações: cada usuário é convidado por um dos anteriores
+    user_ids = []
+    for start in range(0, users, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, users)):
+            sponsor_id = rng.choice(user_ids[-fanout * 50:]) if user_ids and index % (fanout + 1) else None
+            batch.append(CustomUser(
+                phone_number=f'{prefix}{index:09d}', password=password, invited_by_id=sponsor_id,
+            ))
+        user_ids.extend(user.pk for user in CustomUser.objects.bulk_create(invite_codes.assign(batch)))
+    # Saldo inicial pelo livro-razão (um UPDATE por lote de usuários)
+    ledger.post_many(
+        (ledger.entry(user_id, LedgerEntry.ADJUSTMENT, SEED_BALANCE) for user_id in user_ids), batch_size=batch_size,
+    )
+
+    invested = [user_id for user_id in user_ids if rng.random() < invested_ratio]
+    UserLevel.objects.bulk_create([UserLevel(user_id=user_id, level=level) for user_id in invested], batch_size=batch_size)
+    CustomUser.objects.filter(pk__in=invested).update(level_active=True)
+    Deposit.objects.bulk_create(
+        [
+            Deposit(user_id=user_id, amount=level.deposit_value, proof_of_payment='deposit_proofs/loadtest.png', is_approved=True)
+            for user_id in user_ids for _ in range(deposits_per_user)
+        ],
+        batch_size=batch_size,
+    )
+    Task.objects.bulk_create(
+        [Task(user_id=user_id, earnings=level.daily_gain, slot=slot) for user_id in invested for slot in range(tasks_per_user)],
+        batch_size=batch_size,
+    )
+    return Dataset(prefix, level, user_ids)
+
+
+def cleanup(dataset):
+    CustomUser.objects.filter(phone_number__startswith=dataset.prefix).delete()
+    dataset.level.delete()
+
+
+def flow_steps(dataset, index):
+    # (nome, método, rota, dados) de um usuário virtual: cadastro -> ... -> saque
+    phone = f'{dataset.prefix}f{index:08d}'
+    sponsor = CustomUser.objects.filter(pk=dataset.user_ids[index % len(dataset.user_ids)]).values_list('invite_code', flat=True).first()
+    return phone, [
+        ('cadastro', 'post', 'cadastro', {
+            'phone_number': phone, 'password': FLOW_PASSWORD, 'confirm_password': FLOW_PASSWORD,
+            'invited_by_code': sponsor or '',
+        }),
+        ('login', 'post', 'login', {'username': phone, 'password': FLOW_PASSWORD}),
+        ('menu', 'get', 'menu', None),
+        ('nivel', 'post', 'nivel', {'level_id': dataset.level.pk}),
+        ('tarefa', 'get', 'tarefa', None),
+        ('process_task', 'post', 'process_task', None),
+        ('spin_roulette', 'post', 'spin_roulette', None),
+        ('saque', 'post', 'saque', {'amount': str(WITHDRAWAL_AMOUNT)}),
+    ]
+
+
+def _grant_spin(phone):
+    # Preparação fora da medição: o usuário recém-criado ainda não tem giros
+    CustomUser.objects.filter(phone_number=phone).update(roulette_spins=1)
+    user_cache.invalidate(CustomUser.objects.filter(phone_number=phone).values_list('pk', flat=True))
+
+
+def _prepare_withdrawal(phone):
+    # Preparação fora da medição: coordenadas bancárias e saldo para o saque mínimo
+    user_id = CustomUser.objects.filter(phone_number=phone).values_list('pk', flat=True).get()
+    BankDetails.objects.get_or_create(
+        user_id=user_id, defaults={'bank_name': 'BAI', 'IBAN': 'AO06', 'account_holder_name': phone},
+    )
+    balances.credit(user_id, LedgerEntry.ADJUSTMENT, WITHDRAWAL_AMOUNT)
+
+
+def _prepare(name, phone):
+    if name == 'spin_roulette':
+        _grant_spin(phone)
+    elif name == 'saque':
+        _prepare_withdrawal(phone)
+
+
+def _has_success_message(cookie):
+    # Mensagens deixadas pelo redirect, lidas do cookie do armazenamento de mensagens
+    request = HttpRequest()
+    if cookie:
+        request.COOKIES[CookieStorage.cookie_name] = cookie
+    return any(message.level == message_levels.SUCCESS for message in CookieStorage(request))
+
+
+def succeeded(name, status, location, messages_cookie, payload):
+    # Um status < 400 não chega: o saque recusado, por exemplo, também redireciona
+    expected_status, target = EXPECTED[name]
+    if status != expected_status:
+        return False
+    if target and urlsplit(location or '').path != reverse(target):
+        return False
+    if name in SUCCESS_MESSAGE_STEPS and not _has_success_message(messages_cookie):
+        return False
+    return name not in JSON_STEPS or bool((payload or {}).get('success'))
+
+
+def _payload(response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def run_client(dataset, flows):
+    # Usa o cliente de testes do Django (no mesmo processo): mede latência e consultas por pedido
+    from django.test import Client
+
+    latencies = defaultdict(list)
+    queries = defaultdict(list)
+    errors = defaultdict(int)
+    started = time.perf_counter()
+    for index in range(flows):
+        client = Client()
+        phone, steps = flow_steps(dataset, index)
+        for name, method, route, data in steps:
+            _prepare(name, phone)
+            with CaptureQueriesContext(connection) as captured:
+                step_started = time.perf_counter()
+                response = getattr(client, method)(reverse(route), data or {})
+                latencies[name].append(time.perf_counter() - step_started)
+            queries[name].append(len(captured))
+            cookie = response.cookies.get(CookieStorage.cookie_name)
+            errors[name] += not succeeded(
+                name, response.status_code, response.get('Location'), cookie and cookie.value,
+                _payload(response) if name in JSON_STEPS else None,
+            )
+    return _report(latencies, queries, errors, time.perf_counter() - started)
+
+
+def run_http(dataset, flows, base_url, concurrency, start=0):
+    # Cliente HTTP real contra um servidor já em execução (ex.: gunicorn multi-processo).
+    # start desloca os índices dos fluxos: duas rodadas no mesmo dataset não repetem telefones
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    def run_flow(index):
+        session = requests.Session()
+        phone, steps = flow_steps(dataset, index)
+        timings = []
+        for name, method, route, data in steps:
+            _prepare(name, phone)
+            url = base_url + reverse(route)
+            token = _csrf_token(session, base_url + reverse('login'))
+            step_started = time.perf_counter()
+            response = session.request(
+                method.upper(), url, data={**(data or {}), 'csrfmiddlewaretoken': token},
+                headers={'X-CSRFToken': token, 'Referer': url}, allow_redirects=False,
+            )
+            elapsed = time.perf_counter() - step_started
+            failed = not succeeded(
+                name, response.status_code, response.headers.get('Location'),
+                response.cookies.get(CookieStorage.cookie_name), _payload(response) if name in JSON_STEPS else None,
+            )
+            timings.append((name, elapsed, failed))
+        connection.close()
+        return timings
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for timings in pool.map(run_flow, range(start, start + flows)):
+            for name, latency, failed in timings:
+                latencies[name].append(latency)
+                errors[name] += failed
+    return _report(latencies, None, errors, time.perf_counter() - started)
+
+
+def _csrf_token(session, login_url):
+    token = session.cookies.get('csrftoken')
+    if token:
+        return token
+    response = session.get(login_url)
+    token = session.cookies.get('csrftoken')
+    if token:
+        return token
+    match = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.text)
+    return match.group(1) if match else ''
+
+
+def _report(latencies, queries, errors, elapsed):
+    steps = {}
+    for name, values in latencies.items():
+        steps[name] = summarize(values, sum(values))
+        steps[name]['errors'] = errors[name]
+        if queries is not None:
+            steps[name]['queries_per_request'] = round(sum(queries[name]) / len(queries[name]), 2)
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {'overall': summarize(all_latencies, elapsed), 'steps': steps}
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import deposits
+from core.models import Deposit
+
+
+class Command(BaseCommand):
+    help = (
+        "Aprova depósitos pendentes em lote e credita os saldos. "
+        "Depósitos já aprovados são ignorados, por isso pode ser repetido."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('deposit_ids', nargs='*', type=int, help="IDs dos depósitos a aprovar.")
+        parser.add_argument('--all-pending', action='store_true', help="Aprova todos os depósitos pendentes.")
+        parser.add_argument('--batch-size', type=int, default=deposits.BATCH_SIZE, help="Depósitos por transação com --all-pending.")
+
+    def handle(self, *args, **options):
+        if bool(options['deposit_ids']) == options['all_pending']:
+            raise CommandError("Indique os IDs dos depósitos ou --all-pending (não ambos).")
+
+        if options['deposit_ids']:
+            batches = [options['deposit_ids']]
+        else:
+            batches = self._pending_batches(options['batch_size'])
+
+        approved = amount = 0
+        for batch in batches:
+            stats = deposits.approve(batch, batch_size=options['batch_size'])
+            approved += stats['approved']
+            amount += stats['amount']
+        self.stdout.write(self.style.SUCCESS(f"{approved} depósitos aprovados, {amount} KZ creditados."))
+
+    def _pending_batches(self, batch_size):
+        # Um lote por transação, por ordem de chegada
+        last_pk = 0
+        while True:
+            batch = list(
+                Deposit.objects.filter(is_approved=False, pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                return
+            last_pk = batch[-1]
+            yield batch
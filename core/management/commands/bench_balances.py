@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core import balances
+from core.bench import summarize
+from core.models import CustomUser, LedgerEntry
+
+
+class Command(BaseCommand):
+    help = "Benchmark de concorrência do serviço de saldos: N giradores simultâneos na mesma conta."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spinners', type=int, default=50)
+        parser.add_argument('--spins', type=int, default=20, help="Tentativas de giro por girador.")
+        parser.add_argument('--prize', type=Decimal, default=Decimal('100.00'))
+        parser.add_argument('--json', action='store_true', help="Emite apenas o relatório em JSON.")
+
+    def handle(self, *args, **options):
+        spinners = options['spinners']
+        attempts = spinners * options['spins']
+        prize = options['prize']
+        # Só metade das tentativas tem giro disponível: o excesso tem de falhar
+        available_spins = attempts // 2
+
+        user = CustomUser.objects.create_user(f"bench-{uuid.uuid4().hex[:12]}", None)
+        CustomUser.objects.filter(pk=user.pk).update(roulette_spins=available_spins)
+
+        latencies = []
+        outcomes = {'granted': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(spinners)
+
+        def spinner():
+            local_latencies = []
+            local = {'granted': 0, 'rejected': 0, 'errors': 0}
+            start_barrier.wait()
+            try:
+                for _ in range(options['spins']):
+                    started = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            balances.consume_spin(user.pk)
+                            balances.credit(user.pk, LedgerEntry.ROULETTE_PRIZE, prize, prize)
+                        local['granted'] += 1
+                    except balances.NoSpinsAvailable:
+                        local['rejected'] += 1
+                    except Exception:
+                        local['errors'] += 1
+                    local_latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                for key, value in local.items():
+                    outcomes[key] += value
+
+        threads = [threading.Thread(target=spinner) for _ in range(spinners)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        user.refresh_from_db()
+        ledger_count = LedgerEntry.objects.filter(user=user).count()
+        expected_balance = prize * outcomes['granted']
+        report = {
+            'benchmark': 'balances.spin',
+            'vendor': connection.vendor,
+            'spinners': spinners,
+            'attempts': attempts,
+            'available_spins': available_spins,
+            **outcomes,
+            'final_balance': str(user.available_balance),
+            'expected_balance': str(expected_balance),
+            'correct': (
+                user.available_balance == expected_balance
+                and user.roulette_spins == available_spins - outcomes['granted']
+                and user.roulette_spins >= 0
+                and ledger_count == outcomes['granted']
+            ),
+            **summarize(latencies, elapsed),
+        }
+        user.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+        for key, value in report.items():
+            self.stdout.write(f"{key}: {value}")
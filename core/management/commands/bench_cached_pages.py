@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+
+from core.bench import summarize
+from core.models import CustomUser
+
+PAGES = ('sobre', 'roleta', 'nivel')
+
+CONFIGURATIONS = {
+    'db': {'SESSION_ENGINE': 'django.contrib.sessions.backends.db', 'USER_CACHE_TIMEOUT': 0},
+    'cached': {'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db', 'USER_CACHE_TIMEOUT': 300},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara, com o cliente de testes, as páginas sobre/roleta/nivel com sessões e usuário lidos "
+        "da base de dados e do cache. Corre numa transação revertida no fim."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Pedidos por página.")
+        parser.add_argument('--json', action='store_true', help="Emite apenas o relatório em JSON.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        report = {'benchmark': 'cached_pages', 'configurations': {}}
+        for name, overrides in CONFIGURATIONS.items():
+            with override_settings(**overrides):
+                report['configurations'][name] = self._bench(options['requests'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+        for name, pages in report['configurations'].items():
+            for page, result in pages.items():
+                self.stdout.write(f"{name} {page}: {result}")
+
+    def _bench(self, requests):
+        results = {}
+        with transaction.atomic():
+            user = CustomUser.objects.create_user('bench-cached-pages', 'Bench-Pages-2025!')
+            client = Client()
+            client.force_login(user)
+            for page in PAGES:
+                url = reverse(page)
+                client.get(url)  # aquece o cache
+                latencies, queries = [], 0
+                started = time.perf_counter()
+                for _ in range(requests):
+                    with CaptureQueriesContext(connection) as captured:
+                        request_started = time.perf_counter()
+                        client.get(url)
+                        latencies.append(time.perf_counter() - request_started)
+                    queries += len(captured)
+                results[page] = summarize(latencies, time.perf_counter() - started)
+                results[page]['queries_per_request'] = queries / requests
+            transaction.set_rollback(True)
+        cache.clear()
+        return results
@@ -0,0 +1,90 @@
+import importlib.util
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from core import throttling
+from core.bench import summarize
+from core.models import CustomUser
+
+PASSWORD = 'Bench-Login-2025!'
+
+
+class Command(BaseCommand):
+    help = (
+        "Logins por segundo (num só processo, ou seja, por núcleo) com cada nível de algoritmo de senha, "
+        "e tentativas recusadas pelo limite de falhas. Corre numa transação revertida no fim."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tiers', default=','.join(settings.PASSWORD_HASHER_TIERS),
+            help="Níveis a comparar (de PASSWORD_HASHER_TIERS); argon2 é ignorado sem argon2-cffi.",
+        )
+        parser.add_argument('--logins', type=int, default=20)
+        parser.add_argument('--json', action='store_true', help="Emite apenas o relatório em JSON.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        report = {'benchmark': 'login', 'tiers': {}}
+        for tier in options['tiers'].split(','):
+            if tier not in settings.PASSWORD_HASHER_TIERS:
+                raise CommandError(f"Nível desconhecido: {tier}")
+            if tier == 'argon2' and importlib.util.find_spec('argon2') is None:
+                report['tiers'][tier] = 'argon2-cffi não instalado'
+                continue
+            with override_settings(PASSWORD_HASHERS=[settings.PASSWORD_HASHER_TIERS[tier]]):
+                report['tiers'][tier] = self._bench_tier(tier, options['logins'])
+        report['throttled'] = self._bench_throttled(options['logins'] * 10)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+        for key, value in report['tiers'].items():
+            self.stdout.write(f"{key}: {value}")
+        self.stdout.write(f"throttled: {report['throttled']}")
+
+    def _bench_tier(self, tier, logins):
+        phone = f'bench-{tier}'
+        with transaction.atomic():
+            CustomUser.objects.create_user(phone, PASSWORD)
+            client = Client()
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(logins):
+                login_started = time.perf_counter()
+                response = client.post(reverse('login'), {'username': phone, 'password': PASSWORD})
+                latencies.append(time.perf_counter() - login_started)
+                if response.status_code != 302:
+                    raise CommandError(f"Login falhou com {tier}.")
+                client.logout()
+            result = summarize(latencies, time.perf_counter() - started)
+            transaction.set_rollback(True)
+        result['algorithm'] = get_hasher().algorithm
+        return result
+
+    def _bench_throttled(self, attempts):
+        # Tentativas recusadas antes do hash, depois de esgotado o limite por telefone
+        phone = 'bench-throttled'
+        client = Client()
+        with transaction.atomic():
+            CustomUser.objects.create_user(phone, PASSWORD)
+            for _ in range(settings.LOGIN_MAX_FAILURES_PER_PHONE):
+                client.post(reverse('login'), {'username': phone, 'password': 'errada'})
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(attempts):
+                attempt_started = time.perf_counter()
+                client.post(reverse('login'), {'username': phone, 'password': 'errada'})
+                latencies.append(time.perf_counter() - attempt_started)
+            result = summarize(latencies, time.perf_counter() - started)
+            transaction.set_rollback(True)
+        throttling.reset_login_failures(phone)
+        return result
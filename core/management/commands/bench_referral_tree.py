@@ -0,0 +1,78 @@
+import json
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import referrals
+from core.bench import summarize
+from core.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark da árvore de indicações numa árvore sintética. Tudo corre numa transação "
+        "revertida no fim; use apenas numa base de desenvolvimento."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help="Tamanho da árvore (ex.: 1000000).")
+        parser.add_argument('--fanout', type=int, default=5, help="Convidados diretos por usuário.")
+        parser.add_argument('--depth', type=int, default=5, help="Profundidade das consultas de descendentes.")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true', help="Emite apenas o relatório em JSON.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        report = {'benchmark': 'referrals.closure', 'users': options['users'], 'fanout': options['fanout']}
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            ids = self._seed_tree(options['users'], options['fanout'])
+            report['seed_s'] = round(time.perf_counter() - started, 2)
+
+            started = time.perf_counter()
+            report['paths'] = referrals.rebuild()
+            report['rebuild_s'] = round(time.perf_counter() - started, 2)
+
+            # Consultas: raiz (a maior subárvore) e nós aleatórios
+            samples = [ids[0]] + [rng.choice(ids) for _ in range(options['queries'] - 1)]
+            latencies = []
+            started = time.perf_counter()
+            for user_id in samples:
+                query_started = time.perf_counter()
+                referrals.descendant_counts(user_id, options['depth'])
+                latencies.append(time.perf_counter() - query_started)
+            report['descendant_counts'] = summarize(latencies, time.perf_counter() - started)
+            report['root_counts'] = referrals.descendant_counts(ids[0], options['depth'])
+
+            transaction.set_rollback(True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+        for key, value in report.items():
+            self.stdout.write(f"{key}: {value}")
+
+    def _seed_tree(self, count, fanout, batch_size=5000):
+        # Árvore completa: o usuário i é convidado pelo usuário (i - 1) // fanout.
+        # Cada lote termina antes do primeiro usuário cujo patrocinador ainda não foi gravado.
+        password = make_password(None)
+        ids = []
+        start = 0
+        while start < count:
+            end = min(start + batch_size, count, start * fanout + 1)
+            created = CustomUser.objects.bulk_create([
+                CustomUser(
+                    phone_number=f'bench{index:012d}',
+                    password=password,
+                    invited_by_id=ids[(index - 1) // fanout] if index else None,
+                )
+                for index in range(start, end)
+            ])
+            ids.extend(user.pk for user in created)
+            start = end
+        return ids
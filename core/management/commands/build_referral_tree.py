@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import referrals
+
+
+class Command(BaseCommand):
+    help = "Reconstrói em massa a árvore de indicações (tabela de fecho) a partir de invited_by."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-depth', type=int, default=referrals.MAX_DEPTH)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = referrals.rebuild(max_depth=options['max_depth'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"{total} caminhos gravados em {elapsed:.2f}s."))
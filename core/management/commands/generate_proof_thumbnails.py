@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from core import images
+from core.models import Deposit
+
+
+class Command(BaseCommand):
+    help = "Gera as miniaturas dos comprovativos de depósito que ainda não as têm."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        pending = Deposit.objects.filter(proof_thumbnail__isnull=True).exclude(proof_of_payment='').order_by('pk')
+        done = failed = last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk).only('pk', 'proof_of_payment')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            for deposit in batch:
+                try:
+                    thumbnail = images.thumbnail_from(deposit.proof_of_payment)
+                except (OSError, ValueError) as exc:
+                    failed += 1
+                    self.stderr.write(f"Depósito {deposit.pk}: {exc}")
+                    continue
+                deposit.proof_thumbnail.save(thumbnail.name, thumbnail, save=False)
+                # UPDATE direto: gravar o depósito voltaria a calcular o resumo do usuário
+                Deposit.objects.filter(pk=deposit.pk).update(proof_thumbnail=deposit.proof_thumbnail.name)
+                done += 1
+        self.stdout.write(self.style.SUCCESS(f"{done} miniaturas geradas, {failed} comprovativos ilegíveis."))
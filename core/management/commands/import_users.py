@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import user_import
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa usuários em massa de um ficheiro CSV ou JSONL (colunas: "
+        + ', '.join(user_import.FIELDS)
+        + "). invited_by é o código de convite do patrocinador. Use --checkpoint para poder retomar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=None, help="Processos para os hashes (padrão: nº de CPUs).")
+        parser.add_argument(
+            '--hasher', default='default',
+            help="Algoritmo de PASSWORD_HASHERS; as senhas são atualizadas para o preferido no primeiro login.",
+        )
+        parser.add_argument('--checkpoint', help="Ficheiro de progresso; se existir, a importação continua de onde parou.")
+
+    def handle(self, *args, **options):
+        try:
+            importer = user_import.Importer(
+                chunk_size=options['chunk_size'], workers=options['workers'], hasher=options['hasher'],
+                checkpoint=options['checkpoint'], progress=self._progress,
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+        if importer.checkpoint.rows:
+            self.stdout.write(f"A retomar depois da linha {importer.checkpoint.rows}.")
+        try:
+            stats = importer.run(user_import.read_rows(options['path']))
+        except user_import.UnsupportedFormat as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['imported']} usuários importados de {stats['rows']} linhas em {stats['elapsed_s']}s "
+            f"({stats['rows_per_s']} linhas/s); {stats['existing']} já existiam, {stats['invalid']} inválidas, "
+            f"{stats['unknown_sponsors']} com patrocinador desconhecido."
+        ))
+
+    def _progress(self, rows, stats, elapsed):
+        self.stdout.write(f"{rows} linhas ({stats['imported']} importadas, {stats['rows'] / elapsed:.0f} linhas/s)")
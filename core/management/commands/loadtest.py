@@ -0,0 +1,119 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment
+
+from core import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga dos fluxos cadastro -> login -> menu -> nível -> tarefa -> roleta -> saque. "
+        "Semeia dados sintéticos (apagados no fim) e emite um relatório JSON com p50/p95/p99, "
+        "consultas por pedido e débito. Use numa base de desenvolvimento."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Usuários sintéticos semeados.")
+        parser.add_argument('--fanout', type=int, default=5)
+        parser.add_argument('--flows', type=int, default=50, help="Usuários virtuais que percorrem o fluxo.")
+        parser.add_argument(
+            '--server', choices=['client', 'wsgi', 'asgi', 'compare'], default='client',
+            help=(
+                "client: cliente de testes do Django no mesmo processo; wsgi: gunicorn multi-processo local; "
+                "asgi: gunicorn com workers uvicorn (davenport_downs.asgi); compare: wsgi e depois asgi no mesmo dataset."
+            ),
+        )
+        parser.add_argument('--url', help="Servidor já em execução (ignora --server).")
+        parser.add_argument('--workers', type=int, default=4, help="Workers do gunicorn.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Fluxos em paralelo nos modos HTTP.")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help="Ficheiro onde gravar o relatório JSON.")
+        parser.add_argument('--keep', action='store_true', help="Não apaga os dados sintéticos.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        dataset = loadtest.seed(users=options['users'], fanout=options['fanout'], seed=options['seed'])
+        report = {
+            'commit': self._commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'config': {key: options[key] for key in ('users', 'fanout', 'flows', 'server', 'workers', 'concurrency')},
+            'seed_s': round(time.perf_counter() - started, 2),
+        }
+        try:
+            if options['url']:
+                report['config']['server'] = options['url']
+                report.update(loadtest.run_http(dataset, options['flows'], options['url'].rstrip('/'), options['concurrency']))
+            elif options['server'] == 'client':
+                setup_test_environment()
+                # Todos os usuários virtuais saem do mesmo IP: o limite por IP travaria a carga
+                with override_settings(RATE_LIMITING=False):
+                    report.update(loadtest.run_client(dataset, options['flows']))
+            elif options['server'] == 'compare':
+                # Mesmos dados e mesma carga nos dois servidores; os fluxos da segunda
+                # rodada começam depois dos da primeira (telefones novos)
+                for offset, kind in enumerate(('wsgi', 'asgi')):
+                    report[kind] = self._run_server(kind, dataset, options, start=offset * options['flows'])
+            else:
+                report.update(self._run_server(options['server'], dataset, options))
+        finally:
+            if not options['keep']:
+                loadtest.cleanup(dataset)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output)
+        self.stdout.write(output)
+
+    def _run_server(self, kind, dataset, options, start=0):
+        server = self._start_server(kind, options)
+        try:
+            base_url = f"http://127.0.0.1:{options['port']}"
+            return loadtest.run_http(dataset, options['flows'], base_url, options['concurrency'], start=start)
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    def _start_server(self, kind, options):
+        if kind == 'asgi':
+            application = ['davenport_downs.asgi:application', '--worker-class', 'uvicorn_worker.UvicornWorker']
+        else:
+            application = ['davenport_downs.wsgi']
+        command = [
+            sys.executable, '-m', 'gunicorn', *application,
+            '--workers', str(options['workers']), '--bind', f"127.0.0.1:{options['port']}",
+        ]
+        env = {**os.environ, 'RATE_LIMITING': 'False'}
+        if kind == 'wsgi':
+            # Em WSGI as ligações persistentes são seguras (uma thread por worker); em
+            # ASGI fica o default das settings, sem ligações persistentes
+            env.setdefault('CONN_MAX_AGE', '600')
+        server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', options['port']), timeout=0.5).close()
+                return server
+            except OSError:
+                if server.poll() is not None:
+                    break
+                time.sleep(0.2)
+        server.kill()
+        raise CommandError("O servidor não arrancou a tempo.")
+
+    def _commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip() or None
+        except OSError:
+            return None
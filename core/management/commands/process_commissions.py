@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import commissions
+
+
+class Command(BaseCommand):
+    help = "Aplica em lote as comissões de patrocinador pendentes (outbox CommissionEvent)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--loop', action='store_true', help="Continua a correr, à espera de novos eventos.")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Pausa (s) quando não há eventos, com --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                stats = commissions.process_batch(options['batch_size'])
+            except commissions.ConcurrentProcessing:
+                # Outro worker tocou no mesmo lote; tenta de novo com os eventos restantes
+                continue
+            if stats['events']:
+                self.stdout.write(
+                    f"{stats['events']} eventos: {stats['credited']} creditados a "
+                    f"{stats['sponsors']} patrocinadores, {stats['skipped']} ignorados."
+                )
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import dashboard
+
+
+class Command(BaseCommand):
+    help = "Reconstrói em massa os resumos (menu/renda) de todos os usuários."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuilt = dashboard.rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"{rebuilt} resumos reconstruídos em {elapsed:.2f}s."))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import daily_earnings
+
+
+class Command(BaseCommand):
+    help = "Credita o ganho diário de todos os níveis ativos e desativa os níveis com o ciclo terminado."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = daily_earnings.run(chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['levels']} níveis processados em {elapsed:.2f}s: "
+            f"{stats['credited']} creditados, {stats['skipped']} já tinham tarefa hoje, "
+            f"{stats['expired']} expirados, {stats['subsidies']} subsídios de patrocinador enviados para process_commissions."
+        ))
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_ledger(apps, schema_editor):
+    # Lança no livro-razão os movimentos históricos já refletidos nos saldos.
+    # Os saldos dos usuários não são alterados.
+    LedgerEntry = apps.get_model('core', 'LedgerEntry')
+    Deposit = apps.get_model('core', 'Deposit')
+    Withdrawal = apps.get_model('core', 'Withdrawal')
+    Task = apps.get_model('core', 'Task')
+    UserLevel = apps.get_model('core', 'UserLevel')
+    Roulette = apps.get_model('core', 'Roulette')
+
+    sources = [
+        (Deposit.objects.filter(is_approved=True).values_list('user_id', 'amount', 'created_at'), 'deposit', 1, False),
+        (Withdrawal.objects.values_list('user_id', 'amount', 'created_at'), 'withdrawal', -1, False),
+        (Task.objects.values_list('user_id', 'earnings', 'completed_at'), 'task_earning', 1, False),
+        (UserLevel.objects.values_list('user_id', 'level__deposit_value', 'purchase_date'), 'level_purchase', -1, False),
+        (Roulette.objects.values_list('user_id', 'prize', 'spin_date'), 'roulette_prize', 1, True),
+    ]
+    for queryset, entry_type, sign, is_subsidy in sources:
+        batch = []
+        for user_id, amount, created_at in queryset.iterator(chunk_size=2000):
+            batch.append(LedgerEntry(
+                user_id=user_id,
+                entry_type=entry_type,
+                amount=sign * amount,
+                subsidy_amount=amount if is_subsidy else 0,
+                created_at=created_at,
+            ))
+            if len(batch) >= 2000:
+                LedgerEntry.objects.bulk_create(batch)
+                batch = []
+        LedgerEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_remove_platformsettings_app_download_link'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('deposit', 'Depósito'), ('withdrawal', 'Saque'), ('task_earning', 'Ganho de Tarefa'), ('referral_subsidy', 'Subsídio de Indicação'), ('level_purchase', 'Compra de Nível'), ('roulette_prize', 'Prêmio da Roleta'), ('signup_bonus', 'Bônus de Cadastro')], max_length=20, verbose_name='Tipo')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Valor')),
+                ('subsidy_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Valor de Subsídio')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Data')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Movimento',
+                'verbose_name_plural': 'Movimentos',
+                'indexes': [models.Index(fields=['user', 'entry_type', 'created_at'], name='core_ledger_user_type_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDashboard',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dashboard', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+                ('approved_deposit_total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Total de Depósitos Aprovados')),
+                ('approved_withdrawal_total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Total Sacado')),
+                ('task_income_total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Renda Total de Tarefas')),
+                ('today_income', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Renda do Dia')),
+                ('today_date', models.DateField(blank=True, null=True, verbose_name='Dia da Renda')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+                ('active_level', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.userlevel', verbose_name='Nível Ativo')),
+            ],
+            options={
+                'verbose_name': 'Resumo do Usuário',
+                'verbose_name_plural': 'Resumos dos Usuários',
+            },
+        ),
+    ]
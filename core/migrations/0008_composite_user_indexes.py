@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_userdashboard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(fields=['user', 'is_approved'], name='core_deposit_user_appr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'completed_at'], name='core_task_user_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlevel',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user'], name='core_userlevel_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['user', 'status', 'created_at'], name='core_withdraw_user_status_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_composite_user_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(verbose_name='Profundidade')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_paths', to=settings.AUTH_USER_MODEL, verbose_name='Antepassado')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_paths', to=settings.AUTH_USER_MODEL, verbose_name='Descendente')),
+            ],
+            options={
+                'verbose_name': 'Caminho de Indicação',
+                'verbose_name_plural': 'Caminhos de Indicação',
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='core_referral_anc_depth_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='core_referralpath_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_referralpath'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommissionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('task_subsidy', 'Subsídio por Tarefa'), ('level_commission', 'Comissão de Nível')], max_length=20, verbose_name='Tipo')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Valor')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Pendente'), (1, 'Creditado'), (2, 'Ignorado (patrocinador sem nível ativo)')], default=0, verbose_name='Estado')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Data de Criação')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Data de Processamento')),
+                ('source_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Subordinado')),
+                ('sponsor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commission_events', to=settings.AUTH_USER_MODEL, verbose_name='Patrocinador')),
+            ],
+            options={
+                'verbose_name': 'Evento de Comissão',
+                'verbose_name_plural': 'Eventos de Comissão',
+                'indexes': [models.Index(condition=models.Q(('status', 0)), fields=['id'], name='core_commission_pending_idx')],
+            },
+        ),
+    ]
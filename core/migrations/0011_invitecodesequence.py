@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:19
+
+from django.db import migrations, models
+
+
+def create_sequence(apps, schema_editor):
+    # Linha única da sequência; os códigos antigos (hexadecimais) continuam válidos
+    InviteCodeSequence = apps.get_model('core', 'InviteCodeSequence')
+    InviteCodeSequence.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_commissionevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InviteCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.BigIntegerField(default=1, verbose_name='Próximo Valor')),
+            ],
+            options={
+                'verbose_name': 'Sequência de Códigos de Convite',
+                'verbose_name_plural': 'Sequência de Códigos de Convite',
+            },
+        ),
+        migrations.RunPython(create_sequence, migrations.RunPython.noop),
+    ]
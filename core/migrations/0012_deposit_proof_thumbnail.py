@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_invitecodesequence'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='deposit',
+            name='core_deposit_user_appr_idx',
+        ),
+        migrations.AddField(
+            model_name='deposit',
+            name='proof_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='deposit_proofs/thumbs/', verbose_name='Miniatura'),
+        ),
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['user'], name='core_deposit_user_appr_idx'),
+        ),
+    ]
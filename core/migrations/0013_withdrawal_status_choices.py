@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:47
+
+from django.db import migrations, models
+
+STATUS_CHOICES = [(0, 'Pendente'), (1, 'Aprovado'), (2, 'Pago'), (3, 'Rejeitado')]
+
+# Textos encontrados no campo antigo (as views usavam português, o default era 'Pending')
+LEGACY_STATUSES = {
+    0: ('Pendente', 'Pending'),
+    1: ('Aprovado', 'Approved'),
+    2: ('Pago', 'Paid'),
+    3: ('Rejeitado', 'Rejected'),
+}
+
+
+def forwards(apps, schema_editor):
+    # Um UPDATE por texto antigo; valores desconhecidos ficam pendentes para o staff rever
+    Withdrawal = apps.get_model('core', 'Withdrawal')
+    for code, labels in LEGACY_STATUSES.items():
+        for label in labels:
+            Withdrawal.objects.filter(status__iexact=label).update(status_code=code)
+
+
+def backwards(apps, schema_editor):
+    Withdrawal = apps.get_model('core', 'Withdrawal')
+    for code, labels in LEGACY_STATUSES.items():
+        Withdrawal.objects.filter(status_code=code).update(status=labels[0])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_deposit_proof_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='entry_type',
+            field=models.CharField(choices=[('deposit', 'Depósito'), ('withdrawal', 'Saque'), ('withdrawal_refund', 'Saque Rejeitado (Devolução)'), ('task_earning', 'Ganho de Tarefa'), ('referral_subsidy', 'Subsídio de Indicação'), ('level_purchase', 'Compra de Nível'), ('roulette_prize', 'Prêmio da Roleta'), ('signup_bonus', 'Bônus de Cadastro')], max_length=20, verbose_name='Tipo'),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=0, verbose_name='Estado'),
+        ),
+        migrations.RunPython(forwards, backwards),
+        migrations.RemoveIndex(
+            model_name='withdrawal',
+            name='core_withdraw_user_status_idx',
+        ),
+        migrations.RemoveField(
+            model_name='withdrawal',
+            name='status',
+        ),
+        migrations.RenameField(
+            model_name='withdrawal',
+            old_name='status_code',
+            new_name='status',
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['user', 'status', 'created_at'], name='core_withdraw_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['status', 'id'], name='core_withdraw_status_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:05
+
+from django.db import migrations, models
+
+INDEXES = [
+    ('deposit', models.Index(fields=['created_at'], name='core_deposit_created_idx')),
+    ('ledgerentry', models.Index(fields=['created_at'], name='core_ledger_created_idx')),
+    ('roulette', models.Index(fields=['spin_date'], name='core_roulette_spin_idx')),
+    ('task', models.Index(fields=['completed_at'], name='core_task_done_idx')),
+    ('withdrawal', models.Index(fields=['created_at'], name='core_withdraw_created_idx')),
+]
+
+
+def create_indexes(apps, schema_editor):
+    # No PostgreSQL com CONCURRENTLY: as tabelas de tarefas e roletas têm milhões
+    # de linhas e um CREATE INDEX normal bloquearia as escritas durante a criação
+    for model_name, index in INDEXES:
+        model = apps.get_model('core', model_name)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(index.create_sql(model, schema_editor, concurrently=True))
+        else:
+            schema_editor.add_index(model, index)
+
+
+def drop_indexes(apps, schema_editor):
+    for model_name, index in INDEXES:
+        model = apps.get_model('core', model_name)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(index.remove_sql(model, schema_editor, concurrently=True))
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY não pode correr dentro de uma transação
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_withdrawal_status_choices'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name=model_name, index=index) for model_name, index in INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:01
+
+from decimal import Decimal, InvalidOperation
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def prizes_from_settings(apps, schema_editor):
+    # Converte a lista "100,200,500" numa linha por prêmio, com os pesos que o
+    # sorteio usava até aqui (até 1000 KZ peso 3, acima disso peso 1)
+    RouletteSettings = apps.get_model('core', 'RouletteSettings')
+    RoulettePrize = apps.get_model('core', 'RoulettePrize')
+    settings = RouletteSettings.objects.exclude(prizes__isnull=True).exclude(prizes='').first()
+    if settings is None:
+        return
+    weights = {}
+    for value in settings.prizes.split(','):
+        try:
+            amount = Decimal(value.strip())
+        except InvalidOperation:
+            continue
+        weights[amount] = weights.get(amount, 0) + (3 if amount <= 1000 else 1)
+    RoulettePrize.objects.bulk_create(RoulettePrize(amount=amount, weight=weight) for amount, weight in weights.items())
+
+
+def settings_from_prizes(apps, schema_editor):
+    # A lista antiga não tem pesos: cada prêmio volta a aparecer uma vez
+    RouletteSettings = apps.get_model('core', 'RouletteSettings')
+    RoulettePrize = apps.get_model('core', 'RoulettePrize')
+    amounts = RoulettePrize.objects.filter(weight__gt=0).order_by('amount').values_list('amount', flat=True)
+    if amounts:
+        RouletteSettings.objects.create(prizes=','.join(f'{amount.normalize():f}' for amount in amounts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_admin_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoulettePrize',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Valor')),
+                ('weight', models.PositiveIntegerField(default=1, help_text='Probabilidade relativa: um prêmio com peso 3 sai três vezes mais que um com peso 1. Peso 0 desativa o prêmio.', verbose_name='Peso')),
+                ('daily_budget', models.DecimalField(blank=True, decimal_places=2, help_text='Total máximo pago por dia com este prêmio. Vazio: sem limite.', max_digits=12, null=True, verbose_name='Orçamento Diário')),
+            ],
+            options={
+                'verbose_name': 'Prêmio da Roleta',
+                'verbose_name_plural': 'Prêmios da Roleta',
+                'ordering': ['amount'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RoulettePrizeUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Dia')),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Pago')),
+                ('prize', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='core.rouletteprize', verbose_name='Prêmio')),
+            ],
+            options={
+                'verbose_name': 'Uso Diário de Prêmio',
+                'verbose_name_plural': 'Uso Diário de Prêmios',
+            },
+        ),
+        migrations.RunPython(prizes_from_settings, settings_from_prizes),
+        migrations.DeleteModel(
+            name='RouletteSettings',
+        ),
+        migrations.AddConstraint(
+            model_name='rouletteprizeusage',
+            constraint=models.UniqueConstraint(fields=('prize', 'day'), name='core_prize_usage_day_uniq'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_roulette_prizes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoulettePayoutCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hora'), ('day', 'Dia')], max_length=4, verbose_name='Período')),
+                ('starts_at', models.DateTimeField(verbose_name='Início')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='Fragmento')),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Pago')),
+                ('spins', models.PositiveIntegerField(default=0, verbose_name='Giros')),
+            ],
+            options={
+                'verbose_name': 'Contador de Prêmios',
+                'verbose_name_plural': 'Contadores de Prêmios',
+                'constraints': [models.UniqueConstraint(fields=('period', 'starts_at', 'shard'), name='core_payout_counter_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:06
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 5000
+
+
+def backfill_days_and_slots(apps, schema_editor):
+    # Dia local de cada tarefa e a sua ordem dentro do dia do usuário (0, 1, ...),
+    # para que as tarefas antigas respeitem a restrição única
+    Task = apps.get_model('core', 'Task')
+    if schema_editor.connection.vendor == 'postgresql':
+        table = schema_editor.quote_name(Task._meta.db_table)
+        schema_editor.execute(
+            f"""
+            UPDATE {table} AS task SET task_day = ranked.day, slot = ranked.slot
+            FROM (
+                SELECT id, (completed_at AT TIME ZONE %s)::date AS day,
+                       row_number() OVER (
+                           PARTITION BY user_id, (completed_at AT TIME ZONE %s)::date ORDER BY completed_at, id
+                       ) - 1 AS slot
+                FROM {table}
+            ) AS ranked
+            WHERE task.id = ranked.id
+            """,
+            [settings.TIME_ZONE, settings.TIME_ZONE],
+        )
+        return
+
+    batch = []
+    previous = None
+    slot = 0
+    rows = Task.objects.order_by('user_id', 'completed_at', 'pk').values_list('pk', 'user_id', 'completed_at')
+    for pk, user_id, completed_at in rows.iterator(chunk_size=BATCH_SIZE):
+        day = timezone.localdate(completed_at)
+        slot = slot + 1 if (user_id, day) == previous else 0
+        previous = (user_id, day)
+        batch.append(Task(pk=pk, task_day=day, slot=slot))
+        if len(batch) >= BATCH_SIZE:
+            Task.objects.bulk_update(batch, ['task_day', 'slot'])
+            batch = []
+    Task.objects.bulk_update(batch, ['task_day', 'slot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_roulette_payout_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='level',
+            name='max_tasks',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='Tarefas por Dia'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='slot',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Posição no Dia'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='task_day',
+            field=models.DateField(default=django.utils.timezone.localdate, verbose_name='Dia'),
+        ),
+        migrations.RunPython(backfill_days_and_slots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(fields=('user', 'task_day', 'slot'), name='core_task_user_day_slot_uniq'),
+        ),
+    ]
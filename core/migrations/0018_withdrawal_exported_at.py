@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:32
+
+from django.db import migrations, models
+from django.utils import timezone
+
+APPROVED = 1
+
+
+def mark_approved_as_exported(apps, schema_editor):
+    # Os aprovados existentes já podem ter saído num ficheiro (a exportação não
+    # ficava registada): contam como exportados para não serem pagos duas vezes
+    Withdrawal = apps.get_model('core', 'Withdrawal')
+    Withdrawal.objects.filter(status=APPROVED).update(exported_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_task_daily_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawal',
+            name='exported_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Exportado em'),
+        ),
+        migrations.RunPython(mark_approved_as_exported, migrations.RunPython.noop),
+    ]
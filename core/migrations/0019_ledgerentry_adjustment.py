@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_withdrawal_exported_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='entry_type',
+            field=models.CharField(choices=[('deposit', 'Depósito'), ('withdrawal', 'Saque'), ('withdrawal_refund', 'Saque Rejeitado (Devolução)'), ('task_earning', 'Ganho de Tarefa'), ('referral_subsidy', 'Subsídio de Indicação'), ('level_purchase', 'Compra de Nível'), ('roulette_prize', 'Prêmio da Roleta'), ('signup_bonus', 'Bônus de Cadastro'), ('adjustment', 'Ajuste Manual')], max_length=20, verbose_name='Tipo'),
+        ),
+    ]
@@ -1,7 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
-import uuid
 import os
 
 # ---
@@ -46,13 +45,17 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     def save(self, *args, **kwargs):
         if not self.invite_code:
-            while True:
-                new_invite_code = uuid.uuid4().hex[:8]
-                if not CustomUser.objects.filter(invite_code=new_invite_code).exists():
-                    self.invite_code = new_invite_code
-                    break
+            # Código único por construção (sem consulta de colisão); ver core/invite_codes.py
+            from .invite_codes import next_code
+            self.invite_code = next_code()
         super().save(*args, **kwargs)
 
+    def get_session_auth_hash(self):
+        # Usuário vindo do cache (core/user_cache.py): a senha não foi carregada e o hash chega calculado
+        if 'password' in self.get_deferred_fields() and hasattr(self, 'cached_session_auth_hash'):
+            return self.cached_session_auth_hash
+        return super().get_session_auth_hash()
+
 # ---
 
 class PlatformSettings(models.Model):
@@ -115,12 +118,19 @@ class Deposit(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Usuário")
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Valor")
     proof_of_payment = models.ImageField(upload_to='deposit_proofs/', verbose_name="Comprovativo")
+    proof_thumbnail = models.ImageField(upload_to='deposit_proofs/thumbs/', blank=True, null=True, verbose_name="Miniatura")
     is_approved = models.BooleanField(default=False, verbose_name="Aprovado")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Data de Criação")
     
     class Meta:
         verbose_name = "Depósito"
         verbose_name_plural = "Depósitos"
+        indexes = [
+            # Parcial: o termo booleano "is_approved" não serve de chave num índice composto
+            models.Index(fields=['user'], condition=models.Q(is_approved=True), name='core_deposit_user_appr_idx'),
+            # date_hierarchy do admin
+            models.Index(fields=['created_at'], name='core_deposit_created_idx'),
+        ]
 
     def __str__(self):
         return f"Depósito de {self.amount} por {self.user.phone_number}"
@@ -128,17 +138,51 @@ class Deposit(models.Model):
 # ---
 
 class Withdrawal(models.Model):
+    # Estados do pedido de saque (o saldo é debitado logo no pedido)
+    PENDING = 0
+    APPROVED = 1
+    PAID = 2
+    REJECTED = 3
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pendente'),
+        (APPROVED, 'Aprovado'),
+        (PAID, 'Pago'),
+        (REJECTED, 'Rejeitado'),
+    ]
+
+    # Transições permitidas (ver core/withdrawals.py); rejeitar devolve o valor ao saldo
+    TRANSITIONS = {
+        PENDING: (APPROVED, REJECTED),
+        APPROVED: (PAID, REJECTED),
+        PAID: (),
+        REJECTED: (),
+    }
+
+    # Estados que contam como saque feito (limite diário e total sacado)
+    ACTIVE_STATUSES = (PENDING, APPROVED, PAID)
+    APPROVED_STATUSES = (APPROVED, PAID)
+
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Usuário")
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Valor")
-    status = models.CharField(max_length=20, default='Pending', verbose_name="Status")
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=PENDING, verbose_name="Estado")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Data de Criação")
+    # Quando entrou num ficheiro de pagamentos: cada saque aprovado só é exportado uma vez
+    exported_at = models.DateTimeField(null=True, blank=True, verbose_name="Exportado em")
     
     class Meta:
         verbose_name = "Saque"
         verbose_name_plural = "Saques"
+        indexes = [
+            models.Index(fields=['user', 'status', 'created_at'], name='core_withdraw_user_status_idx'),
+            # Fila de processamento do admin e exportação de pagamentos (por estado, pela ordem dos pedidos)
+            models.Index(fields=['status', 'id'], name='core_withdraw_status_idx'),
+            # date_hierarchy do admin
+            models.Index(fields=['created_at'], name='core_withdraw_created_idx'),
+        ]
 
     def __str__(self):
-        return f"Saque de {self.amount} por {self.user.phone_number} ({self.status})"
+        return f"Saque de {self.amount} por {self.user.phone_number} ({self.get_status_display()})"
 
 # ---
 
@@ -148,6 +192,7 @@ class Level(models.Model):
     daily_gain = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Ganho Diário")
     monthly_gain = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Ganho Mensal")
     cycle_days = models.IntegerField(verbose_name="Ciclo (dias)")
+    max_tasks = models.PositiveSmallIntegerField(default=1, verbose_name="Tarefas por Dia")
     image = models.ImageField(upload_to='level_images/', verbose_name="Imagem")
 
     class Meta:
@@ -168,6 +213,10 @@ class UserLevel(models.Model):
     class Meta:
         verbose_name = "Nível do Usuário"
         verbose_name_plural = "Níveis dos Usuários"
+        indexes = [
+            # Índice parcial: só as linhas ativas, que são as consultadas em cada pedido
+            models.Index(fields=['user'], condition=models.Q(is_active=True), name='core_userlevel_active_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.phone_number} - {self.level.name}"
@@ -178,10 +227,22 @@ class Task(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Usuário")
     earnings = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Ganhos")
     completed_at = models.DateTimeField(auto_now_add=True, verbose_name="Data de Conclusão")
+    # Dia local da tarefa e a sua posição (0 .. max_tasks - 1) nesse dia: a quota
+    # diária é garantida pela restrição única, não por uma contagem prévia
+    task_day = models.DateField(default=timezone.localdate, verbose_name="Dia")
+    slot = models.PositiveSmallIntegerField(default=0, verbose_name="Posição no Dia")
 
     class Meta:
         verbose_name = "Tarefa"
         verbose_name_plural = "Tarefas"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'task_day', 'slot'], name='core_task_user_day_slot_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'completed_at'], name='core_task_user_done_idx'),
+            # date_hierarchy do admin
+            models.Index(fields=['completed_at'], name='core_task_done_idx'),
+        ]
 
     def __str__(self):
         return f"Tarefa de {self.user.phone_number} em {self.completed_at}"
@@ -197,23 +258,218 @@ class Roulette(models.Model):
     class Meta:
         verbose_name = "Roleta"
         verbose_name_plural = "Roletas"
+        indexes = [
+            # date_hierarchy do admin
+            models.Index(fields=['spin_date'], name='core_roulette_spin_idx'),
+        ]
 
     def __str__(self):
         return f"Roleta de {self.user.phone_number} - Prêmio: {self.prize}"
 
 # ---
 
-class RouletteSettings(models.Model):
-    prizes = models.CharField(
-        max_length=255, blank=True, null=True,
-        verbose_name="Prêmios da Roleta",
-        help_text="Uma lista de prêmios separados por vírgula. Ex: 100,200,500,1000"
+class RoulettePrize(models.Model):
+    amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Valor")
+    weight = models.PositiveIntegerField(
+        default=1, verbose_name="Peso",
+        help_text="Probabilidade relativa: um prêmio com peso 3 sai três vezes mais que um com peso 1. Peso 0 desativa o prêmio."
+    )
+    daily_budget = models.DecimalField(
+        max_digits=12, decimal_places=2, blank=True, null=True, verbose_name="Orçamento Diário",
+        help_text="Total máximo pago por dia com este prêmio. Vazio: sem limite."
     )
 
     class Meta:
-        verbose_name = "Configuração da Roleta"
-        verbose_name_plural = "Configurações da Roleta"
+        verbose_name = "Prêmio da Roleta"
+        verbose_name_plural = "Prêmios da Roleta"
+        ordering = ['amount']
+
+    def __str__(self):
+        return f"{self.amount} KZ (peso {self.weight})"
+
+# ---
+
+class RoulettePrizeUsage(models.Model):
+    # Total já pago por dia com cada prêmio que tem orçamento diário
+    prize = models.ForeignKey(RoulettePrize, on_delete=models.CASCADE, related_name='usage', verbose_name="Prêmio")
+    day = models.DateField(verbose_name="Dia")
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Pago")
+
+    class Meta:
+        verbose_name = "Uso Diário de Prêmio"
+        verbose_name_plural = "Uso Diário de Prêmios"
+        constraints = [
+            models.UniqueConstraint(fields=['prize', 'day'], name='core_prize_usage_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.prize.amount} KZ em {self.day}: {self.paid}"
+
+# ---
+
+class RoulettePayoutCounter(models.Model):
+    # Total pago pela roleta por hora e por dia, dividido em fragmentos (shard):
+    # cada giro soma numa linha ao acaso, para que não haja uma única linha disputada
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [
+        (HOUR, 'Hora'),
+        (DAY, 'Dia'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, verbose_name="Período")
+    starts_at = models.DateTimeField(verbose_name="Início")
+    shard = models.PositiveSmallIntegerField(verbose_name="Fragmento")
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Pago")
+    spins = models.PositiveIntegerField(default=0, verbose_name="Giros")
+
+    class Meta:
+        verbose_name = "Contador de Prêmios"
+        verbose_name_plural = "Contadores de Prêmios"
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'starts_at', 'shard'], name='core_payout_counter_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_period_display()} {self.starts_at:%Y-%m-%d %H:%M} #{self.shard}: {self.paid}"
+
+# ---
+
+class LedgerEntry(models.Model):
+    # Tipos de movimento registados no livro-razão
+    DEPOSIT = 'deposit'
+    WITHDRAWAL = 'withdrawal'
+    WITHDRAWAL_REFUND = 'withdrawal_refund'
+    TASK_EARNING = 'task_earning'
+    REFERRAL_SUBSIDY = 'referral_subsidy'
+    LEVEL_PURCHASE = 'level_purchase'
+    ROULETTE_PRIZE = 'roulette_prize'
+    SIGNUP_BONUS = 'signup_bonus'
+    ADJUSTMENT = 'adjustment'
+
+    ENTRY_TYPE_CHOICES = [
+        (DEPOSIT, 'Depósito'),
+        (WITHDRAWAL, 'Saque'),
+        (WITHDRAWAL_REFUND, 'Saque Rejeitado (Devolução)'),
+        (TASK_EARNING, 'Ganho de Tarefa'),
+        (REFERRAL_SUBSIDY, 'Subsídio de Indicação'),
+        (LEVEL_PURCHASE, 'Compra de Nível'),
+        (ROULETTE_PRIZE, 'Prêmio da Roleta'),
+        (SIGNUP_BONUS, 'Bônus de Cadastro'),
+        (ADJUSTMENT, 'Ajuste Manual'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Usuário")
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES, verbose_name="Tipo")
+    # Variação do saldo disponível (positiva = crédito, negativa = débito)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Valor")
+    # Variação do saldo de subsídios (apenas subsídios e prêmios)
+    subsidy_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Valor de Subsídio")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Data")
+
+    class Meta:
+        verbose_name = "Movimento"
+        verbose_name_plural = "Movimentos"
+        indexes = [
+            models.Index(fields=['user', 'entry_type', 'created_at'], name='core_ledger_user_type_idx'),
+            # date_hierarchy do admin
+            models.Index(fields=['created_at'], name='core_ledger_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_entry_type_display()} de {self.amount} ({self.user_id})"
+
+# ---
+
+class UserDashboard(models.Model):
+    # Agregados por usuário usados pelas páginas menu e renda (atualizados incrementalmente)
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='dashboard', verbose_name="Usuário")
+    active_level = models.ForeignKey(UserLevel, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Nível Ativo")
+    approved_deposit_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Total de Depósitos Aprovados")
+    approved_withdrawal_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Total Sacado")
+    task_income_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Renda Total de Tarefas")
+    today_income = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Renda do Dia")
+    today_date = models.DateField(null=True, blank=True, verbose_name="Dia da Renda")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizado em")
+
+    class Meta:
+        verbose_name = "Resumo do Usuário"
+        verbose_name_plural = "Resumos dos Usuários"
+
+    def __str__(self):
+        return f"Resumo de {self.user_id}"
+
+# ---
+
+class ReferralPath(models.Model):
+    # Tabela de fecho da árvore de indicações: uma linha por par (antepassado, descendente)
+    ancestor = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='descendant_paths', verbose_name="Antepassado")
+    descendant = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='ancestor_paths', verbose_name="Descendente")
+    depth = models.PositiveSmallIntegerField(verbose_name="Profundidade")
+
+    class Meta:
+        verbose_name = "Caminho de Indicação"
+        verbose_name_plural = "Caminhos de Indicação"
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='core_referralpath_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['ancestor', 'depth'], name='core_referral_anc_depth_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
+# ---
+
+class CommissionEvent(models.Model):
+    # Caixa de saída (outbox) das comissões de patrocinador, aplicadas em lote por um worker
+    TASK_SUBSIDY = 'task_subsidy'
+    LEVEL_COMMISSION = 'level_commission'
+
+    KIND_CHOICES = [
+        (TASK_SUBSIDY, 'Subsídio por Tarefa'),
+        (LEVEL_COMMISSION, 'Comissão de Nível'),
+    ]
+
+    PENDING = 0
+    CREDITED = 1
+    SKIPPED = 2
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pendente'),
+        (CREDITED, 'Creditado'),
+        (SKIPPED, 'Ignorado (patrocinador sem nível ativo)'),
+    ]
+
+    sponsor = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='commission_events', verbose_name="Patrocinador")
+    source_user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+', verbose_name="Subordinado")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Tipo")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Valor")
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=PENDING, verbose_name="Estado")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Data de Criação")
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name="Data de Processamento")
+
+    class Meta:
+        verbose_name = "Evento de Comissão"
+        verbose_name_plural = "Eventos de Comissão"
+        indexes = [
+            # O worker só lê os eventos pendentes
+            models.Index(fields=['id'], condition=models.Q(status=0), name='core_commission_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} de {self.amount} para {self.sponsor_id}"
+
+# ---
+
+class InviteCodeSequence(models.Model):
+    # Contador global dos códigos de convite, reservado em blocos (ver core/invite_codes.py)
+    next_value = models.BigIntegerField(default=1, verbose_name="Próximo Valor")
+
+    class Meta:
+        verbose_name = "Sequência de Códigos de Convite"
+        verbose_name_plural = "Sequência de Códigos de Convite"
 
     def __str__(self):
-        return "Configurações da Roleta"
-        
\ No newline at end of file
+        return str(self.next_value)
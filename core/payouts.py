@@ -0,0 +1,179 @@
+import random
+from datetime import timedelta
+from decimal import ROUND_DOWN, Decimal
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import RoulettePayoutCounter, RoulettePrize
+
+# ---
+# Contadores do total pago pela roleta (por hora e por dia), mantidos a cada
+# giro na mesma transação do prêmio.
+# Cada período tem ROULETTE_PAYOUT_SHARDS linhas; um giro soma numa delas ao
+# acaso, logo giros simultâneos raramente esperam pela mesma linha. Com
+# orçamento, cada fragmento fica com uma parte igual e a soma só acontece se
+# couber nela (UPDATE condicional): a verificação é atómica sem bloquear o
+# período inteiro. Quando nenhum fragmento tem folga para o valor inteiro (um
+# prêmio maior do que a parte, ou o fim do orçamento), os fragmentos do período
+# são bloqueados e o valor é repartido pela folga de cada um: nenhum fragmento
+# passa da sua parte, logo a soma nunca passa do orçamento. O total do período
+# é a soma dos fragmentos.
+# ---
+
+ZERO = Decimal('0.00')
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def periods(now=None):
+    # (período, início, orçamento) em que um prêmio pago agora é contado
+    local = timezone.localtime(now)
+    hour = local.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    return (
+        (RoulettePayoutCounter.HOUR, hour, settings.ROULETTE_HOURLY_BUDGET),
+        (RoulettePayoutCounter.DAY, day, settings.ROULETTE_DAILY_BUDGET),
+    )
+
+
+def has_budget(now=None):
+    return any(budget for _, _, budget in periods(now))
+
+
+def _exhausted_key(period, starts_at):
+    return f'core:payouts:exhausted:{period}:{starts_at:%Y%m%d%H}'
+
+
+def _create_shards(current):
+    # Primeiro prêmio do período: cria todos os fragmentos de uma vez
+    RoulettePayoutCounter.objects.bulk_create(
+        [
+            RoulettePayoutCounter(period=period, starts_at=starts_at, shard=shard)
+            for period, starts_at, _ in current
+            for shard in range(settings.ROULETTE_PAYOUT_SHARDS)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _add_unchecked(current, amount, spins, rng):
+    # Sem limite, o mesmo fragmento de todos os períodos muda num único UPDATE
+    shard = rng.randrange(settings.ROULETTE_PAYOUT_SHARDS)
+    counters = RoulettePayoutCounter.objects.filter(
+        reduce(or_, (Q(period=period, starts_at=starts_at) for period, starts_at, _ in current)), shard=shard,
+    )
+    changes = {'paid': F('paid') + amount, 'spins': F('spins') + spins}
+    if counters.update(**changes) < len(current):
+        # Os fragmentos que já existiam foram somados; os que faltam são criados e somados a seguir
+        updated = list(counters.values_list('period', flat=True))
+        _create_shards(current)
+        counters.exclude(period__in=updated).update(**changes)
+
+
+def _add_checked(current, period, starts_at, amount, spins, limit, rng):
+    counters = RoulettePayoutCounter.objects.filter(period=period, starts_at=starts_at)
+    changes = {'paid': F('paid') + amount, 'spins': F('spins') + spins}
+    with_room = counters.filter(paid__lte=limit - amount)
+
+    shard = rng.randrange(settings.ROULETTE_PAYOUT_SHARDS)
+    if with_room.filter(shard=shard).update(**changes):
+        return True
+    _create_shards(current)
+    if with_room.filter(shard=shard).update(**changes):
+        return True
+    # A parte deste fragmento esgotou: tenta os que ainda têm folga
+    for other in with_room.exclude(shard=shard).values_list('shard', flat=True):
+        if with_room.filter(shard=other).update(**changes):
+            return True
+    return _add_split(counters, amount, spins, limit)
+
+
+def _add_split(counters, amount, spins, limit):
+    # Nenhum fragmento tem folga para o valor inteiro: com o período bloqueado,
+    # cabe se a folga somada dos fragmentos chegar
+    rooms = [
+        (shard, max(limit - paid, ZERO))
+        for shard, paid in counters.select_for_update().order_by('shard').values_list('shard', 'paid')
+    ]
+    if sum(room for _, room in rooms) < amount:
+        return False
+    remaining = amount
+    for shard, room in rooms:
+        part = min(room, remaining)
+        if not part:
+            continue
+        # Os giros ficam no primeiro fragmento usado
+        counters.filter(shard=shard).update(
+            paid=F('paid') + part, spins=F('spins') + (spins if remaining == amount else 0),
+        )
+        remaining -= part
+        if not remaining:
+            break
+    return True
+
+
+def add(amount, now=None, checked=True, spins=1, rng=random):
+    # Conta o valor (de `spins` giros) em todos os períodos. Com checked, levanta
+    # BudgetExceeded se não couber no orçamento de algum deles; o chamador desfaz
+    # o que já foi somado (savepoint), porque os períodos anteriores podem já ter
+    # sido incrementados.
+    current = periods(now)
+    if not checked or not any(budget for _, _, budget in current):
+        _add_unchecked(current, amount, spins, rng)
+        return
+
+    shards = settings.ROULETTE_PAYOUT_SHARDS
+    for period, starts_at, budget in current:
+        if not budget:
+            _add_unchecked([(period, starts_at, budget)], amount, spins, rng)
+            continue
+        # Arredondada para baixo: a soma das partes não passa do orçamento
+        limit = (budget / shards).quantize(Decimal('0.01'), rounding=ROUND_DOWN)
+        # Os contadores só crescem dentro do período: um valor que já não coube continua a não caber
+        key = _exhausted_key(period, starts_at)
+        smallest_refused = cache.get(key)
+        if smallest_refused is not None and amount >= smallest_refused:
+            raise BudgetExceeded()
+        if not _add_checked(current, period, starts_at, amount, spins, limit, rng):
+            ends_at = starts_at + (timedelta(hours=1) if period == RoulettePayoutCounter.HOUR else timedelta(days=1))
+            timeout = max(int((ends_at - timezone.now()).total_seconds()), 1)
+            cache.set(key, amount if smallest_refused is None else min(amount, smallest_refused), timeout)
+            raise BudgetExceeded()
+
+
+def exposure(now=None):
+    # Pago na hora e no dia correntes (lê só os fragmentos dos dois períodos) e
+    # o uso dos prêmios com orçamento diário
+    current = periods(now)
+    totals = {
+        row['period']: row
+        for row in RoulettePayoutCounter.objects.filter(
+            Q(period=current[0][0], starts_at=current[0][1]) | Q(period=current[1][0], starts_at=current[1][1])
+        ).values('period').annotate(total=Sum('paid'), count=Sum('spins'))
+    }
+    report = {}
+    for period, starts_at, budget in current:
+        paid = totals.get(period, {}).get('total') or ZERO
+        report[period] = {
+            'starts_at': starts_at.isoformat(),
+            'paid': paid,
+            'spins': totals.get(period, {}).get('count') or 0,
+            'budget': budget or None,
+            'remaining': max(budget - paid, ZERO) if budget else None,
+        }
+
+    day = timezone.localdate(now)
+    report['prizes'] = [
+        {'amount': amount, 'daily_budget': daily_budget, 'paid': paid or ZERO}
+        for amount, daily_budget, paid in RoulettePrize.objects.filter(daily_budget__isnull=False)
+        .annotate(paid=Sum('usage__paid', filter=Q(usage__day=day)))
+        .values_list('amount', 'daily_budget', 'paid')
+    ]
+    return report
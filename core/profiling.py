@@ -0,0 +1,346 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger(__name__)
+
+# ---
+# Instrumentação por pedido: número de consultas, tempo de base de dados,
+# consultas repetidas, tempo de renderização dos templates e tempo Python,
+# agregados por nome de rota em histogramas do próprio processo (cada worker
+# do gunicorn tem os seus). Expostos em /profiling/ (JSON) e /metrics/
+# (formato de texto do Prometheus), apenas para staff.
+# ---
+
+# Consultas de qualquer pedido autenticado antes da view: sessão e usuário
+# (nenhuma com a sessão cached_db e a cache de usuários quentes, core/user_cache.py)
+AUTH_QUERIES = 2
+
+# Orçamento de consultas por rota: o plano de consultas de cada view com as caches
+# frias, sem contar os savepoints (ver RequestProfile). Qualquer consulta a mais
+# (N+1, consulta repetida) ultrapassa-o. Os testes falham quando uma view o
+# ultrapassa (QUERY_BUDGET_STRICT); em produção só fica um aviso no log.
+QUERY_BUDGETS = {
+    # A página não consulta nada
+    'home': AUTH_QUERIES,
+    # Um único SELECT do resumo (core/dashboard.py) e as configurações (cache fria)
+    'menu': AUTH_QUERIES + 2,
+    # Telefone, patrocinador, bloco de códigos (2, um em cada 1000), usuário, árvore (2), resumo, bônus (2), login (4)
+    'cadastro': 14,
+    # Usuário, sessão nova (3), last_login e a atualização de um hash antigo (uma vez por usuário)
+    'login': 6,
+    # O flush() do Django relê a sessão antes de a apagar
+    'logout': AUTH_QUERIES + 2,
+    # Contas da plataforma, valores dos níveis, configurações (cache fria); no POST também o depósito
+    'deposito': AUTH_QUERIES + 4,
+    # Configurações (cache fria), dados bancários, saques do dia e lista; no POST o débito (2) e o saque em vez da lista
+    'saque': AUTH_QUERIES + 6,
+    # Nível ativo e tarefas feitas hoje
+    'tarefa': AUTH_QUERIES + 2,
+    # Nível ativo, tarefas do dia, tarefa, resumo, crédito (2) e evento de comissão
+    'process_task': AUTH_QUERIES + 7,
+    # Catálogo (cache fria) e níveis do usuário; no POST débito (2), nível, resumo (2), level_active e comissão
+    'nivel': AUTH_QUERIES + 9,
+    # Totais da equipa, membros por nível, nomes dos níveis, contagem e página da aba
+    'equipa': AUTH_QUERIES + 5,
+    # Só o usuário (giros disponíveis)
+    'roleta': AUTH_QUERIES,
+    # Prêmios (cache fria), giro, contador (+3 no primeiro giro do período, core/payouts.py), roleta e crédito (2)
+    'spin_roulette': AUTH_QUERIES + 9,
+    # Configurações da plataforma (core/singletons.py, cache fria)
+    'sobre': AUTH_QUERIES + 1,
+    # Dados bancários (get_or_create: 2 na primeira visita); no POST a gravação
+    'perfil': AUTH_QUERIES + 2,
+    # Um único SELECT do resumo
+    'renda': AUTH_QUERIES + 1,
+}
+
+SAVEPOINT_STATEMENTS = ('SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+DURATION_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Métricas de duração (ms) registadas por pedido, além do número de consultas
+DURATION_METRICS = ('total', 'db', 'template', 'python')
+
+_current = contextvars.ContextVar('core_request_profile', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.total_ms = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: mede cada consulta em todas as ligações. Pedidos ASGI que
+        # partilhem a mesma ligação (mesma thread) só contam as suas próprias consultas
+        if _current.get() is not self:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            # Savepoints são controlo de transação: nos testes cada atomic exterior
+            # também vira um, e o orçamento deixaria de ser o mesmo que em produção
+            if not sql.startswith(SAVEPOINT_STATEMENTS):
+                self.queries += 1
+                self.statements[(sql, _freeze(params))] += 1
+
+    @property
+    def python_ms(self):
+        return max(self.total_ms - self.db_ms - self.template_ms, 0.0)
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def duplicated_sql(self):
+        return Counter({sql: count for (sql, _), count in self.statements.items() if count > 1})
+
+
+def _freeze(params):
+    if isinstance(params, (list, tuple)):
+        return tuple(_freeze(value) for value in params)
+    if isinstance(params, dict):
+        return tuple(sorted((key, _freeze(value)) for key, value in params.items()))
+    try:
+        hash(params)
+    except TypeError:
+        return repr(params)
+    return params
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            yield bound, running
+
+
+class ViewStats:
+    def __init__(self):
+        self.durations = {metric: Histogram(DURATION_BUCKETS_MS) for metric in DURATION_METRICS}
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.duplicates = 0
+        self.over_budget = 0
+        self.duplicated_sql = Counter()
+
+    def as_dict(self):
+        requests = self.queries.count
+        return {
+            'requests': requests,
+            'queries_mean': round(self.queries.total / requests, 2),
+            'duplicate_queries': self.duplicates,
+            'over_budget': self.over_budget,
+            **{f'{metric}_ms_mean': round(h.total / requests, 3) for metric, h in self.durations.items()},
+            'top_duplicates': [
+                {'sql': sql, 'count': count} for sql, count in self.duplicated_sql.most_common(5)
+            ],
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, name, profile, over_budget):
+        with self._lock:
+            stats = self._views.get(name)
+            if stats is None:
+                stats = self._views[name] = ViewStats()
+            stats.durations['total'].observe(profile.total_ms)
+            stats.durations['db'].observe(profile.db_ms)
+            stats.durations['template'].observe(profile.template_ms)
+            stats.durations['python'].observe(profile.python_ms)
+            stats.queries.observe(profile.queries)
+            stats.duplicates += profile.duplicates
+            stats.over_budget += over_budget
+            stats.duplicated_sql.update(profile.duplicated_sql())
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def snapshot(self):
+        with self._lock:
+            views = {}
+            for name, stats in sorted(self._views.items()):
+                views[name] = stats.as_dict()
+                views[name]['budget'] = QUERY_BUDGETS.get(name)
+            return views
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            items = sorted(self._views.items())
+            lines += [
+                '# HELP core_view_duration_ms Tempo por pedido (ms), por componente.',
+                '# TYPE core_view_duration_ms histogram',
+            ]
+            for name, stats in items:
+                for metric, histogram in stats.durations.items():
+                    lines += _histogram_lines('core_view_duration_ms', histogram, f'view="{name}",component="{metric}"')
+            lines += [
+                '# HELP core_view_queries Consultas SQL por pedido.',
+                '# TYPE core_view_queries histogram',
+            ]
+            for name, stats in items:
+                lines += _histogram_lines('core_view_queries', stats.queries, f'view="{name}"')
+            lines += [
+                '# HELP core_view_duplicate_queries_total Consultas repetidas (mesmo SQL e parâmetros).',
+                '# TYPE core_view_duplicate_queries_total counter',
+            ]
+            lines += [f'core_view_duplicate_queries_total{{view="{name}"}} {stats.duplicates}' for name, stats in items]
+            lines += [
+                '# HELP core_view_over_budget_total Pedidos acima do orçamento de consultas.',
+                '# TYPE core_view_over_budget_total counter',
+            ]
+            lines += [f'core_view_over_budget_total{{view="{name}"}} {stats.over_budget}' for name, stats in items]
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(metric, histogram, labels):
+    lines = []
+    for bound, count in histogram.cumulative():
+        le = '+Inf' if bound == float('inf') else f'{bound:g}'
+        lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {count}')
+    lines.append(f'{metric}_sum{{{labels}}} {histogram.total:.3f}')
+    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+registry = Registry()
+
+
+def check_budget(name, profile):
+    budget = QUERY_BUDGETS.get(name)
+    if budget is None or profile.queries <= budget:
+        return False
+    message = f"A view '{name}' fez {profile.queries} consultas (orçamento: {budget}, repetidas: {profile.duplicates})."
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+    return True
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'REQUEST_PROFILING', True):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with _wrap_connections(profile):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, profile, response)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'REQUEST_PROFILING', True):
+            return await self.get_response(request)
+
+        # Em ASGI as consultas do pedido correm numa thread própria (ThreadSensitiveContext):
+        # as ligações dessa thread só são instrumentadas a partir dela
+        profile = RequestProfile()
+        token = _current.set(profile)
+        wrapped = _wrap_connections(profile)
+        await sync_to_async(wrapped.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrapped.__exit__)(None, None, None)
+            _current.reset(token)
+        return self._finish(request, profile, response)
+
+    def _finish(self, request, profile, response):
+        profile.total_ms = (time.perf_counter() - profile.started) * 1000
+        match = request.resolver_match
+        name = (match.url_name or match.view_name) if match else None
+        if name:
+            registry.record(name, profile, check_budget(name, profile))
+        response.profile = profile
+        return response
+
+
+class _wrap_connections:
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.stacks = []
+
+    def __enter__(self):
+        for connection in connections.all():
+            stack = connection.execute_wrapper(self.wrapper)
+            stack.__enter__()
+            self.stacks.append(stack)
+
+    def __exit__(self, *exc_info):
+        for stack in reversed(self.stacks):
+            stack.__exit__(*exc_info)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.template_ms += (time.perf_counter() - started) * 1000
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    # Backend de templates do Django que mede o tempo de renderização do pedido atual
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
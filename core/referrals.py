@@ -0,0 +1,129 @@
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import CustomUser, ReferralPath
+
+# ---
+# Árvore de indicações em tabela de fecho (ReferralPath). Cada usuário tem uma
+# linha para cada antepassado, com a distância até ele, o que permite
+# responder "descendentes de X até à profundidade N" numa consulta indexada.
+# ---
+
+# Limite de segurança contra ciclos em invited_by
+MAX_DEPTH = 100
+
+
+def add_user(user):
+    # Chamado quando um usuário é criado: copia os caminhos do patrocinador
+    sponsor_id = user.invited_by_id
+    if not sponsor_id:
+        return
+    paths = [ReferralPath(ancestor_id=sponsor_id, descendant_id=user.pk, depth=1)]
+    paths.extend(
+        ReferralPath(ancestor_id=ancestor_id, descendant_id=user.pk, depth=depth + 1)
+        for ancestor_id, depth in ReferralPath.objects.filter(descendant_id=sponsor_id).values_list('ancestor_id', 'depth')
+        if depth < MAX_DEPTH
+    )
+    ReferralPath.objects.bulk_create(paths, ignore_conflicts=True)
+
+
+def descendant_counts(user, max_depth):
+    # {profundidade: número de descendentes} numa única consulta (índice ancestor/depth)
+    return dict(
+        ReferralPath.objects.filter(ancestor=user, depth__lte=max_depth)
+        .values_list('depth').annotate(members=Count('pk')).order_by('depth')
+    )
+
+
+def descendants(user, max_depth):
+    return CustomUser.objects.filter(ancestor_paths__ancestor=user, ancestor_paths__depth__lte=max_depth)
+
+
+def rebuild(max_depth=MAX_DEPTH):
+    # Reconstrói toda a tabela nível a nível com INSERT ... SELECT (sem percorrer linhas em Python)
+    paths = connection.ops.quote_name(ReferralPath._meta.db_table)
+    users = connection.ops.quote_name(CustomUser._meta.db_table)
+    total = 0
+    with transaction.atomic():
+        ReferralPath.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {paths} (ancestor_id, descendant_id, depth) "
+                f"SELECT invited_by_id, id, 1 FROM {users} WHERE invited_by_id IS NOT NULL"
+            )
+            inserted = cursor.rowcount
+            depth = 1
+            while inserted > 0 and depth < max_depth:
+                total += inserted
+                cursor.execute(
+                    f"INSERT INTO {paths} (ancestor_id, descendant_id, depth) "
+                    f"SELECT p.ancestor_id, u.id, p.depth + 1 FROM {paths} p "
+                    f"JOIN {users} u ON u.invited_by_id = p.descendant_id "
+                    f"WHERE p.depth = %s AND p.ancestor_id <> u.id "
+                    # Protege contra ciclos em invited_by (par já existente)
+                    f"AND NOT EXISTS (SELECT 1 FROM {paths} q "
+                    f"WHERE q.ancestor_id = p.ancestor_id AND q.descendant_id = u.id)",
+                    [depth],
+                )
+                inserted = cursor.rowcount
+                depth += 1
+            total += max(inserted, 0)
+    return total
+
+
+def add_users(user_ids):
+    # Versão em massa de add_user para usuários acabados de inserir (importações).
+    # Cada passo copia os caminhos de profundidade N do patrocinador; os
+    # patrocinadores do mesmo lote já receberam os seus no passo anterior.
+    if not user_ids:
+        return 0
+    paths = connection.ops.quote_name(ReferralPath._meta.db_table)
+    users = connection.ops.quote_name(CustomUser._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {paths} (ancestor_id, descendant_id, depth) "
+            f"SELECT invited_by_id, id, 1 FROM {users} WHERE invited_by_id IS NOT NULL AND id IN ({placeholders})",
+            list(user_ids),
+        )
+        inserted = cursor.rowcount
+        depth = 1
+        while inserted > 0 and depth < MAX_DEPTH:
+            total += inserted
+            cursor.execute(
+                f"INSERT INTO {paths} (ancestor_id, descendant_id, depth) "
+                f"SELECT p.ancestor_id, u.id, p.depth + 1 FROM {paths} p "
+                f"JOIN {users} u ON u.invited_by_id = p.descendant_id "
+                f"WHERE p.depth = %s AND u.id IN ({placeholders}) AND p.ancestor_id <> u.id "
+                f"AND NOT EXISTS (SELECT 1 FROM {paths} q "
+                f"WHERE q.ancestor_id = p.ancestor_id AND q.descendant_id = u.id)",
+                [depth, *user_ids],
+            )
+            inserted = cursor.rowcount
+            depth += 1
+        total += max(inserted, 0)
+    return total
+
+
+def link_subtree(user_id, sponsor_id):
+    # Liga um usuário que já tem descendentes a um patrocinador (importações com o
+    # patrocinador mais à frente no ficheiro): cada antepassado do patrocinador,
+    # e ele próprio, passa a ser antepassado do usuário e de toda a sua subárvore.
+    # Um INSERT ... SELECT só com os caminhos novos, sem reconstruir a tabela.
+    paths = connection.ops.quote_name(ReferralPath._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {paths} (ancestor_id, descendant_id, depth) "
+            f"SELECT up.ancestor_id, down.descendant_id, up.depth + down.depth FROM "
+            f"(SELECT %s AS ancestor_id, 1 AS depth UNION ALL "
+            f"SELECT ancestor_id, depth + 1 FROM {paths} WHERE descendant_id = %s) up, "
+            f"(SELECT %s AS descendant_id, 0 AS depth UNION ALL "
+            f"SELECT descendant_id, depth FROM {paths} WHERE ancestor_id = %s) down "
+            f"WHERE up.ancestor_id <> down.descendant_id AND up.depth + down.depth <= %s "
+            # Protege contra ciclos em invited_by (par já existente)
+            f"AND NOT EXISTS (SELECT 1 FROM {paths} q "
+            f"WHERE q.ancestor_id = up.ancestor_id AND q.descendant_id = down.descendant_id)",
+            [sponsor_id, sponsor_id, user_id, user_id, MAX_DEPTH],
+        )
+        return cursor.rowcount
@@ -0,0 +1,127 @@
+import random
+from collections import namedtuple
+from contextlib import nullcontext
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import balances, ledger, payouts, singletons
+from .models import LedgerEntry, Roulette, RoulettePrizeUsage
+
+# ---
+# Sorteio dos prêmios da roleta.
+# Os pesos de RoulettePrize são compilados num amostrador de alias (Walker):
+# construção O(n), guardada no cache partilhado e refeita só quando o admin
+# grava um prêmio; cada sorteio é O(1) (um índice e uma comparação).
+# Prêmios com orçamento diário reservam o valor com um UPDATE condicional na
+# transação do giro; esgotado o orçamento, o prêmio sai do sorteio.
+# Cada prêmio também é somado aos contadores de hora/dia (core/payouts.py);
+# esgotado o orçamento global, o sorteio continua só com os prêmios baixos.
+# ---
+
+Prize = namedtuple('Prize', ('id', 'amount', 'daily_budget'))
+
+
+class PrizesExhausted(Exception):
+    # Nenhum prêmio com peso cabe nos orçamentos
+    pass
+
+
+class AliasSampler:
+    def __init__(self, items, weights):
+        if not items or sum(weights) <= 0:
+            raise PrizesExhausted()
+        count = len(items)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        prob = [1.0] * count
+        alias = list(range(count))
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[less], alias[less] = scaled[less], more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # O que sobra (erros de arredondamento incluídos) fica com probabilidade 1
+
+        self.items = tuple(items)
+        self.weights = tuple(weights)
+        self.prob = tuple(prob)
+        self.alias = tuple(alias)
+
+    def draw(self, rng=random):
+        index = rng.randrange(len(self.items))
+        return self.items[index if rng.random() < self.prob[index] else self.alias[index]]
+
+    def only(self, keep):
+        # Novo amostrador com os itens aceites por keep, mantendo os pesos relativos
+        pairs = [(item, weight) for item, weight in zip(self.items, self.weights) if keep(item)]
+        return AliasSampler([item for item, _ in pairs], [weight for _, weight in pairs])
+
+    def without(self, item):
+        return self.only(lambda other: other != item)
+
+
+def _reserve(prize, day):
+    # Soma o prêmio ao total do dia só se couber no orçamento
+    usage = RoulettePrizeUsage.objects.filter(prize_id=prize.id, day=day, paid__lte=prize.daily_budget - prize.amount)
+    if usage.update(paid=F('paid') + prize.amount):
+        return True
+    # Primeiro prêmio do dia (ou orçamento esgotado): cria a linha se faltar e tenta de novo
+    RoulettePrizeUsage.objects.bulk_create([RoulettePrizeUsage(prize_id=prize.id, day=day)], ignore_conflicts=True)
+    return bool(usage.update(paid=F('paid') + prize.amount))
+
+
+class _PrizeSpent(Exception):
+    pass
+
+
+def _draws(sampler, rng, now):
+    # Prêmios sorteados e já reservados nos orçamentos, com a indicação de se já
+    # foram somados aos contadores globais (sem orçamento, o chamador soma-os em lote)
+    day = timezone.localdate(now)
+    checked = payouts.has_budget(now)
+    while True:
+        prize = sampler.draw(rng)
+        try:
+            # Com orçamento global, um savepoint desfaz a reserva do prêmio (e o
+            # período já somado) quando o prêmio não cabe no orçamento
+            with transaction.atomic() if checked else nullcontext():
+                if prize.daily_budget is not None and not _reserve(prize, day):
+                    raise _PrizeSpent()
+                if checked:
+                    payouts.add(prize.amount, now, rng=rng)
+        except _PrizeSpent:
+            sampler = sampler.without(prize)
+            continue
+        except payouts.BudgetExceeded:
+            # Orçamento esgotado: o resto do período só paga prêmios baixos (contados, sem limite)
+            low = settings.ROULETTE_LOW_PRIZE_MAX
+            sampler = sampler.only(lambda item: item.amount <= low)
+            checked = False
+            continue
+        yield prize, checked
+
+
+def spin(user, count=1, rng=random):
+    # Consome `count` giros e regista todos os prêmios numa única transação:
+    # um UPDATE de giros, um bulk_create de rodadas e um de lançamentos, um
+    # UPDATE de saldo e um por contador de período. Levanta NoSpinsAvailable se
+    # faltarem giros e PrizesExhausted se nenhum prêmio couber nos orçamentos.
+    user_id = getattr(user, 'pk', user)
+    sampler = singletons.roulette_sampler()
+    now = timezone.now()
+    with transaction.atomic():
+        balances.consume_spin(user_id, count)
+        draws = list(islice(_draws(sampler, rng, now), count))
+        prizes = [prize.amount for prize, _ in draws]
+        uncounted = [prize.amount for prize, counted in draws if not counted]
+        if uncounted:
+            payouts.add(sum(uncounted), now, checked=False, spins=len(uncounted), rng=rng)
+        Roulette.objects.bulk_create([Roulette(user_id=user_id, prize=amount, is_approved=True) for amount in prizes])
+        ledger.post_many(ledger.entry(user_id, LedgerEntry.ROULETTE_PRIZE, amount, amount) for amount in prizes)
+    return prizes
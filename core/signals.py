@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import dashboard, referrals, singletons, user_cache
+from .models import CustomUser, Deposit, Level, PlatformSettings, RoulettePrize, Task, UserDashboard, UserLevel, Withdrawal
+
+# ---
+# Mantém os dados derivados (resumos de core.dashboard, árvore de indicações,
+# cache das configurações e dos usuários) atualizados quando os dados mudam pelo ORM (views,
+# admin). Alterações em massa via queryset.update()/bulk_create não passam por aqui.
+# ---
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    # Novos usuários entram na árvore de indicações do patrocinador e recebem o
+    # resumo vazio (a primeira visita ao menu também é uma só consulta)
+    if created and not raw:
+        referrals.add_user(instance)
+        dashboard.create_empty(instance.pk)
+    elif not created:
+        user_cache.invalidate([instance.pk])
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    user_cache.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, created, **kwargs):
+    if created:
+        dashboard.record_task(instance.user_id, instance.earnings, instance.completed_at)
+    else:
+        dashboard.rebuild([instance.user_id])
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    if UserDashboard.objects.filter(user_id=instance.user_id).exists():
+        dashboard.rebuild([instance.user_id])
+
+
+@receiver(post_save, sender=Deposit)
+def deposit_saved(sender, instance, created, **kwargs):
+    # Um depósito novo e pendente não altera o resumo
+    if not created or instance.is_approved:
+        dashboard.refresh_deposits(instance.user_id)
+
+
+@receiver(post_delete, sender=Deposit)
+def deposit_deleted(sender, instance, **kwargs):
+    dashboard.refresh_deposits(instance.user_id, create=False)
+
+
+@receiver(post_save, sender=Withdrawal)
+def withdrawal_saved(sender, instance, created, **kwargs):
+    if not created or instance.status in dashboard.APPROVED_WITHDRAWAL_STATUSES:
+        dashboard.refresh_withdrawals(instance.user_id)
+
+
+@receiver(post_delete, sender=Withdrawal)
+def withdrawal_deleted(sender, instance, **kwargs):
+    dashboard.refresh_withdrawals(instance.user_id, create=False)
+
+
+@receiver(post_save, sender=UserLevel)
+def user_level_saved(sender, instance, **kwargs):
+    dashboard.refresh_active_level(instance.user_id)
+    user_cache.invalidate([instance.user_id])
+
+
+@receiver(post_delete, sender=UserLevel)
+def user_level_deleted(sender, instance, **kwargs):
+    dashboard.refresh_active_level(instance.user_id, create=False)
+    user_cache.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=Level)
+@receiver(post_delete, sender=Level)
+@receiver(post_save, sender=PlatformSettings)
+@receiver(post_delete, sender=PlatformSettings)
+@receiver(post_save, sender=RoulettePrize)
+@receiver(post_delete, sender=RoulettePrize)
+def singleton_settings_changed(sender, **kwargs):
+    # Nova versão das chaves de cache: todos os workers deixam de ver a cópia antiga.
+    # Muda já (as leituras desta transação veem a alteração) e de novo depois do
+    # commit: antes dele, outro pedido ainda lê a linha antiga e pode guardá-la na versão nova
+    singletons.invalidate()
+    transaction.on_commit(singletons.invalidate)
@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Level, PlatformSettings, RoulettePrize
+
+# ---
+# Cache das configurações singleton (PlatformSettings), do catálogo de
+# níveis e do amostrador de prêmios da roleta.
+# As chaves levam um número de versão guardado no próprio cache: ao gravar
+# as configurações no admin, o sinal post_save incrementa a versão e todos
+# os workers que partilham o cache passam a ler a nova entrada.
+# ---
+
+VERSION_KEY = 'core:singletons:version'
+
+# Prêmios (com o mesmo peso) usados quando não há nenhum RoulettePrize
+DEFAULT_PRIZES = (
+    Decimal('100'), Decimal('200'), Decimal('300'), Decimal('500'), Decimal('1000'), Decimal('2000'),
+)
+
+# Marca "não existe linha" (None não pode ser distinguido de falta no cache)
+_MISSING = 'missing'
+
+
+def _timeout():
+    return getattr(settings, 'SINGLETON_CACHE_TIMEOUT', 300)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # A versão expirou ou nunca foi criada
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def _cached(name, loader):
+    key = f'core:singletons:{name}:v{_version()}'
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        cache.set(key, _MISSING if value is None else value, _timeout())
+        return value
+    return None if value == _MISSING else value
+
+
+def platform_settings():
+    return _cached('platform', lambda: PlatformSettings.objects.first())
+
+
+def levels():
+    # Catálogo de níveis (muda raramente; invalidado quando um nível é gravado)
+    return _cached('levels', lambda: list(Level.objects.order_by('deposit_value')))
+
+
+def _load_roulette_sampler():
+    from .roulette import AliasSampler, Prize
+
+    rows = RoulettePrize.objects.filter(weight__gt=0).values_list('pk', 'amount', 'daily_budget', 'weight')
+    prizes = [(Prize(pk, amount, budget), weight) for pk, amount, budget, weight in rows]
+    if not prizes:
+        prizes = [(Prize(None, amount, None), 1) for amount in DEFAULT_PRIZES]
+    return AliasSampler([prize for prize, _ in prizes], [weight for _, weight in prizes])
+
+
+def roulette_sampler():
+    # Amostrador de alias já construído: refeito só quando um prêmio é gravado
+    return _cached('roulette_sampler', _load_roulette_sampler)
@@ -0,0 +1,22 @@
+import uuid
+
+from django import template
+from django.utils.html import format_html
+
+from ..throttling import IDEMPOTENCY_FIELD
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_key():
+    # Chave para os pedidos fetch de uma ação: a página só a troca depois de
+    # receber a resposta, logo cliques repetidos enquanto o pedido corre partilham-na
+    return uuid.uuid4().hex
+
+
+@register.simple_tag
+def idempotency_field():
+    # Uma chave nova por formulário desenhado: submeter a mesma página duas vezes
+    # (duplo clique, reenvio do navegador) repete a resposta do primeiro envio
+    return format_html('<input type="hidden" name="{}" value="{}">', IDEMPOTENCY_FIELD, idempotency_key())
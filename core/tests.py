@@ -1,3 +1,1317 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import random
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.contrib.auth.hashers import make_password
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import admin as admin_site
+from . import balances, commissions, daily_earnings, dashboard, deposits, images, invite_codes, ledger, loadtest, payouts, profiling, referrals, roulette, singletons, throttling, uploads, user_cache, user_import, views, withdrawals
+from .backends import CachedModelBackend
+from .dates import day_filter
+from .forms import DepositForm
+from .models import (
+    BankDetails, CommissionEvent, CustomUser, Deposit, LedgerEntry, Level, PlatformSettings, ReferralPath, Roulette, RoulettePayoutCounter, RoulettePrize, Task, UserDashboard, UserLevel,
+    Withdrawal,
+)
+
+
+class BalanceServiceTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('923000001', 'senha-forte-123')
+
+    def test_credit_returns_new_balance_and_writes_ledger(self):
+        new_balance = balances.credit(self.user, LedgerEntry.ROULETTE_PRIZE, Decimal('150.00'), Decimal('150.00'))
+
+        self.assertEqual(new_balance, Decimal('150.00'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.available_balance, Decimal('150.00'))
+        self.assertEqual(self.user.subsidy_balance, Decimal('150.00'))
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user).count(), 1)
+
+    def test_debit_without_funds_changes_nothing(self):
+        balances.credit(self.user, LedgerEntry.DEPOSIT, Decimal('100.00'))
+
+        with self.assertRaises(balances.InsufficientBalance):
+            balances.debit(self.user, LedgerEntry.WITHDRAWAL, Decimal('100.01'))
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.available_balance, Decimal('100.00'))
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user).count(), 1)
+
+    def test_consume_spin_stops_at_zero(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(roulette_spins=1)
+
+        self.assertEqual(balances.consume_spin(self.user), 0)
+        with self.assertRaises(balances.NoSpinsAvailable):
+            balances.consume_spin(self.user)
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    # As threads abrem ligações próprias: a base de testes tem de ser partilhada
+    # (PostgreSQL, ou o SQLite em ficheiro configurado em DATABASES TEST NAME)
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('A base de testes SQLite em memória não é partilhada entre threads.')
+
+
+class BalanceConcurrencyTests(ConcurrencyTestCase):
+    spinners = 50
+
+    def test_parallel_spinners_do_not_lose_updates(self):
+        user = CustomUser.objects.create_user('923000002', 'senha-forte-123')
+        CustomUser.objects.filter(pk=user.pk).update(roulette_spins=self.spinners // 2)
+        barrier = threading.Barrier(self.spinners)
+
+        def spin():
+            barrier.wait()
+            try:
+                with transaction.atomic():
+                    balances.consume_spin(user.pk)
+                    balances.credit(user.pk, LedgerEntry.ROULETTE_PRIZE, Decimal('100.00'), Decimal('100.00'))
+            except balances.NoSpinsAvailable:
+                pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=spin) for _ in range(self.spinners)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        user.refresh_from_db()
+        self.assertEqual(user.roulette_spins, 0)
+        self.assertEqual(user.available_balance, Decimal('100.00') * (self.spinners // 2))
+        self.assertEqual(LedgerEntry.objects.filter(user=user).count(), self.spinners // 2)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('923000003', 'senha-forte-123')
+        self.level = Level.objects.create(
+            name='Bronze', deposit_value=5000, daily_gain=300, monthly_gain=9000, cycle_days=30, image='nivel.png',
+        )
+
+    def test_incremental_updates_match_rebuild(self):
+        dashboard.get(self.user)
+        user_level = UserLevel.objects.create(user=self.user, level=self.level)
+        Task.objects.create(user=self.user, earnings=Decimal('300.00'))
+        Deposit.objects.create(user=self.user, amount=Decimal('5000.00'), proof_of_payment='p.png', is_approved=True)
+        Withdrawal.objects.create(user=self.user, amount=Decimal('2500.00'), status=Withdrawal.APPROVED)
+
+        with self.assertNumQueries(1):
+            snapshot = dashboard.get(self.user)
+            self.assertEqual(snapshot.active_level.level.name, 'Bronze')
+        incremental = (
+            snapshot.active_level_id, snapshot.approved_deposit_total, snapshot.approved_withdrawal_total,
+            snapshot.task_income_total, snapshot.today_income,
+        )
+
+        dashboard.rebuild()
+        snapshot = dashboard.get(self.user)
+        rebuilt = (
+            snapshot.active_level_id, snapshot.approved_deposit_total, snapshot.approved_withdrawal_total,
+            snapshot.task_income_total, snapshot.today_income,
+        )
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual(rebuilt, (
+            user_level.pk, Decimal('5000.00'), Decimal('2500.00'), Decimal('300.00'), Decimal('300.00'),
+        ))
+
+
+class SingletonCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_settings_are_read_once_and_invalidated_on_save(self):
+        platform = PlatformSettings.objects.create(
+            whatsapp_link='https://chat.whatsapp.com/a', history_text='h',
+            deposit_instruction='d', withdrawal_instruction='w',
+        )
+        singletons.platform_settings()
+        with self.assertNumQueries(0):
+            self.assertEqual(singletons.platform_settings().whatsapp_link, 'https://chat.whatsapp.com/a')
+
+        platform.whatsapp_link = 'https://chat.whatsapp.com/b'
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            platform.save()
+            version = cache.get(singletons.VERSION_KEY)
+        # A versão muda outra vez depois do commit: uma cópia antiga guardada entretanto é descartada
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(cache.get(singletons.VERSION_KEY), version + 1)
+        self.assertEqual(singletons.platform_settings().whatsapp_link, 'https://chat.whatsapp.com/b')
+
+    def test_prize_sampler_is_cached_and_rebuilt_on_save(self):
+        prize = RoulettePrize.objects.create(amount=100, weight=3)
+        self.assertEqual(singletons.roulette_sampler().weights, (3,))
+        with self.assertNumQueries(0):
+            singletons.roulette_sampler()
+
+        prize.weight = 5
+        prize.save()
+        self.assertEqual(singletons.roulette_sampler().weights, (5,))
+
+
+class RouletteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('923000074', 'senha-forte-123', roulette_spins=50)
+
+    def test_alias_sampler_follows_the_weights(self):
+        sampler = roulette.AliasSampler(['a', 'b', 'c'], [1, 3, 6])
+        rng = random.Random(7)
+        draws = [sampler.draw(rng) for _ in range(20000)]
+
+        for item, share in (('a', 0.1), ('b', 0.3), ('c', 0.6)):
+            self.assertAlmostEqual(draws.count(item) / len(draws), share, delta=0.015)
+        self.assertEqual(sampler.without('c').weights, (1, 3))
+
+    def test_bulk_spin_records_every_prize_in_one_transaction(self):
+        RoulettePrize.objects.create(amount=100, weight=1)
+        RoulettePrize.objects.create(amount=300, weight=1)
+        roulette.spin(self.user)
+
+        # Giros, rodadas, lançamentos, saldo e contadores (mais os savepoints): não cresce com o número de giros
+        with self.assertNumQueries(9):
+            roulette.spin(self.user, 20)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.roulette_spins, 29)
+        self.assertEqual(Roulette.objects.filter(user=self.user).count(), 21)
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user, entry_type=LedgerEntry.ROULETTE_PRIZE).count(), 21)
+        with self.assertRaises(balances.NoSpinsAvailable):
+            roulette.spin(self.user, 30)
+
+    def test_view_spins_in_bulk(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('spin_roulette'), {'count': 5})
+
+        self.assertEqual(len(response.json()['prizes']), 5)
+        self.assertEqual(Roulette.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(self.client.post(reverse('spin_roulette'), {'count': 1000}).status_code, 400)
+
+    def test_prize_leaves_the_draw_when_its_daily_budget_is_spent(self):
+        RoulettePrize.objects.create(amount=100, weight=1)
+        jackpot = RoulettePrize.objects.create(amount=5000, weight=1000, daily_budget=10000)
+
+        prizes = roulette.spin(self.user, 30, rng=random.Random(3))
+
+        self.assertEqual(prizes.count(Decimal('5000')), 2)
+        self.assertEqual(prizes.count(Decimal('100')), 28)
+        self.assertEqual(jackpot.usage.get().paid, Decimal('10000'))
+
+    def test_payouts_are_counted_without_scanning_rounds(self):
+        RoulettePrize.objects.create(amount=100, weight=1)
+        RoulettePrize.objects.create(amount=300, weight=1)
+        prizes = roulette.spin(self.user, 10) + roulette.spin(self.user, 10)
+
+        with self.assertNumQueries(2):
+            report = payouts.exposure()
+        for period in ('hour', 'day'):
+            self.assertEqual(report[period]['paid'], sum(prizes))
+            self.assertEqual(report[period]['spins'], 20)
+            self.assertIsNone(report[period]['remaining'])
+
+    @override_settings(ROULETTE_DAILY_BUDGET=Decimal('3000'), ROULETTE_PAYOUT_SHARDS=2, ROULETTE_LOW_PRIZE_MAX=Decimal('100'))
+    def test_exhausted_budget_falls_back_to_low_prizes(self):
+        RoulettePrize.objects.create(amount=100, weight=1)
+        RoulettePrize.objects.create(amount=1000, weight=20)
+
+        prizes = roulette.spin(self.user, 30, rng=random.Random(5))
+
+        self.assertLessEqual(sum(prize for prize in prizes if prize > 100), Decimal('3000'))
+        self.assertEqual(prizes[-1], Decimal('100'))
+        report = payouts.exposure()
+        self.assertEqual(report['day']['paid'], sum(prizes))
+        self.assertEqual(report['day']['spins'], 30)
+        self.assertEqual(report['day']['remaining'], Decimal('0.00'))
+
+    @override_settings(ROULETTE_DAILY_BUDGET=Decimal('10000'), ROULETTE_PAYOUT_SHARDS=8)
+    def test_prize_larger_than_a_shard_share_is_paid_while_the_period_has_room(self):
+        # A parte de cada fragmento é 1250: o prêmio de 2000 é repartido por vários
+        for _ in range(5):
+            payouts.add(Decimal('2000'))
+        with self.assertRaises(payouts.BudgetExceeded):
+            payouts.add(Decimal('100'))
+
+        report = payouts.exposure()
+        self.assertEqual((report['day']['paid'], report['day']['spins']), (Decimal('10000'), 5))
+        self.assertFalse(RoulettePayoutCounter.objects.filter(period='day', paid__gt=Decimal('1250')).exists())
+
+    def test_exposure_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('roulette_exposure')).status_code, 302)
+        self.client.force_login(CustomUser.objects.create_user('923000075', 'senha-forte-123', is_staff=True))
+        self.assertEqual(self.client.get(reverse('roulette_exposure')).json()['prizes'], [])
+
+    def test_spin_fails_without_spending_when_every_prize_is_exhausted(self):
+        RoulettePrize.objects.create(amount=5000, weight=1, daily_budget=5000)
+
+        roulette.spin(self.user)
+        with self.assertRaises(roulette.PrizesExhausted):
+            roulette.spin(self.user)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.roulette_spins, 49)
+
+
+class IndexUsageTests(TestCase):
+    # Garante que os filtros por usuário/dia dos views usam os índices compostos
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('EXPLAIN verificado apenas em SQLite e PostgreSQL.')
+        self.user = CustomUser.objects.create_user('923000004', 'senha-forte-123')
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # Tabelas de teste são minúsculas: força o planeador a considerar os índices
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_task_day_filter_uses_index(self):
+        self.assertUsesIndex(Task.objects.filter(user=self.user, **day_filter('completed_at')), 'core_task_user_done_idx')
+
+    def test_withdrawal_day_filter_uses_index(self):
+        queryset = Withdrawal.objects.filter(
+            user=self.user, status__in=Withdrawal.ACTIVE_STATUSES, **day_filter('created_at'),
+        )
+        self.assertUsesIndex(queryset, 'core_withdraw_user_status_idx')
+
+    def test_approved_deposits_use_index(self):
+        self.assertUsesIndex(Deposit.objects.filter(user=self.user, is_approved=True), 'core_deposit_user_appr_idx')
+
+    def test_active_level_uses_partial_index(self):
+        self.assertUsesIndex(UserLevel.objects.filter(user=self.user, is_active=True), 'core_userlevel_active_idx')
+
+
+class DashboardSignupTests(TestCase):
+    def test_new_user_menu_is_a_single_lookup(self):
+        user = CustomUser.objects.create_user('923000013', 'senha-forte-123')
+        self.assertTrue(UserDashboard.objects.filter(user=user, today_date=timezone.localdate()).exists())
+        with self.assertNumQueries(1):
+            snapshot = dashboard.get(user)
+        self.assertEqual((snapshot.today_income, snapshot.task_income_total), (Decimal('0.00'), Decimal('0.00')))
+
+
+class DailyEarningsTests(TestCase):
+    def setUp(self):
+        self.level = Level.objects.create(
+            name='Prata', deposit_value=10000, daily_gain=600, monthly_gain=18000, cycle_days=30, image='nivel.png',
+        )
+        self.sponsor = CustomUser.objects.create_user('923000010', 'senha-forte-123')
+        UserLevel.objects.create(user=self.sponsor, level=self.level)
+        self.member = CustomUser.objects.create_user('923000011', 'senha-forte-123', invited_by=self.sponsor)
+        UserLevel.objects.create(user=self.member, level=self.level)
+
+    def test_credits_once_per_day(self):
+        first = daily_earnings.run(chunk_size=1)
+        second = daily_earnings.run(chunk_size=1)
+
+        self.assertEqual(first['credited'], 2)
+        self.assertEqual(first['subsidies'], 1)
+        self.assertEqual(second['credited'], 0)
+        self.assertEqual(second['skipped'], 2)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.available_balance, Decimal('600.00'))
+
+        # O subsídio do patrocinador passa pela caixa de saída, como o dos cliques
+        event = CommissionEvent.objects.get()
+        self.assertEqual(
+            (event.sponsor_id, event.source_user_id, event.kind, event.amount),
+            (self.sponsor.pk, self.member.pk, CommissionEvent.TASK_SUBSIDY, commissions.TASK_SUBSIDY_AMOUNT),
+        )
+        self.sponsor.refresh_from_db()
+        self.assertEqual(self.sponsor.available_balance, Decimal('600.00'))
+        commissions.process_batch()
+        self.sponsor.refresh_from_db()
+        self.assertEqual(self.sponsor.available_balance, Decimal('700.00'))
+        self.assertEqual(self.sponsor.subsidy_balance, Decimal('100.00'))
+
+    def test_click_between_the_check_and_the_insert_is_not_paid_twice(self):
+        insert_tasks = daily_earnings._insert_tasks
+
+        def click_first(earning, day):
+            # O clique ocupa a primeira posição depois da consulta das tarefas já feitas
+            Task.objects.create(user=self.member, earnings=600, task_day=day, slot=0)
+            return insert_tasks(earning, day)
+
+        with mock.patch.object(daily_earnings, '_insert_tasks', click_first):
+            stats = daily_earnings.run()
+
+        self.assertEqual((stats['credited'], stats['skipped']), (1, 1))
+        self.assertEqual(Task.objects.filter(user=self.member).count(), 1)
+        self.assertFalse(LedgerEntry.objects.filter(user=self.member).exists())
+        # O subsídio do clique é emitido por process_task, não pelo motor
+        self.assertFalse(CommissionEvent.objects.exists())
+
+    def test_insert_fallback_records_each_task_once(self):
+        dashboard.get(self.member)
+        # Bases sem INSERT ... RETURNING: uma tarefa por savepoint
+        with mock.patch.object(connection.features, 'can_return_columns_from_insert', False):
+            stats = daily_earnings.run()
+
+        self.assertEqual(stats['credited'], 2)
+        summary = dashboard.get(self.member)
+        self.assertEqual((summary.today_income, summary.task_income_total), (Decimal('600.00'), Decimal('600.00')))
+
+    def test_expired_levels_are_deactivated_without_earning(self):
+        purchased = timezone.now() - timedelta(days=31)
+        UserLevel.objects.filter(user=self.member).update(purchase_date=purchased)
+        CustomUser.objects.filter(pk=self.member.pk).update(level_active=True)
+
+        stats = daily_earnings.run()
+
+        self.assertEqual(stats['expired'], 1)
+        self.assertFalse(UserLevel.objects.filter(user=self.member, is_active=True).exists())
+        self.member.refresh_from_db()
+        self.assertFalse(self.member.level_active)
+        self.assertEqual(self.member.available_balance, Decimal('0.00'))
+
+
+class TaskQuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.level = Level.objects.create(
+            name='Diamante', deposit_value=20000, daily_gain=900, monthly_gain=27000, cycle_days=30, image='nivel.png',
+            max_tasks=2,
+        )
+        self.user = CustomUser.objects.create_user('923000012', 'senha-forte-123')
+        UserLevel.objects.create(user=self.user, level=self.level)
+        self.client.force_login(self.user)
+
+    def test_level_sets_the_daily_quota(self):
+        results = [self.client.post(reverse('process_task')).json()['success'] for _ in range(3)]
+
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(
+            sorted(Task.objects.filter(user=self.user, task_day=timezone.localdate()).values_list('slot', flat=True)), [0, 1],
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.available_balance, Decimal('1800.00'))
+        self.assertEqual(self.client.get(reverse('tarefa')).context['tasks_completed_today'], 2)
+
+    @override_settings(REQUEST_PROFILING=True, QUERY_BUDGET_STRICT=True)
+    def test_every_slot_stays_within_the_query_budget(self):
+        # Cada clique tenta direto a posição seguinte: a segunda tarefa custa o mesmo que a primeira
+        daily_earnings.run()
+        self.assertTrue(self.client.post(reverse('process_task')).json()['success'])
+        self.assertFalse(self.client.post(reverse('process_task')).json()['success'])
+
+    def test_click_takes_the_next_slot_after_the_daily_engine(self):
+        daily_earnings.run()
+        self.assertTrue(self.client.post(reverse('process_task')).json()['success'])
+        self.assertFalse(self.client.post(reverse('process_task')).json()['success'])
+        self.assertEqual(daily_earnings.run()['credited'], 0)
+
+
+class TaskQuotaConcurrencyTests(ConcurrencyTestCase):
+    clicks = 100
+
+    # Todos os cliques chegam à base de dados (sem o limite de pedidos por usuário)
+    @override_settings(RATE_LIMITING=False)
+    def test_parallel_clicks_complete_a_single_task(self):
+        level = Level.objects.create(
+            name='Bronze', deposit_value=5000, daily_gain=300, monthly_gain=9000, cycle_days=30, image='nivel.png',
+        )
+        user = CustomUser.objects.create_user('923000013', 'senha-forte-123')
+        UserLevel.objects.create(user=user, level=level)
+        barrier = threading.Barrier(self.clicks)
+        results = []
+
+        def click():
+            client = Client()
+            client.force_login(user)
+            barrier.wait()
+            try:
+                results.append(client.post(reverse('process_task')).json()['success'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click) for _ in range(self.clicks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Task.objects.filter(user=user).count(), 1)
+        user.refresh_from_db()
+        self.assertEqual(user.available_balance, Decimal('300.00'))
+
+
+class TeamViewTests(TestCase):
+    def test_query_count_does_not_grow_with_levels_or_members(self):
+        sponsor = CustomUser.objects.create_user('923000020', 'senha-forte-123')
+        self.client.force_login(sponsor)
+
+        def page_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('equipa'), {'aba': 0})
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        CustomUser.objects.create_user('923000049', 'senha-forte-123', invited_by=sponsor)
+        baseline = page_queries()
+        for index in range(5):
+            level = Level.objects.create(
+                name=f'Nível {index}', deposit_value=1000 * (index + 1), daily_gain=100,
+                monthly_gain=3000, cycle_days=30, image='nivel.png',
+            )
+            member = CustomUser.objects.create_user(f'92300003{index}', 'senha-forte-123', invited_by=sponsor)
+            UserLevel.objects.create(user=member, level=level)
+            CustomUser.objects.create_user(f'92300004{index}', 'senha-forte-123', invited_by=sponsor)
+
+        self.assertEqual(page_queries(), baseline)
+        response = self.client.get(reverse('equipa'))
+        self.assertEqual(response.context['team_count'], 11)
+        self.assertEqual(response.context['total_investors'], 5)
+        self.assertEqual(response.context['total_non_investors'], 6)
+        self.assertEqual(len(response.context['members_page']), 6)
+
+
+class ReferralTreeTests(TestCase):
+    def test_paths_maintained_on_signup_match_rebuild(self):
+        root = CustomUser.objects.create_user('923000050', 'senha-forte-123')
+        child = CustomUser.objects.create_user('923000051', 'senha-forte-123', invited_by=root)
+        CustomUser.objects.create_user('923000052', 'senha-forte-123', invited_by=child)
+        CustomUser.objects.create_user('923000053', 'senha-forte-123', invited_by=child)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(referrals.descendant_counts(root, max_depth=5), {1: 1, 2: 2})
+        maintained = set(ReferralPath.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+        referrals.rebuild()
+        self.assertEqual(set(ReferralPath.objects.values_list('ancestor_id', 'descendant_id', 'depth')), maintained)
+        self.assertEqual(referrals.descendants(root, max_depth=1).get(), child)
+
+
+class CommissionOutboxTests(TestCase):
+    def setUp(self):
+        self.level = Level.objects.create(
+            name='Ouro', deposit_value=20000, daily_gain=1200, monthly_gain=36000, cycle_days=30, image='nivel.png',
+        )
+        self.sponsor = CustomUser.objects.create_user('923000060', 'senha-forte-123')
+        self.idle_sponsor = CustomUser.objects.create_user('923000061', 'senha-forte-123')
+        UserLevel.objects.create(user=self.sponsor, level=self.level)
+        self.member = CustomUser.objects.create_user('923000062', 'senha-forte-123', invited_by=self.sponsor)
+
+    def test_events_are_aggregated_per_sponsor_and_applied_once(self):
+        for _ in range(3):
+            commissions.emit(self.sponsor.pk, self.member, CommissionEvent.TASK_SUBSIDY, Decimal('100.00'))
+        commissions.emit(self.sponsor.pk, self.member, CommissionEvent.LEVEL_COMMISSION, Decimal('3000.00'))
+        commissions.emit(self.idle_sponsor.pk, self.member, CommissionEvent.TASK_SUBSIDY, Decimal('100.00'))
+
+        stats = commissions.process_batch()
+        self.assertEqual(stats, {'events': 5, 'credited': 4, 'skipped': 1, 'sponsors': 1})
+        self.assertEqual(commissions.process_batch()['events'], 0)
+
+        self.sponsor.refresh_from_db()
+        self.idle_sponsor.refresh_from_db()
+        self.assertEqual(self.sponsor.available_balance, Decimal('3300.00'))
+        self.assertEqual(self.sponsor.subsidy_balance, Decimal('3300.00'))
+        self.assertEqual(self.idle_sponsor.available_balance, Decimal('0.00'))
+        self.assertEqual(LedgerEntry.objects.filter(user=self.sponsor).count(), 1)
+
+
+class LoadTestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _at(self, hour):
+        # O saque só é aceite das 9h às 17h (hora local)
+        moment = timezone.localtime().replace(hour=hour, minute=0, second=0, microsecond=0)
+        return mock.patch('django.utils.timezone.now', return_value=moment)
+
+    def test_client_flow_reports_every_step_without_errors(self):
+        dataset = loadtest.seed(users=20, fanout=3)
+        with self._at(12):
+            report = loadtest.run_client(dataset, flows=2)
+
+        self.assertEqual(report['overall']['requests'], 16)
+        self.assertEqual(set(report['steps']), {
+            'cadastro', 'login', 'menu', 'nivel', 'tarefa', 'process_task', 'spin_roulette', 'saque',
+        })
+        self.assertFalse(any(step['errors'] for step in report['steps'].values()))
+        self.assertTrue(Roulette.objects.filter(user__phone_number__startswith=dataset.prefix).exists())
+        self.assertEqual(Withdrawal.objects.filter(user__phone_number__startswith=dataset.prefix).count(), 2)
+
+        loadtest.cleanup(dataset)
+        self.assertFalse(CustomUser.objects.filter(phone_number__startswith=dataset.prefix).exists())
+
+    def test_refused_form_redirect_counts_as_an_error(self):
+        dataset = loadtest.seed(users=20, fanout=3)
+        with self._at(20):
+            report = loadtest.run_client(dataset, flows=2)
+
+        # Fora do horário o saque redireciona para a mesma página, mas com uma mensagem de erro
+        self.assertEqual(report['steps']['saque']['errors'], 2)
+        self.assertEqual(report['steps']['nivel']['errors'], 0)
+        self.assertFalse(Withdrawal.objects.filter(user__phone_number__startswith=dataset.prefix).exists())
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        profiling.registry.reset()
+        self.level = Level.objects.create(
+            name='Prata', deposit_value=5000, daily_gain=300, monthly_gain=9000, cycle_days=30, image='nivel.png',
+        )
+        self.sponsor = CustomUser.objects.create_user('923000070', 'senha-forte-123')
+        UserLevel.objects.create(user=self.sponsor, level=self.level)
+        self.user = CustomUser.objects.create_user(
+            '923000071', 'senha-forte-123', invited_by=self.sponsor,
+            available_balance=Decimal('20000.00'), roulette_spins=1,
+        )
+        self.client.force_login(self.user)
+
+    def test_views_stay_within_their_query_budgets(self):
+        # Cada pedido com as caches frias: o orçamento é o plano de consultas no pior caso
+        def cold(method, name, data=None):
+            cache.clear()
+            return getattr(self.client, method)(reverse(name), data)
+
+        # home redireciona quem já entrou
+        self.assertEqual(cold('get', 'home').status_code, 302)
+        for name in ('menu', 'deposito', 'saque', 'tarefa', 'nivel', 'equipa', 'roleta', 'sobre', 'perfil', 'renda'):
+            self.assertEqual(cold('get', name).status_code, 200, name)
+        self.assertEqual(cold('post', 'nivel', {'level_id': self.level.pk}).status_code, 302)
+        self.assertEqual(cold('get', 'tarefa').context['has_active_level'], True)
+        self.assertTrue(cold('post', 'process_task').json()['success'])
+        self.assertTrue(cold('post', 'spin_roulette').json()['success'])
+        cold('post', 'perfil', {'update_bank': '1', 'bank_name': 'BAI', 'IBAN': 'AO06', 'account_holder_name': 'Titular'})
+        with mock.patch('django.utils.timezone.now', return_value=timezone.localtime().replace(hour=12)):
+            cold('post', 'saque', {'amount': '2500'})
+        self.assertTrue(Withdrawal.objects.filter(user=self.user).exists())
+
+        cold('post', 'logout')
+        cold('post', 'cadastro', {
+            'phone_number': '923000072', 'password': 'senha-forte-123', 'confirm_password': 'senha-forte-123',
+            'invited_by_code': self.sponsor.invite_code,
+        })
+        cold('post', 'logout')
+        self.assertEqual(cold('post', 'login', {'username': '923000071', 'password': 'senha-forte-123'}).status_code, 302)
+        # A equipa do patrocinador, com a aba dos investidores do nível
+        self.client.force_login(self.sponsor)
+        self.assertEqual(len(cold('get', 'equipa', {'aba': self.level.pk}).context['members_page']), 1)
+
+        report = profiling.registry.snapshot()
+        self.assertEqual(set(report), set(profiling.QUERY_BUDGETS))
+        self.assertTrue(all(view['over_budget'] == 0 for view in report.values()))
+
+    def test_savepoints_are_not_counted(self):
+        UserLevel.objects.create(user=self.user, level=self.level)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.client.post(reverse('process_task')).json()['success'])
+        savepoints = [query for query in queries if query['sql'].startswith(profiling.SAVEPOINT_STATEMENTS)]
+        # Nos testes a transação da view também é um savepoint: só as consultas contam
+        self.assertTrue(savepoints)
+        self.assertEqual(profiling.registry.snapshot()['process_task']['queries_mean'], len(queries) - len(savepoints))
+
+    def test_unknown_level_is_not_found(self):
+        self.assertEqual(self.client.post(reverse('nivel'), {'level_id': '999999'}).status_code, 404)
+        self.assertFalse(UserLevel.objects.filter(user=self.user).exists())
+
+    def test_exceeding_the_budget_fails(self):
+        with self.assertRaises(profiling.QueryBudgetExceeded):
+            with self.settings(REQUEST_PROFILING=True):
+                profiling.QUERY_BUDGETS['sobre'], budget = 0, profiling.QUERY_BUDGETS['sobre']
+                try:
+                    self.client.get(reverse('sobre'))
+                finally:
+                    profiling.QUERY_BUDGETS['sobre'] = budget
+
+    def test_metrics_are_staff_only(self):
+        self.client.get(reverse('menu'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+        staff = CustomUser.objects.create_user('923000072', 'senha-forte-123', is_staff=True)
+        self.client.force_login(staff)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('core_view_queries_count{view="menu"} 1', body)
+        self.assertIn('core_view_duration_ms_bucket{view="menu",component="template",le="+Inf"} 1', body)
+        self.assertEqual(self.client.get(reverse('profiling')).json()['views']['menu']['requests'], 1)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profiling.registry.reset()
+        level = Level.objects.create(
+            name='Ouro', deposit_value=5000, daily_gain=300, monthly_gain=9000, cycle_days=30, image='nivel.png',
+        )
+        self.user = CustomUser.objects.create_user('923000073', 'senha-forte-123', roulette_spins=2)
+        UserLevel.objects.create(user=self.user, level=level)
+
+    async def test_repeated_clicks_complete_a_single_task(self):
+        await self.async_client.aforce_login(self.user)
+        responses = await asyncio.gather(*(self.async_client.post(reverse('process_task')) for _ in range(3)))
+
+        self.assertEqual(sorted(response.json()['success'] for response in responses), [False, False, True])
+        self.assertEqual(await Task.objects.filter(user=self.user).acount(), 1)
+        self.assertEqual(profiling.registry.snapshot()['process_task']['requests'], 3)
+
+    async def test_spins_never_go_negative(self):
+        await self.async_client.aforce_login(self.user)
+        responses = await asyncio.gather(*(self.async_client.post(reverse('spin_roulette')) for _ in range(3)))
+
+        self.assertEqual(sum(response.json()['success'] for response in responses), 2)
+        user = await CustomUser.objects.aget(pk=self.user.pk)
+        self.assertEqual(user.roulette_spins, 0)
+        self.assertEqual(await Roulette.objects.filter(user=self.user).acount(), 2)
+        self.assertEqual(await LedgerEntry.objects.filter(user=self.user, entry_type=LedgerEntry.ROULETTE_PRIZE).acount(), 2)
+
+    async def test_duplicates_with_the_same_key_get_the_first_response(self):
+        await self.async_client.aforce_login(self.user)
+        headers = {'Idempotency-Key': 'giro-0001-abcdef'}
+        responses = await asyncio.gather(
+            *(self.async_client.post(reverse('spin_roulette'), headers=headers) for _ in range(3))
+        )
+
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertTrue(responses[0].json()['success'])
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), 2)
+        self.assertEqual(await Roulette.objects.filter(user=self.user).acount(), 1)
+        # Uma chave nova é um pedido novo
+        response = await self.async_client.post(reverse('spin_roulette'), headers={'Idempotency-Key': 'giro-0002-abcdef'})
+        self.assertTrue(response.json()['success'])
+
+    async def test_clicks_beyond_the_burst_are_refused(self):
+        await self.async_client.aforce_login(self.user)
+        burst, _ = throttling.RATE_LIMITS['process_task']['user']
+        statuses = [(await self.async_client.post(reverse('process_task'))).status_code for _ in range(burst + 1)]
+
+        self.assertEqual(statuses, [200] * burst + [429])
+        response = await self.async_client.post(reverse('process_task'))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_token_bucket_refills_over_the_period(self):
+        # 2 fichas, reenchidas em 10 s (uma a cada 5 s)
+        self.assertEqual([throttling.take_token('teste', 2, 10, now=100) for _ in range(2)], [0, 0])
+        self.assertEqual(throttling.take_token('teste', 2, 10, now=100), 5)
+        # Um pedido recusado não gasta fichas
+        self.assertEqual(throttling.take_token('teste', 2, 10, now=104), 1)
+        self.assertEqual(throttling.take_token('teste', 2, 10, now=105), 0)
+        self.assertEqual(throttling.take_token('teste', 2, 10, now=200), 0)
+        self.assertEqual(throttling.take_token('teste', 2, 10, now=200), 0)
+
+    def test_ip_bucket_is_skipped_without_the_client_address(self):
+        with mock.patch.dict(throttling.RATE_LIMITS, {'nivel': {'user': (100, 60), 'ip': (1, 60)}}):
+            # Atrás de um proxy não configurado, usuários diferentes não partilham o balde do proxy
+            self.assertEqual([throttling._retry_after('nivel', user_id, '') for user_id in (1, 2)], [0, 0])
+            self.assertEqual(throttling._retry_after('nivel', 1, '10.0.0.1'), 0)
+            self.assertGreater(throttling._retry_after('nivel', 2, '10.0.0.1'), 0)
+
+    def test_resubmitted_form_repeats_the_first_response(self):
+        level = Level.objects.create(
+            name='Bronze', deposit_value=5000, daily_gain=300, monthly_gain=9000, cycle_days=30, image='nivel.png',
+        )
+        user = CustomUser.objects.create_user('923000090', 'senha-forte-123', available_balance=Decimal('20000'))
+        self.client.force_login(user)
+        page = self.client.get(reverse('nivel'))
+        key = page.content.decode().split('name="idempotency_key" value="')[1].split('"')[0]
+
+        first = self.client.post(reverse('nivel'), {'level_id': level.pk, 'idempotency_key': key})
+        again = self.client.post(reverse('nivel'), {'level_id': level.pk, 'idempotency_key': key})
+
+        self.assertEqual((again.status_code, again['Location']), (first.status_code, first['Location']))
+        self.assertTrue(again.has_header('Idempotent-Replayed'))
+        self.assertEqual(UserLevel.objects.filter(user=user).count(), 1)
+        self.assertEqual(LedgerEntry.objects.filter(user=user, entry_type=LedgerEntry.LEVEL_PURCHASE).count(), 1)
+
+    def test_task_page_key_is_shared_by_repeated_clicks(self):
+        level = Level.objects.create(
+            name='Bronze', deposit_value=5000, daily_gain=300, monthly_gain=9000, cycle_days=30, image='nivel.png',
+            max_tasks=2,
+        )
+        user = CustomUser.objects.create_user('923000091', 'senha-forte-123')
+        UserLevel.objects.create(user=user, level=level)
+        self.client.force_login(user)
+        page = self.client.get(reverse('tarefa')).content.decode()
+        key = page.split("let idempotencyKey = '")[1].split("'")[0]
+
+        responses = [self.client.post(reverse('process_task'), headers={'Idempotency-Key': key}) for _ in range(2)]
+
+        self.assertEqual(responses[0].content, responses[1].content)
+        self.assertEqual(Task.objects.filter(user=user).count(), 1)
+
+
+class InviteCodeTests(TestCase):
+    def test_codes_are_unique_fixed_width_and_need_no_lookup(self):
+        codes = invite_codes.allocate(100000)
+        self.assertEqual(len(set(codes)), 100000)
+        self.assertTrue(all(len(code) == 8 and set(code) <= set(invite_codes.ALPHABET) for code in codes))
+        self.assertEqual(invite_codes.allocate(1)[0], invite_codes.encode(100001))
+
+        # O bloco reservado dentro de uma transação só é usado depois do commit
+        with self.captureOnCommitCallbacks(execute=True):
+            invite_codes.next_code()
+        with self.assertNumQueries(2):
+            # Só os INSERTs do usuário e do resumo vazio: o bloco já reservado dispensa consultas
+            CustomUser.objects.create_user('923000080', 'senha-forte-123')
+
+    def test_signup_accepts_code_in_lower_case(self):
+        sponsor = CustomUser.objects.create_user('923000081', 'senha-forte-123')
+        response = self.client.post(reverse('cadastro'), {
+            'phone_number': '923000082', 'password': 'senha-forte-123', 'confirm_password': 'senha-forte-123',
+            'invited_by_code': sponsor.invite_code.lower(),
+        })
+        self.assertRedirects(response, reverse('menu'), fetch_redirect_response=False)
+        self.assertEqual(CustomUser.objects.get(phone_number='923000082').invited_by, sponsor)
+
+
+class UserImportTests(TestCase):
+    def test_import_resolves_sponsors_and_resumes_from_checkpoint(self):
+        sponsor = CustomUser.objects.create_user('923000090', 'senha-forte-123')
+        rows = [
+            {'phone_number': '923000091', 'password': 'senha-1', 'invited_by': sponsor.invite_code},
+            # Patrocinador que só aparece mais à frente no ficheiro
+            {'phone_number': '923000092', 'password': 'senha-2', 'invited_by': 'abc12345'},
+            {'phone_number': '923000093', 'password': 'senha-3', 'invite_code': 'abc12345'},
+            {'phone_number': '', 'password': 'sem-telefone'},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'import.json')
+            def interrupt(*args):
+                raise KeyboardInterrupt
+
+            first = user_import.Importer(chunk_size=2, workers=1, checkpoint=checkpoint, progress=interrupt)
+            with self.assertRaises(KeyboardInterrupt):
+                first.run(iter(rows))
+            self.assertEqual(user_import.Checkpoint(checkpoint).load().pending, [['923000092', 'abc12345']])
+
+            resumed = user_import.Importer(chunk_size=2, workers=1, checkpoint=checkpoint)
+            stats = resumed.run(iter(rows))
+
+        self.assertEqual((stats['imported'], stats['invalid'], stats['unknown_sponsors']), (1, 1, 0))
+        imported = {user.phone_number: user for user in CustomUser.objects.filter(phone_number__startswith='92300009')}
+        self.assertEqual(imported['923000091'].invited_by, sponsor)
+        self.assertEqual(imported['923000092'].invited_by, imported['923000093'])
+        self.assertTrue(imported['923000091'].check_password('senha-1'))
+        self.assertEqual(len({user.invite_code for user in imported.values()}), 4)
+        self.assertTrue(ReferralPath.objects.filter(ancestor=sponsor, descendant=imported['923000091'], depth=1).exists())
+
+    def test_pending_links_survive_a_stop_between_commit_and_checkpoint(self):
+        rows = [
+            {'phone_number': '923000098', 'password': 'senha-8', 'invited_by': 'late0099'},
+            {'phone_number': '923000099', 'password': 'senha-9', 'invite_code': 'late0099'},
+        ]
+        save = user_import.Checkpoint.save
+        calls = []
+
+        def stop_after_commit(checkpoint):
+            # O segundo save (o de run(), depois do commit do primeiro lote) não chega a acontecer
+            calls.append(checkpoint.rows)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            save(checkpoint)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'import.json')
+            with mock.patch.object(user_import.Checkpoint, 'save', autospec=True, side_effect=stop_after_commit):
+                with self.assertRaises(KeyboardInterrupt):
+                    user_import.Importer(chunk_size=1, workers=1, checkpoint=checkpoint).run(iter(rows))
+            self.assertEqual(user_import.Checkpoint(checkpoint).load().rows, 0)
+
+            stats = user_import.Importer(chunk_size=1, workers=1, checkpoint=checkpoint).run(iter(rows))
+
+        self.assertEqual((stats['existing'], stats['imported']), (1, 1))
+        user = CustomUser.objects.get(phone_number='923000098')
+        self.assertEqual(user.invited_by.phone_number, '923000099')
+
+    def test_late_sponsor_links_only_the_new_subtree(self):
+        root = CustomUser.objects.create_user('923000094', 'senha-forte-123')
+        rows = [
+            # O usuário e o filho chegam antes do patrocinador, que é filho de root
+            {'phone_number': '923000095', 'password': 'senha-5', 'invite_code': 'user0095', 'invited_by': 'late0096'},
+            {'phone_number': '923000097', 'password': 'senha-7', 'invited_by': 'user0095'},
+            {'phone_number': '923000096', 'password': 'senha-6', 'invite_code': 'late0096', 'invited_by': root.invite_code},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            importer = user_import.Importer(chunk_size=1, workers=1, checkpoint=os.path.join(directory, 'import.json'))
+            with mock.patch.object(referrals, 'rebuild', side_effect=AssertionError('reconstrução completa')):
+                importer.run(iter(rows))
+
+        linked = set(ReferralPath.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        referrals.rebuild()
+        self.assertEqual(linked, set(ReferralPath.objects.values_list('ancestor_id', 'descendant_id', 'depth')))
+        grandchild = CustomUser.objects.get(phone_number='923000097')
+        self.assertTrue(ReferralPath.objects.filter(ancestor=root, descendant=grandchild, depth=3).exists())
+
+
+class LoginPolicyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_legacy_hash_is_upgraded_on_login(self):
+        user = CustomUser.objects.create_user('923000100', 'senha-forte-123')
+        user.password = make_password('senha-forte-123', hasher='pbkdf2_sha256')
+        user.save(update_fields=['password'])
+
+        response = self.client.post(reverse('login'), {'username': '923000100', 'password': 'senha-forte-123'})
+        self.assertRedirects(response, reverse('menu'), fetch_redirect_response=False)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+        self.assertTrue(user.check_password('senha-forte-123'))
+
+    @override_settings(LOGIN_MAX_FAILURES_PER_PHONE=3)
+    def test_failures_block_further_attempts_before_hashing(self):
+        CustomUser.objects.create_user('923000101', 'senha-forte-123')
+        for _ in range(3):
+            self.client.post(reverse('login'), {'username': '923000101', 'password': 'errada'})
+
+        with mock.patch.object(ModelBackend, 'authenticate') as authenticate:
+            response = self.client.post(reverse('login'), {'username': '923000101', 'password': 'senha-forte-123'})
+        authenticate.assert_not_called()
+        self.assertEqual(response.context['form'].non_field_errors().as_data()[0].code, 'throttled')
+
+        # Outro telefone a partir do mesmo IP continua a poder entrar
+        CustomUser.objects.create_user('923000102', 'senha-forte-123')
+        response = self.client.post(reverse('login'), {'username': '923000102', 'password': 'senha-forte-123'})
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(LOGIN_MAX_FAILURES_PER_PHONE=3)
+    def test_parallel_attempts_cannot_overrun_the_limit(self):
+        # Cinco pedidos em paralelo: todos começam antes de o primeiro terminar
+        started = [throttling.start_login_attempt('923000106', '10.0.0.1') for _ in range(5)]
+        self.assertEqual(started, [True, True, True, False, False])
+
+        # Um login certo liberta o telefone e devolve a tentativa ao IP
+        throttling.finish_login_attempt('923000106', '10.0.0.1', succeeded=True)
+        self.assertTrue(throttling.start_login_attempt('923000106', '10.0.0.1'))
+        self.assertEqual(cache.get('core:login:fail:ip:10.0.0.1'), 3)
+
+    @override_settings(LOGIN_MAX_FAILURES_PER_IP=2)
+    def test_ip_limit_needs_the_real_client_address(self):
+        for phone in ('923000103', '923000104'):
+            self.client.post(reverse('login'), {'username': phone, 'password': 'errada'}, HTTP_X_FORWARDED_FOR='10.0.0.1')
+        CustomUser.objects.create_user('923000105', 'senha-forte-123')
+        login = {'username': '923000105', 'password': 'senha-forte-123'}
+
+        # Sem NUM_PROXIES, REMOTE_ADDR é o do proxy: as falhas de outros usuários não bloqueiam o IP
+        self.assertEqual(self.client.post(reverse('login'), login, HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 302)
+
+        with self.settings(NUM_PROXIES=1):
+            self.client.logout()
+            for phone in ('923000103', '923000104'):
+                self.client.post(reverse('login'), {'username': phone, 'password': 'errada'}, HTTP_X_FORWARDED_FOR='10.0.0.1')
+            self.assertEqual(self.client.post(reverse('login'), login, HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 200)
+            self.assertEqual(self.client.post(reverse('login'), login, HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 302)
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db', USER_CACHE_TIMEOUT=300)
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.level = Level.objects.create(
+            name='Bronze', deposit_value=2000, daily_gain=100, monthly_gain=3000, cycle_days=30, image='nivel.png',
+        )
+        self.user = CustomUser.objects.create_user('923000110', 'senha-forte-123', roulette_spins=1)
+        self.client.post(reverse('login'), {'username': '923000110', 'password': 'senha-forte-123'})
+
+    def test_read_mostly_pages_render_without_queries(self):
+        for name in ('sobre', 'roleta', 'nivel'):
+            self.client.get(reverse(name))
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+
+    def test_balance_and_level_changes_invalidate_the_cached_user(self):
+        self.client.get(reverse('roleta'))
+        balances.credit(self.user, LedgerEntry.DEPOSIT, Decimal('500.00'))
+        response = self.client.get(reverse('roleta'))
+        self.assertEqual(response.wsgi_request.user.available_balance, Decimal('500.00'))
+
+        self.client.post(reverse('spin_roulette'))
+        self.assertEqual(self.client.get(reverse('roleta')).context['roulette_spins'], 0)
+
+        self.client.get(reverse('nivel'))
+        UserLevel.objects.create(user=self.user, level=self.level)
+        self.assertIn(self.level.pk, self.client.get(reverse('nivel')).context['user_levels'])
+
+    def test_password_hash_stays_out_of_the_cache(self):
+        self.client.get(reverse('roleta'))
+        entry = cache.get(user_cache._user_key(self.user.pk))
+        self.assertNotIn('password', entry['fields'])
+        self.assertNotIn(self.user.password, repr(entry))
+
+        response = self.client.get(reverse('roleta'))
+        self.assertIn('password', response.wsgi_request.user.get_deferred_fields())
+
+        # Mudar a senha lê-a da base de dados e mantém a sessão
+        response = self.client.post(reverse('perfil'), {
+            'change_password': '1', 'old_password': 'senha-forte-123',
+            'new_password1': 'outra-senha-forte-456', 'new_password2': 'outra-senha-forte-456',
+        })
+        self.assertRedirects(response, reverse('perfil'), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('roleta')).status_code, 200)
+        self.assertTrue(CustomUser.objects.get(pk=self.user.pk).check_password('outra-senha-forte-456'))
+
+    def test_wrong_password_falls_through_to_the_next_backend(self):
+        self.assertIsNone(CachedModelBackend().authenticate(None, username='923000110', password='errada'))
+        with mock.patch.object(ModelBackend, 'authenticate', autospec=True, side_effect=ModelBackend.authenticate) as authenticate:
+            self.client.post(reverse('login'), {'username': '923000110', 'password': 'errada'})
+        self.assertEqual(authenticate.call_count, len(settings.AUTHENTICATION_BACKENDS))
+
+
+class DepositProofTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        storage_settings = override_settings(MEDIA_ROOT=self.media.name, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        self.user = CustomUser.objects.create_user('923000120', 'senha-forte-123')
+        self.client.force_login(self.user)
+
+    def _photo(self):
+        # Foto de telemóvel em pé: 3000x2000 com orientação EXIF 6 (rodar 90°) e GPS
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {1: 'S', 2: (8.0, 50.0, 0.0)}
+        buffer = io.BytesIO()
+        Image.new('RGB', (3000, 2000), 'navy').save(buffer, 'JPEG', quality=95, exif=exif)
+        return SimpleUploadedFile('IMG_0001.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_is_downsized_stripped_and_thumbnailed(self):
+        response = self.client.post(reverse('deposito'), {'amount': '5000', 'proof_of_payment': self._photo()})
+        self.assertTrue(response.context['deposit_success'])
+
+        deposit = Deposit.objects.get(user=self.user)
+        with Image.open(deposit.proof_of_payment.path) as proof:
+            self.assertEqual(proof.format, images.output_format()[0])
+            self.assertEqual(proof.size, (1067, 1600))
+            self.assertFalse(proof.getexif())
+        with Image.open(deposit.proof_thumbnail.path) as thumbnail:
+            self.assertLessEqual(max(thumbnail.size), 320)
+
+        staff = CustomUser.objects.create_superuser('923000121', 'senha-forte-123')
+        self.client.force_login(staff)
+        changelist = self.client.get(reverse('admin:core_deposit_changelist')).content.decode()
+        self.assertIn(deposit.proof_thumbnail.url, changelist)
+        self.assertIn(deposit.proof_of_payment.url, changelist)
+
+    def _upload_request(self, content, name='IMG_0001.jpg'):
+        # Pedido montado à mão para se poder inspecionar quanto do corpo foi lido
+        request = RequestFactory().post(reverse('deposito'), {
+            'amount': '5000', 'proof_of_payment': SimpleUploadedFile(name, content),
+        })
+        request.user = self.user
+        request.session = self.client.session
+        request._messages = FallbackStorage(request)
+        request._dont_enforce_csrf_checks = True
+        return request
+
+    @override_settings(DEPOSIT_PROOF_MAX_UPLOAD_SIZE=1024 * 1024)
+    def test_oversized_upload_is_refused_before_reading_the_body(self):
+        request = self._upload_request(self._photo().read() + b'\0' * 2 * 1024 * 1024)
+        response = views.deposito(request)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(request.environ['wsgi.input'].read_started)
+        self.assertFalse(Deposit.objects.exists())
+
+    def test_non_image_upload_stops_at_the_first_chunk(self):
+        request = self._upload_request(b'%PDF-1.7\n' + b'0' * 2 * 1024 * 1024, 'comprovativo.pdf')
+        response = views.deposito(request)
+
+        self.assertEqual(response.status_code, 415)
+        self.assertGreater(len(request.environ['wsgi.input']), 1024 * 1024)
+        self.assertFalse(Deposit.objects.exists())
+
+    def test_large_upload_memory_is_bounded(self):
+        # Foto de 12 MP acrescentada até 20 MB: o corpo vai para um ficheiro
+        # temporário (nunca fica inteiro em memória Python) e a imagem é
+        # descodificada já em escala reduzida
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 3000), 'navy').save(buffer, 'JPEG', quality=95)
+        request = self._upload_request(buffer.getvalue() + b'\0' * (20 * 1024 * 1024 - buffer.tell()))
+        del buffer
+
+        decode, decoded = images._decode, []
+
+        def measured_decode(upload):
+            image = decode(upload)
+            decoded.append(image.size)
+            return image
+
+        tracemalloc.start()
+        try:
+            request.upload_handlers = [uploads.ProofUploadHandler(request)]
+            form = DepositForm(request.POST, request.FILES)
+            self.assertTrue(form.is_valid(), form.errors)
+            with mock.patch.object(images, '_decode', measured_decode):
+                images.compress_proof(form.cleaned_data['proof_of_payment'])
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, 5 * 1024 * 1024)
+        # Os píxeis (fora do tracemalloc) são os da imagem a 1/2: ~9 MB em vez de ~36 MB
+        self.assertEqual(decoded, [(2000, 1500)])
+
+
+class DepositApprovalTests(TestCase):
+    def setUp(self):
+        self.first = CustomUser.objects.create_user('923000130', 'senha-forte-123')
+        self.second = CustomUser.objects.create_user('923000131', 'senha-forte-123')
+        dashboard.get(self.first)
+        self.pending = [
+            Deposit.objects.create(user=self.first, amount=Decimal('5000.00'), proof_of_payment='p.png'),
+            Deposit.objects.create(user=self.first, amount=Decimal('3000.00'), proof_of_payment='p.png'),
+            Deposit.objects.create(user=self.second, amount=Decimal('5000.00'), proof_of_payment='p.png'),
+        ]
+        self.approved = Deposit.objects.create(user=self.second, amount=Decimal('1000.00'), proof_of_payment='p.png', is_approved=True)
+        self.staff = CustomUser.objects.create_superuser('923000132', 'senha-forte-123')
+        self.client.force_login(self.staff)
+
+    def test_admin_action_credits_each_user_once(self):
+        response = self.client.post(reverse('admin:core_deposit_changelist'), {
+            'action': 'approve_selected',
+            '_selected_action': [deposit.pk for deposit in self.pending] + [self.approved.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.available_balance, self.second.available_balance), (Decimal('8000.00'), Decimal('5000.00')))
+        self.assertFalse(Deposit.objects.filter(is_approved=False).exists())
+        self.assertEqual(LedgerEntry.objects.filter(entry_type=LedgerEntry.DEPOSIT).count(), 3)
+        self.assertEqual(dashboard.get(self.first).approved_deposit_total, Decimal('8000.00'))
+        self.assertEqual(dashboard.get(self.second).approved_deposit_total, Decimal('6000.00'))
+
+        # Repetir (ação, comando ou view) não volta a creditar
+        self.assertEqual(deposits.approve([deposit.pk for deposit in self.pending])['approved'], 0)
+        call_command('approve_deposits', '--all-pending', stdout=io.StringIO())
+        self.client.post(reverse('approve_deposit', args=[self.pending[0].pk]))
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.available_balance, Decimal('8000.00'))
+        self.assertEqual(LedgerEntry.objects.filter(entry_type=LedgerEntry.DEPOSIT).count(), 3)
+
+    def test_query_count_does_not_grow_with_the_selection(self):
+        more = [
+            Deposit.objects.create(user=user, amount=Decimal('2000.00'), proof_of_payment='p.png')
+            for user in CustomUser.objects.bulk_create(
+                invite_codes.assign([CustomUser(phone_number=f'92300014{i}') for i in range(10)])
+            )
+        ]
+        with CaptureQueriesContext(connection) as small:
+            deposits.approve([deposit.pk for deposit in self.pending])
+        with CaptureQueriesContext(connection) as large:
+            stats = deposits.approve([deposit.pk for deposit in more])
+        self.assertEqual(stats['approved'], 10)
+        self.assertLessEqual(len(large), len(small))
+
+
+class WithdrawalProcessingTests(TestCase):
+    def setUp(self):
+        self.users = CustomUser.objects.bulk_create(
+            invite_codes.assign([CustomUser(phone_number=f'92300015{i}') for i in range(3)])
+        )
+        BankDetails.objects.bulk_create([
+            BankDetails(user=user, bank_name='BAI', IBAN=f'AO06004000000000000000{i}', account_holder_name=f'Titular {i}')
+            for i, user in enumerate(self.users[:2])
+        ])
+        self.withdrawals = [Withdrawal.objects.create(user=user, amount=Decimal('2500.00')) for user in self.users]
+        self.staff = CustomUser.objects.create_superuser('923000159', 'senha-forte-123')
+        self.client.force_login(self.staff)
+
+    def _action(self, action, withdrawals):
+        return self.client.post(reverse('admin:core_withdrawal_changelist'), {
+            'action': action, '_selected_action': [withdrawal.pk for withdrawal in withdrawals],
+        })
+
+    def test_approve_streams_payout_file_and_reject_refunds(self):
+        response = self._action('approve_and_export', self.withdrawals[:2])
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(withdrawals.PAYOUT_HEADER))
+        self.assertEqual(len(lines), 3)
+        self.assertIn('AO060040000000000000001', lines[2])
+        self.assertEqual(Withdrawal.objects.filter(status=Withdrawal.APPROVED).count(), 2)
+        self.assertEqual(dashboard.get(self.users[0]).approved_withdrawal_total, Decimal('2500.00'))
+
+        # Aprovado -> Rejeitado devolve o valor; Rejeitado -> Pago não é uma transição válida
+        self._action('reject', self.withdrawals[:1])
+        self._action('mark_paid', self.withdrawals[:2])
+        statuses = dict(Withdrawal.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[withdrawal.pk] for withdrawal in self.withdrawals],
+            [Withdrawal.REJECTED, Withdrawal.PAID, Withdrawal.PENDING],
+        )
+        self.users[0].refresh_from_db()
+        self.assertEqual(self.users[0].available_balance, Decimal('2500.00'))
+        self.assertEqual(LedgerEntry.objects.filter(entry_type=LedgerEntry.WITHDRAWAL_REFUND).count(), 1)
+        self.assertEqual(dashboard.get(self.users[0]).approved_withdrawal_total, Decimal('0.00'))
+        self.assertEqual(dashboard.get(self.users[1]).approved_withdrawal_total, Decimal('2500.00'))
+
+    def test_each_approved_withdrawal_is_exported_once(self):
+        withdrawals.transition([self.withdrawals[0].pk], Withdrawal.APPROVED)
+        response = self._action('approve_and_export', self.withdrawals[:2])
+        # O aprovado antes também entra (ainda não tinha sido exportado)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 3)
+
+        response = self._action('export_payouts', self.withdrawals)
+        self.assertFalse(getattr(response, 'streaming', False))
+        self.assertEqual(Withdrawal.objects.filter(exported_at__isnull=False).count(), 2)
+
+    def test_exported_batch_can_be_exported_again(self):
+        withdrawals.transition([withdrawal.pk for withdrawal in self.withdrawals], Withdrawal.APPROVED)
+        self._action('export_payouts', self.withdrawals[:2])
+        stamp = Withdrawal.objects.get(pk=self.withdrawals[0].pk).exported_at
+
+        # Selecionar um saque do lote volta a gerar o lote inteiro, sem o remarcar
+        response = self._action('reexport_payouts', self.withdrawals[1:2])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], [str(w.pk) for w in self.withdrawals[:2]])
+        self.assertEqual(set(Withdrawal.objects.filter(exported_at__isnull=False).values_list('exported_at', flat=True)), {stamp})
+
+        # O que ainda não foi exportado não entra numa reexportação
+        response = self._action('reexport_payouts', self.withdrawals[2:])
+        self.assertFalse(getattr(response, 'streaming', False))
+
+    def test_export_needs_the_change_permission(self):
+        withdrawals.transition([self.withdrawals[0].pk], Withdrawal.APPROVED)
+        viewer = CustomUser.objects.create_user('923000158', 'senha-forte-123', is_staff=True)
+        viewer.user_permissions.add(Permission.objects.get(codename='view_withdrawal'))
+        self.client.force_login(viewer)
+
+        response = self._action('export_payouts', self.withdrawals[:1])
+        self.assertFalse(getattr(response, 'streaming', False))
+        self.assertIsNone(Withdrawal.objects.get(pk=self.withdrawals[0].pk).exported_at)
+
+    def test_payout_export_is_a_single_query(self):
+        withdrawals.transition([withdrawal.pk for withdrawal in self.withdrawals], Withdrawal.APPROVED)
+        with self.assertNumQueries(1):
+            rows = list(withdrawals.payout_rows(Withdrawal.objects.all()))
+        # Sem dados bancários a linha sai na mesma, com as colunas vazias
+        self.assertEqual([row[4] for row in rows], ['AO060040000000000000000', 'AO060040000000000000001', ''])
+
+
+class AdminChangelistTests(TestCase):
+    MODELS = (
+        'customuser', 'bankdetails', 'deposit', 'withdrawal', 'task', 'roulette', 'userlevel', 'ledgerentry',
+        'commissionevent',
+    )
+
+    def setUp(self):
+        self.level = Level.objects.create(
+            name='Bronze', deposit_value=5000, daily_gain=300, monthly_gain=9000, cycle_days=30, image='nivel.png',
+        )
+        self.staff = CustomUser.objects.create_superuser('923000160', 'senha-forte-123')
+        self.client.force_login(self.staff)
+        self.created = 0
+
+    def _add_rows(self, count):
+        users = CustomUser.objects.bulk_create(
+            invite_codes.assign([CustomUser(phone_number=f'9231{self.created + i:05d}') for i in range(count)])
+        )
+        self.created += count
+        BankDetails.objects.bulk_create(BankDetails(user=user, bank_name='BAI', IBAN='AO06', account_holder_name='T') for user in users)
+        Deposit.objects.bulk_create(Deposit(user=user, amount=5000, proof_of_payment='p.png') for user in users)
+        Withdrawal.objects.bulk_create(Withdrawal(user=user, amount=2500) for user in users)
+        Task.objects.bulk_create(Task(user=user, earnings=300) for user in users)
+        Roulette.objects.bulk_create(Roulette(user=user, prize=100) for user in users)
+        UserLevel.objects.bulk_create(UserLevel(user=user, level=self.level) for user in users)
+        LedgerEntry.objects.bulk_create(ledger.entry(user, LedgerEntry.DEPOSIT, 5000) for user in users)
+        CommissionEvent.objects.bulk_create(
+            CommissionEvent(sponsor=user, source_user=self.staff, kind=CommissionEvent.TASK_SUBSIDY, amount=10) for user in users
+        )
+
+    def test_ledger_is_read_only(self):
+        entry = LedgerEntry.objects.create(user=self.staff, entry_type=LedgerEntry.DEPOSIT, amount=5000)
+        self.assertEqual(self.client.get(reverse('admin:core_ledgerentry_add')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:core_ledgerentry_delete', args=[entry.pk])).status_code, 403)
+        self.assertEqual(self.client.post(reverse('admin:core_ledgerentry_change', args=[entry.pk]), {}).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:core_ledgerentry_changelist')).status_code, 200)
+        self.assertTrue(LedgerEntry.objects.filter(pk=entry.pk).exists())
+
+    def _change_form_data(self, url):
+        # Dados do formulário de edição tal como o admin o mostra
+        data = {}
+        for field in self.client.get(url).context['adminform'].form:
+            value = field.value()
+            if value is None or value is False:
+                continue
+            if hasattr(field.field.widget, 'decompress'):
+                data.update({f'{field.html_name}_{i}': part for i, part in enumerate(field.field.widget.decompress(value))})
+            else:
+                data[field.html_name] = value
+        return data
+
+    def test_user_balance_only_changes_through_the_ledger(self):
+        user = CustomUser.objects.create_user('923000161', 'senha-forte-123')
+        url = reverse('admin:core_customuser_change', args=[user.pk])
+        data = self._change_form_data(url)
+        self.assertNotIn('available_balance', data)
+
+        # Um crédito feito com a página aberta não é sobreposto ao gravar
+        balances.credit(user, LedgerEntry.DEPOSIT, 1000)
+        self.client.post(url, {**data, 'available_balance': '999999', 'balance_adjustment': '-300'})
+        user.refresh_from_db()
+        self.assertEqual(user.available_balance, Decimal('700.00'))
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(user=user, entry_type=LedgerEntry.ADJUSTMENT).values_list('amount', flat=True)),
+            [Decimal('-300.00')],
+        )
+
+        # Débito acima do saldo: não é aplicado
+        self.client.post(url, {**data, 'balance_adjustment': '-5000'})
+        user.refresh_from_db()
+        self.assertEqual(user.available_balance, Decimal('700.00'))
+
+    def _queries_per_page(self, **params):
+        counts = {}
+        for model in self.MODELS:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f'admin:core_{model}_changelist'), params)
+            self.assertEqual(response.status_code, 200, model)
+            counts[model] = len(queries)
+        return counts
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self._add_rows(2)
+        few = self._queries_per_page()
+        self._add_rows(20)
+        self.assertEqual(self._queries_per_page(), few)
+        # Pesquisa por prefixo do telefone
+        self.assertEqual(self._queries_per_page(q='92310'), few)
+
+    def test_estimated_count_only_for_unfiltered_lists(self):
+        self._add_rows(3)
+        with mock.patch('core.admin.estimated_count', return_value=2_000_000):
+            self.assertEqual(admin_site.EstimatedCountPaginator(Task.objects.order_by('pk'), 100).count, 2_000_000)
+            filtered = Task.objects.filter(user__phone_number__startswith='9231').order_by('pk')
+            self.assertEqual(admin_site.EstimatedCountPaginator(filtered, 100).count, 3)
+        # Sem estatísticas do PostgreSQL (SQLite): contagem exata
+        self.assertIsNone(admin_site.estimated_count(Task.objects.all()))
+        self.assertEqual(admin_site.EstimatedCountPaginator(Task.objects.order_by('pk'), 100).count, 3)
@@ -0,0 +1,269 @@
+import asyncio
+import math
+import re
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import redirect
+
+# ---
+# Limitação de tentativas de login falhadas, contadas no cache por número de
+# telefone e por IP (janela fixa a partir da primeira falha). Com REDIS_URL o
+# contador é partilhado por todos os workers. Cada tentativa é contada antes de
+# autenticar, e uma tentativa acima do limite é recusada sem calcular o hash.
+#
+# Para os POSTs das ações (tarefa, roleta, saque, nível, depósito):
+# - rate_limit: token bucket por usuário e por IP (quando conhecido), com limites por view;
+# - idempotent: pedidos repetidos com a mesma chave de idempotência (cabeçalho
+#   Idempotency-Key ou campo idempotency_key do formulário) recebem a resposta
+#   do primeiro em vez de repetirem o trabalho; um duplicado que chega enquanto
+#   o primeiro ainda corre espera por ele.
+# Ambos guardam o estado no cache (partilhado com REDIS_URL).
+# ---
+
+
+def client_ip(request):
+    # Atrás de N proxies de confiança (NUM_PROXIES), o IP real é o N-ésimo a contar do fim.
+    # Devolve '' quando o IP real não é conhecido: com X-Forwarded-For mas sem proxies
+    # configurados, REMOTE_ADDR seria o do proxy, partilhado por todos os usuários
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    proxies = getattr(settings, 'NUM_PROXIES', 0)
+    if proxies:
+        return forwarded[-proxies] if len(forwarded) >= proxies else ''
+    return '' if forwarded else request.META.get('REMOTE_ADDR', '')
+
+
+def _login_keys(phone, ip):
+    keys = {f'core:login:fail:phone:{phone}': getattr(settings, 'LOGIN_MAX_FAILURES_PER_PHONE', 5)}
+    if ip:
+        keys[f'core:login:fail:ip:{ip}'] = getattr(settings, 'LOGIN_MAX_FAILURES_PER_IP', 30)
+    return keys
+
+
+def _count(key, window):
+    # add() só cria a chave (e a janela) na primeira tentativa
+    cache.add(key, 0, window)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # A chave expirou entre add() e incr()
+        cache.set(key, 1, window)
+        return 1
+
+
+def _uncount(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        # A janela já expirou
+        pass
+
+
+def start_login_attempt(phone, ip):
+    # Conta a tentativa antes de autenticar: incr() é atómico, por isso num pico de
+    # pedidos em paralelo só passam os que ainda cabem no limite. Os recusados
+    # descontam-se logo e devolvem False
+    window = getattr(settings, 'LOGIN_FAILURE_WINDOW', 900)
+    keys = _login_keys(phone, ip)
+    counts = {key: _count(key, window) for key in keys}
+    if all(counts[key] <= limit for key, limit in keys.items()):
+        return True
+    for key in keys:
+        _uncount(key)
+    return False
+
+
+def finish_login_attempt(phone, ip, succeeded):
+    # Uma falha fica contada; um login certo limpa as falhas do telefone e devolve a tentativa ao IP
+    if not succeeded:
+        return
+    reset_login_failures(phone)
+    if ip:
+        _uncount(f'core:login:fail:ip:{ip}')
+
+
+def reset_login_failures(phone):
+    cache.delete(f'core:login:fail:phone:{phone}')
+
+
+# Por view: (capacidade do balde, segundos para o reencher por completo), por usuário e por IP
+RATE_LIMITS = {
+    'process_task': {'user': (5, 60), 'ip': (120, 60)},
+    'spin_roulette': {'user': (10, 60), 'ip': (300, 60)},
+    'saque': {'user': (5, 60), 'ip': (60, 60)},
+    'nivel': {'user': (5, 60), 'ip': (60, 60)},
+    'deposito': {'user': (5, 300), 'ip': (30, 300)},
+}
+
+
+def take_token(key, capacity, period, now=None):
+    # Token bucket na forma GCRA: guarda só o instante teórico (ms) em que o balde
+    # volta a estar cheio e avança-o com incr(), atómico em qualquer cache do Django
+    interval = max(int(period * 1000 / capacity), 1)
+    now = int((time.time() if now is None else now) * 1000)
+    timeout = math.ceil(period) + 1
+    if cache.add(key, now + interval, timeout):
+        return 0
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        # A chave expirou entre add() e incr()
+        cache.set(key, now + interval, timeout)
+        return 0
+    if full_at - interval < now:
+        # O balde já estava cheio: conta a partir de agora
+        cache.set(key, now + interval, timeout)
+        return 0
+    if full_at - now > capacity * interval:
+        # Sem fichas: o pedido recusado não gasta nenhuma
+        cache.decr(key, interval)
+        return (full_at - now - capacity * interval) / 1000
+    cache.touch(key, timeout)
+    return 0
+
+
+def _retry_after(name, user_id, ip):
+    # Segundos até haver ficha nos dois baldes (0: pedido aceite). Sem IP conhecido
+    # (ver client_ip) só conta o balde do usuário: o do proxy seria um limite global
+    limits = RATE_LIMITS[name]
+    wait = 0
+    if user_id:
+        wait = take_token(f'core:rate:{name}:user:{user_id}', *limits['user'])
+    if not wait and ip:
+        wait = take_token(f'core:rate:{name}:ip:{ip}', *limits['ip'])
+    return wait
+
+
+def _too_many_requests(request, wait, json):
+    message = 'Muitos pedidos seguidos. Aguarde alguns segundos e tente novamente.'
+    if json:
+        response = JsonResponse({'success': False, 'message': message}, status=429)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+    messages.error(request, message)
+    return redirect(request.path)
+
+
+def rate_limit(name, json=False):
+    # Só os POSTs gastam fichas; funciona com views síncronas e assíncronas.
+    # Views JSON respondem 429; as de formulário voltam à página com uma mensagem
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method == 'POST' and settings.RATE_LIMITING:
+                    user = await request.auser()
+                    wait = await sync_to_async(_retry_after)(name, user.pk, client_ip(request))
+                    if wait:
+                        return _too_many_requests(request, wait, json)
+                return await view(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method == 'POST' and settings.RATE_LIMITING:
+                    wait = _retry_after(name, request.user.pk, client_ip(request))
+                    if wait:
+                        return _too_many_requests(request, wait, json)
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+IDEMPOTENCY_FIELD = 'idempotency_key'
+_VALID_KEY = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+_PENDING = 'pending'
+# Quanto tempo um duplicado espera pela resposta do pedido original (segundos)
+IDEMPOTENCY_WAIT = 5
+_POLL_INTERVAL = 0.05
+
+
+def _idempotency_key(request, name, user_id):
+    if request.method != 'POST' or not user_id:
+        return None
+    key = request.headers.get('Idempotency-Key')
+    if key is None and request.content_type != 'application/json':
+        key = request.POST.get(IDEMPOTENCY_FIELD)
+    if not key or not _VALID_KEY.match(key):
+        return None
+    return f'core:idempotency:{name}:{user_id}:{key}'
+
+
+def _freeze(response):
+    # Só respostas completas e definitivas são repetidas (não 429 nem erros do servidor)
+    if response.streaming or response.status_code == 429 or response.status_code >= 500:
+        return None
+    headers = {header: response[header] for header in ('Content-Type', 'Location') if response.has_header(header)}
+    return {'status': response.status_code, 'content': response.content, 'headers': headers}
+
+
+def _replay(stored):
+    if stored is None or stored == _PENDING:
+        # O pedido original ainda não terminou (ou demorou demais)
+        return JsonResponse({'success': False, 'message': 'Este pedido ainda está a ser processado.'}, status=409)
+    response = HttpResponse(stored['content'], status=stored['status'])
+    for header, value in stored['headers'].items():
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(name):
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                user = await request.auser()
+                key = _idempotency_key(request, name, user.pk)
+                if key is None:
+                    return await view(request, *args, **kwargs)
+                timeout = settings.IDEMPOTENCY_KEY_TIMEOUT
+                if not await cache.aadd(key, _PENDING, timeout):
+                    stored = await cache.aget(key)
+                    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+                    while stored == _PENDING and time.monotonic() < deadline:
+                        await asyncio.sleep(_POLL_INTERVAL)
+                        stored = await cache.aget(key)
+                    return _replay(stored)
+                try:
+                    response = await view(request, *args, **kwargs)
+                except BaseException:
+                    await cache.adelete(key)
+                    raise
+                frozen = _freeze(response)
+                if frozen is None:
+                    await cache.adelete(key)
+                else:
+                    await cache.aset(key, frozen, timeout)
+                return response
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                key = _idempotency_key(request, name, request.user.pk)
+                if key is None:
+                    return view(request, *args, **kwargs)
+                timeout = settings.IDEMPOTENCY_KEY_TIMEOUT
+                if not cache.add(key, _PENDING, timeout):
+                    stored = cache.get(key)
+                    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+                    while stored == _PENDING and time.monotonic() < deadline:
+                        time.sleep(_POLL_INTERVAL)
+                        stored = cache.get(key)
+                    return _replay(stored)
+                try:
+                    response = view(request, *args, **kwargs)
+                except BaseException:
+                    cache.delete(key)
+                    raise
+                frozen = _freeze(response)
+                if frozen is None:
+                    cache.delete(key)
+                else:
+                    cache.set(key, frozen, timeout)
+                return response
+        return wrapper
+    return decorator
@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+# ---
+# Receção dos comprovativos de depósito. Substitui os handlers padrão do
+# Django (memória até 2,5 MB, depois ficheiro temporário) por um único que
+# escreve os blocos diretamente num ficheiro temporário: o pedido nunca tem o
+# ficheiro inteiro em memória, e o ImageField e o processamento de imagens
+# (images.compress_proof) leem-no a partir do disco. Os limites são
+# verificados à medida que os dados chegam:
+#   - Content-Length acima do limite: o corpo nem chega a ser lido;
+#   - o ficheiro ultrapassa o limite a meio (Content-Length falso ou ausente):
+#     a leitura pára nesse bloco;
+#   - os primeiros bytes não são de JPEG, PNG ou WebP: pára no primeiro bloco.
+# ---
+
+# Assinaturas (magic bytes) dos formatos aceites; o WebP tem 'WEBP' no byte 8
+SIGNATURES = (
+    (0, b'\xff\xd8\xff'),
+    (0, b'\x89PNG\r\n\x1a\n'),
+    (8, b'WEBP'),
+)
+SNIFF_BYTES = 12
+
+# Margem para os restantes campos e os separadores do multipart
+FORM_OVERHEAD = 64 * 1024
+
+TOO_LARGE = 'too_large'
+UNSUPPORTED = 'unsupported'
+
+
+def max_bytes():
+    return settings.DEPOSIT_PROOF_MAX_UPLOAD_SIZE
+
+
+def sniff(head):
+    return any(head[offset:offset + len(signature)] == signature for offset, signature in SIGNATURES)
+
+
+class ProofUploadHandler(FileUploadHandler):
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+        self.limit = max_bytes()
+        self.head = b''
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > self.limit + FORM_OVERHEAD:
+            # Devolver um resultado impede o MultiPartParser de ler o corpo
+            self.error = TOO_LARGE
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.head = b''
+        self.file = TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limit:
+            self._abort(TOO_LARGE)
+        if len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES and not sniff(self.head):
+                self._abort(UNSUPPORTED)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if file_size and not sniff(self.head):
+            # Ficheiro com menos de SNIFF_BYTES bytes
+            self._abort(UNSUPPORTED)
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def upload_interrupted(self):
+        self._discard()
+
+    def _abort(self, error):
+        self.error = error
+        self._discard()
+        # connection_reset: o resto do corpo não é lido
+        raise StopUpload(connection_reset=True)
+
+    def _discard(self):
+        # Fechar o NamedTemporaryFile apaga-o do disco
+        if hasattr(self, 'file'):
+            self.file.close()
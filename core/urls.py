@@ -15,6 +15,7 @@ urlpatterns = [
     path('login/', views.user_login, name='login'),
     path('logout/', views.user_logout, name='logout'),
     path('deposito/', views.deposito, name='deposito'),
+    path('deposito/<int:deposit_id>/aprovar/', views.approve_deposit, name='approve_deposit'),
     path('saque/', views.saque, name='saque'),
     path('tarefa/', views.tarefa, name='tarefa'),
     path('process_task/', views.process_task, name='process_task'),
@@ -25,6 +26,11 @@ urlpatterns = [
     path('sobre/', views.sobre, name='sobre'),
     path('perfil/', views.perfil, name='perfil'),
     path('renda/', views.renda, name='renda'),
+
+    # Métricas por rota (apenas staff)
+    path('profiling/', views.profiling_report, name='profiling'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('roleta/exposicao/', views.roulette_exposure, name='roulette_exposure'),
     
     # URLs para alteração de senha
     path('change_password/', auth_views.PasswordChangeView.as_view(
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CustomUser, UserLevel
+
+# ---
+# Cache do usuário autenticado (request.user) e dos seus níveis ativos, por
+# id. Qualquer alteração ao usuário (saldos, giros, níveis, admin) chama
+# invalidate(): a entrada é apagada logo e outra vez depois do commit, para
+# que um pedido concorrente não volte a guardar a versão anterior.
+# O hash da senha não vai para o cache: guardam-se os outros campos e o hash
+# da sessão já calculado (um HMAC com a SECRET_KEY), e a senha só é lida da
+# base de dados se alguém a usar (ex.: mudança de senha).
+# Desligado com USER_CACHE_TIMEOUT=0.
+# ---
+
+
+def _timeout():
+    return getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+
+
+def _user_key(user_id):
+    return f'core:user:{user_id}'
+
+
+def _levels_key(user_id):
+    return f'core:user:{user_id}:levels'
+
+
+def get(user_id):
+    if not _timeout():
+        return CustomUser.objects.filter(pk=user_id).first()
+    entry = cache.get(_user_key(user_id))
+    if entry is None:
+        user = CustomUser.objects.filter(pk=user_id).first()
+        if user is not None:
+            fields = {field.attname: getattr(user, field.attname) for field in CustomUser._meta.concrete_fields if field.attname != 'password'}
+            cache.set(_user_key(user_id), {'fields': fields, 'session_auth_hash': user.get_session_auth_hash()}, _timeout())
+        return user
+    # Sem o valor da senha, o campo fica diferido (carregado só se for acedido)
+    user = CustomUser.from_db(CustomUser.objects.db, list(entry['fields']), list(entry['fields'].values()))
+    user.cached_session_auth_hash = entry['session_auth_hash']
+    return user
+
+
+def active_level_ids(user_id):
+    # Ids dos níveis ativos do usuário (para a página de níveis)
+    if not _timeout():
+        return frozenset(UserLevel.objects.filter(user_id=user_id, is_active=True).values_list('level_id', flat=True))
+    level_ids = cache.get(_levels_key(user_id))
+    if level_ids is None:
+        level_ids = frozenset(UserLevel.objects.filter(user_id=user_id, is_active=True).values_list('level_id', flat=True))
+        cache.set(_levels_key(user_id), level_ids, _timeout())
+    return level_ids
+
+
+def invalidate(user_ids):
+    keys = [key for user_id in user_ids for key in (_user_key(user_id), _levels_key(user_id))]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,218 @@
+import csv
+import itertools
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from . import invite_codes, referrals
+from .models import CustomUser
+
+# ---
+# Importação em massa de usuários (migração da plataforma anterior).
+# Lê CSV/JSONL em streaming, calcula os hashes das senhas num pool de
+# processos, resolve invited_by por um mapa em memória código -> id e grava
+# com bulk_create por lotes. Depois de cada lote gravado fica um ponto de
+# retoma (checkpoint), e as ligações pendentes do lote entram nele ainda
+# dentro da transação; números de telefone já existentes são ignorados, por
+# isso repetir um lote não duplica usuários.
+# ---
+
+# Colunas reconhecidas (só phone_number e password ou password_hash são obrigatórias)
+FIELDS = ('phone_number', 'password', 'password_hash', 'full_name', 'invite_code', 'invited_by', 'date_joined')
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+def read_rows(path):
+    # Um dicionário por linha; o formato vem da extensão (.csv ou .jsonl/.ndjson)
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as handle:
+            yield from csv.DictReader(handle)
+    elif path.endswith(('.jsonl', '.ndjson')):
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise UnsupportedFormat(f"Formato não suportado: {path} (use .csv ou .jsonl).")
+
+
+def _hash_password(args):
+    raw, hasher = args
+    return make_password(raw, hasher=hasher)
+
+
+def _known_hash(value):
+    if not value:
+        return False
+    try:
+        identify_hasher(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _init_worker():
+    # Processos criados com "spawn" não herdam o Django configurado
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.imported = 0
+        self.pending = []
+
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as handle:
+                state = json.load(handle)
+            self.rows, self.imported, self.pending = state['rows'], state['imported'], state['pending']
+        return self
+
+    def save(self):
+        if not self.path:
+            return
+        # Escrita atómica: um ficheiro temporário substitui o anterior
+        with open(self.path + '.tmp', 'w') as handle:
+            json.dump({'rows': self.rows, 'imported': self.imported, 'pending': self.pending}, handle)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class Importer:
+    def __init__(self, chunk_size=5000, workers=None, hasher='default', checkpoint=None, progress=None):
+        self.chunk_size = chunk_size
+        self.workers = os.cpu_count() if workers is None else workers
+        # Falha já aqui se o algoritmo não estiver em PASSWORD_HASHERS
+        self.hasher = get_hasher(hasher).algorithm
+        self.checkpoint = Checkpoint(checkpoint).load()
+        self.progress = progress
+        self.stats = {'rows': 0, 'imported': 0, 'existing': 0, 'invalid': 0, 'unknown_sponsors': 0}
+        # Mapa código de convite -> id, carregado uma vez e atualizado a cada lote
+        self.codes = {}
+
+    def run(self, rows):
+        started = time.perf_counter()
+        self.codes = dict(
+            CustomUser.objects.exclude(invite_code=None).values_list('invite_code', 'pk').iterator(chunk_size=10000)
+        )
+        rows = itertools.islice(rows, self.checkpoint.rows, None)
+        pool = ProcessPoolExecutor(self.workers, initializer=_init_worker) if self.workers > 1 else None
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self._import_chunk(chunk, pool)
+                self.checkpoint.rows += len(chunk)
+                self.checkpoint.save()
+                if self.progress:
+                    self.progress(self.checkpoint.rows, self.stats, time.perf_counter() - started)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        self._link_pending()
+        self.stats['elapsed_s'] = round(time.perf_counter() - started, 2)
+        self.stats['rows_per_s'] = round(self.stats['rows'] / self.stats['elapsed_s'], 1) if self.stats['elapsed_s'] else None
+        return self.stats
+
+    def _import_chunk(self, chunk, pool):
+        self.stats['rows'] += len(chunk)
+        rows = []
+        for row in chunk:
+            phone = (row.get('phone_number') or '').strip()
+            if not phone or not (row.get('password') or _known_hash(row.get('password_hash'))):
+                self.stats['invalid'] += 1
+                continue
+            rows.append((phone, row))
+
+        # Retoma/repetição: quem já existe não é recalculado nem inserido outra vez
+        existing = set(
+            CustomUser.objects.filter(phone_number__in=[phone for phone, _ in rows]).values_list('phone_number', flat=True)
+        )
+        self.stats['existing'] += len(existing)
+        rows = list({phone: row for phone, row in rows if phone not in existing}.items())
+        if not rows:
+            return
+
+        passwords = self._hash_passwords([row for _, row in rows], pool)
+        users, pending = [], []
+        for (phone, row), password in zip(rows, passwords):
+            sponsor_code = (row.get('invited_by') or '').strip()
+            sponsor_id = self.codes.get(sponsor_code) if sponsor_code else None
+            if sponsor_code and sponsor_id is None:
+                # O patrocinador pode vir mais à frente no ficheiro
+                pending.append([phone, sponsor_code])
+            user = CustomUser(
+                phone_number=phone, password=password, full_name=row.get('full_name') or None,
+                invite_code=(row.get('invite_code') or '').strip() or None, invited_by_id=sponsor_id,
+            )
+            if row.get('date_joined'):
+                user.date_joined = parse_datetime(row['date_joined'])
+            users.append(user)
+
+        with transaction.atomic():
+            created = CustomUser.objects.bulk_create(invite_codes.assign(users))
+            referrals.add_users([user.pk for user in created])
+            # As ligações pendentes vão para o checkpoint antes do commit: se o processo
+            # parar logo a seguir, a retoma salta o lote (já existe) sem as perder. Se o
+            # commit falhar, a retoma grava o lote outra vez e as repetidas são ignoradas
+            known = {tuple(link) for link in self.checkpoint.pending}
+            self.checkpoint.pending.extend(link for link in pending if tuple(link) not in known)
+            self.checkpoint.save()
+        self.codes.update((user.invite_code, user.pk) for user in created)
+        self.checkpoint.imported += len(created)
+        self.stats['imported'] += len(created)
+
+    def _hash_passwords(self, rows, pool):
+        hashed = [None] * len(rows)
+        raw = []
+        for index, row in enumerate(rows):
+            if _known_hash(row.get('password_hash')):
+                # Hash vindo da plataforma anterior, num formato que o Django reconhece
+                hashed[index] = row['password_hash']
+            else:
+                raw.append((index, (row['password'], self.hasher)))
+        if pool is None:
+            results = map(_hash_password, (args for _, args in raw))
+        else:
+            results = pool.map(_hash_password, (args for _, args in raw), chunksize=max(1, len(raw) // (self.workers * 4)))
+        for (index, _), value in zip(raw, results):
+            hashed[index] = value
+        return hashed
+
+    def _link_pending(self):
+        # Ligações a patrocinadores que só apareceram depois: um UPDATE por patrocinador
+        if not self.checkpoint.pending:
+            return
+        by_sponsor = defaultdict(list)
+        for phone, code in self.checkpoint.pending:
+            sponsor_id = self.codes.get(code)
+            if sponsor_id is None:
+                self.stats['unknown_sponsors'] += 1
+            else:
+                by_sponsor[sponsor_id].append(phone)
+        with transaction.atomic():
+            for sponsor_id, phones in by_sponsor.items():
+                unlinked = CustomUser.objects.filter(phone_number__in=phones, invited_by=None)
+                user_ids = list(unlinked.values_list('pk', flat=True))
+                unlinked.update(invited_by_id=sponsor_id)
+                # Os descendentes destes usuários também ganham novos antepassados
+                for user_id in user_ids:
+                    referrals.link_subtree(user_id, sponsor_id)
+        self.checkpoint.pending = []
+        self.checkpoint.save()
@@ -0,0 +1,27 @@
+import asyncio
+from contextlib import asynccontextmanager
+from weakref import WeakValueDictionary
+
+# ---
+# Secção crítica por usuário nas views assíncronas. Dentro do processo, os
+# pedidos do mesmo usuário (cliques repetidos) esperam uns pelos outros num
+# asyncio.Lock em vez de competirem pela mesma linha na base de dados; entre
+# processos a garantia continua a ser da base de dados (SELECT ... FOR UPDATE
+# ou UPDATE condicional dentro da transação).
+# ---
+
+# Um lock por (ciclo de eventos, usuário), apagado quando ninguém o usa. Em
+# produção (uvicorn, ver Procfile) cada worker tem um único ciclo; a chave só
+# separa os ciclos que o async_to_sync cria quando as views correm em WSGI
+# (cliente de testes), onde um asyncio.Lock não pode ser partilhado.
+_locks = WeakValueDictionary()
+
+
+@asynccontextmanager
+async def hold(user_id):
+    key = (id(asyncio.get_running_loop()), user_id)
+    lock = _locks.get(key)
+    if lock is None:
+        lock = _locks[key] = asyncio.Lock()
+    async with lock:
+        yield
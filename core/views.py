@@ -1,19 +1,31 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import login, authenticate, logout, update_session_auth_hash
-from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
+from django.contrib.auth import login, logout, update_session_auth_hash
+from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib import messages
-from django.db.models import Sum
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, OuterRef, Q
 from django.urls import reverse
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_POST
-import random
-from datetime import date, time, datetime
+from datetime import time
 from django.utils import timezone
 from decimal import Decimal
 
-from .forms import RegisterForm, DepositForm, WithdrawalForm, BankDetailsForm
-from .models import PlatformSettings, CustomUser, Level, UserLevel, BankDetails, Deposit, Withdrawal, Task, PlatformBankDetails, Roulette, RouletteSettings
+from .dates import day_filter
+from .forms import RegisterForm, LoginForm, DepositForm, WithdrawalForm, BankDetailsForm
+from .models import CustomUser, Level, UserLevel, BankDetails, Deposit, Withdrawal, Task, PlatformBankDetails, LedgerEntry, CommissionEvent
+from . import balances, commissions, dashboard, deposits, payouts, profiling, roulette, singletons, throttling, uploads, user_cache, user_locks
+
+def _whatsapp_link():
+    # Configurações da plataforma vêm do cache partilhado (sem consulta por pedido)
+    platform_settings = singletons.platform_settings()
+    return platform_settings.whatsapp_link if platform_settings else '#'
 
 # --- FUNÇÃO ATUALIZADA ---
 def home(request):
@@ -30,25 +42,15 @@ def home(request):
 def menu(request):
     user = request.user
     
-    # Busca o nível ativo
-    active_level = UserLevel.objects.filter(user=user, is_active=True).first()
-
-    # Calcula Depósito Activo (Aprovado)
-    approved_deposit_total = Deposit.objects.filter(user=user, is_approved=True).aggregate(Sum('amount'))['amount__sum'] or 0
-
-    # Calcula Renda de Hoje (Tarefas concluídas hoje)
-    today = date.today()
-    daily_income = Task.objects.filter(user=user, completed_at__date=today).aggregate(Sum('earnings'))['earnings__sum'] or 0
-
-    # Calcula Total Sacado (Aprovado - Usando a lógica da função 'renda')
-    total_withdrawals = Withdrawal.objects.filter(user=user, status='Aprovado').aggregate(Sum('amount'))['amount__sum'] or 0
+    # Nível ativo, Depósito Activo, Renda de Hoje e Total Sacado vêm do resumo do usuário (uma consulta)
+    snapshot = dashboard.get(user)
+    active_level = snapshot.active_level
+    approved_deposit_total = snapshot.approved_deposit_total
+    daily_income = snapshot.today_income
+    total_withdrawals = snapshot.approved_withdrawal_total
 
     # Busca link do WhatsApp
-    try:
-        platform_settings = PlatformSettings.objects.first()
-        whatsapp_link = platform_settings.whatsapp_link
-    except (PlatformSettings.DoesNotExist, AttributeError):
-        whatsapp_link = '#'
+    whatsapp_link = _whatsapp_link()
 
     context = {
         'user': user, # Necessário para Saldo Activo (user.available_balance) e Subsídio (user.subsidy_balance)
@@ -71,7 +73,8 @@ def cadastro(request):
             user.set_password(form.cleaned_data['password'])
             
             # --- Lógica 1: Saldo Inicial (1000 KZ) no Cadastro ---
-            user.available_balance = 1000 # Define o saldo inicial de 1000 KZ
+            # O bônus é lançado no livro-razão depois de o usuário ser gravado
+            signup_bonus = Decimal('1000.00')
             # --- Fim da Lógica 1 ---
             
             # --- CORREÇÃO AQUI: O NOME DO CAMPO NO FORM É 'invited_by_code' ---
@@ -79,22 +82,26 @@ def cadastro(request):
             
             if invited_by_code:
                 try:
-                    invited_by_user = CustomUser.objects.get(invite_code=invited_by_code)
+                    # Os códigos novos são em maiúsculas (aceita-se o código escrito em minúsculas);
+                    # os antigos, hexadecimais, continuam em minúsculas
+                    invited_by_user = (
+                        CustomUser.objects.filter(invite_code=invited_by_code).first()
+                        or CustomUser.objects.get(invite_code=invited_by_code.upper())
+                    )
                     user.invited_by = invited_by_user
                 except CustomUser.DoesNotExist:
                     messages.error(request, 'Código de convite inválido.')
                     return render(request, 'cadastro.html', {'form': form})
             
-            user.save()
-            login(request, user)
+            with transaction.atomic():
+                user.save()
+                balances.credit(user, LedgerEntry.SIGNUP_BONUS, signup_bonus)
+            # Há dois backends configurados: a sessão fica com o que usa o cache
+            login(request, user, backend='core.backends.CachedModelBackend')
             messages.success(request, 'Cadastro realizado com sucesso! Você recebeu 1000 KZ de saldo inicial.')
             return redirect('menu')
         else:
-            try:
-                whatsapp_link = PlatformSettings.objects.first().whatsapp_link
-            except (PlatformSettings.DoesNotExist, AttributeError):
-                whatsapp_link = '#'
-            return render(request, 'cadastro.html', {'form': form, 'whatsapp_link': whatsapp_link})
+            return render(request, 'cadastro.html', {'form': form, 'whatsapp_link': _whatsapp_link()})
     else:
         # --- CORREÇÃO AQUI: O NOME DO CAMPO NO FORM É 'invited_by_code' ---
         if invite_code_from_url:
@@ -102,30 +109,20 @@ def cadastro(request):
         else:
             form = RegisterForm()
     
-    try:
-        whatsapp_link = PlatformSettings.objects.first().whatsapp_link
-    except (PlatformSettings.DoesNotExist, AttributeError):
-        whatsapp_link = '#'
-
-    return render(request, 'cadastro.html', {'form': form, 'whatsapp_link': whatsapp_link})
+    return render(request, 'cadastro.html', {'form': form, 'whatsapp_link': _whatsapp_link()})
 
 def user_login(request):
     if request.method == 'POST':
-        form = AuthenticationForm(request, data=request.POST)
+        form = LoginForm(request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
             # REMOVIDA CHAMADA INCORRETA: authenticate(request, user)
             login(request, user)
             return redirect('menu')
     else:
-        form = AuthenticationForm()
+        form = LoginForm()
 
-    try:
-        whatsapp_link = PlatformSettings.objects.first().whatsapp_link
-    except (PlatformSettings.DoesNotExist, AttributeError):
-        whatsapp_link = '#'
-
-    return render(request, 'login.html', {'form': form, 'whatsapp_link': whatsapp_link})
+    return render(request, 'login.html', {'form': form, 'whatsapp_link': _whatsapp_link()})
 
 @login_required
 def user_logout(request):
@@ -133,16 +130,32 @@ def user_logout(request):
     return redirect('menu')
 
 # --- FUNÇÃO DE DEPÓSITO ATUALIZADA PARA O NOVO FLUXO ---
+UPLOAD_ERRORS = {
+    uploads.TOO_LARGE: (413, 'O comprovativo é demasiado grande (máximo {max_mb} MB).'),
+    uploads.UNSUPPORTED: (415, 'O comprovativo tem de ser uma imagem JPEG, PNG ou WebP.'),
+}
+
 @login_required
+@csrf_exempt
+@throttling.rate_limit('deposito')
 def deposito(request):
-    platform_bank_details = PlatformBankDetails.objects.all()
-    deposit_instruction = PlatformSettings.objects.first().deposit_instruction if PlatformSettings.objects.first() else 'Instruções de depósito não disponíveis.'
-    
-    # Busca todos os valores de depósito dos Níveis para a Etapa 2
-    level_deposits = Level.objects.all().values_list('deposit_value', flat=True).distinct().order_by('deposit_value')
-    # Converte os Decimais para strings formatadas para JS
-    level_deposits_list = [str(d) for d in level_deposits] 
-
+    # O handler do comprovativo tem de ser instalado antes de qualquer leitura
+    # de request.POST, e o CsrfViewMiddleware lê-o: a verificação CSRF é feita
+    # depois, por _deposito (csrf_protect).
+    if request.method == 'POST':
+        handler = uploads.ProofUploadHandler(request)
+        request.upload_handlers = [handler]
+        request.POST
+        if handler.error:
+            # Upload abortado: nada é gravado, por isso a resposta não precisa do token CSRF
+            status, message = UPLOAD_ERRORS[handler.error]
+            messages.error(request, message.format(max_mb=handler.limit // (1024 * 1024)))
+            return _deposito_page(request, status=status)
+    return _deposito(request)
+
+@csrf_protect
+@throttling.idempotent('deposito')
+def _deposito(request):
     if request.method == 'POST':
         # O formulário agora é submetido na Etapa 3
         # Os campos 'amount' e 'proof_of_payment' são necessários
@@ -154,42 +167,43 @@ def deposito(request):
             
             # Não exibe mensagem aqui, mas sim no template
             # O template irá exibir uma tela de sucesso após a submissão
-            return render(request, 'deposito.html', {
-                'platform_bank_details': platform_bank_details,
-                'deposit_instruction': deposit_instruction,
-                'level_deposits_list': level_deposits_list,
-                'deposit_success': True # Variável de contexto para a tela de sucesso
-            })
+            return _deposito_page(request, deposit_success=True)
         else:
             messages.error(request, 'Erro ao enviar o depósito. Verifique o valor e o comprovativo.')
+    return _deposito_page(request)
+
+def _deposito_page(request, deposit_success=False, status=200):
+    platform_bank_details = PlatformBankDetails.objects.all()
+    platform_settings = singletons.platform_settings()
+    deposit_instruction = platform_settings.deposit_instruction if platform_settings else 'Instruções de depósito não disponíveis.'
     
-    # Se não for POST ou se for a primeira vez acessando a página
-    form = DepositForm()
-    
+    # Busca todos os valores de depósito dos Níveis para a Etapa 2
+    level_deposits = Level.objects.all().values_list('deposit_value', flat=True).distinct().order_by('deposit_value')
+    # Converte os Decimais para strings formatadas para JS
+    level_deposits_list = [str(d) for d in level_deposits] 
+
     context = {
         'platform_bank_details': platform_bank_details,
         'deposit_instruction': deposit_instruction,
-        'form': form,
         'level_deposits_list': level_deposits_list,
-        'deposit_success': False, # Estado inicial
+        'deposit_success': deposit_success, # True mostra a tela de sucesso
     }
-    return render(request, 'deposito.html', context)
+    if not deposit_success:
+        # Se não for POST ou se for a primeira vez acessando a página
+        context['form'] = DepositForm()
+    return render(request, 'deposito.html', context, status=status)
 # --- FIM DA FUNÇÃO DE DEPÓSITO ATUALIZADA ---
 
 @login_required
+@require_POST
 def approve_deposit(request, deposit_id):
     if not request.user.is_staff:
         messages.error(request, 'Você não tem permissão para realizar esta ação.')
         return redirect('menu')
 
-    deposit = get_object_or_404(Deposit, id=deposit_id)
-    if not deposit.is_approved:
-        deposit.is_approved = True
-        deposit.save()
-        
-        deposit.user.available_balance += deposit.amount
-        deposit.user.save()
-        
+    deposit = get_object_or_404(Deposit.objects.select_related('user'), id=deposit_id)
+    # Só aprova (e credita) se ainda estiver pendente
+    if deposits.approve([deposit.pk])['approved']:
         # --- LÓGICA DE COMISSÃO DE 15% REMOVIDA DAQUI ---
         # A comissão será aplicada na compra do nível (`nivel`)
         
@@ -201,13 +215,16 @@ def approve_deposit(request, deposit_id):
 # FUNÇÃO SAQUE - ATUALIZADA PARA HORÁRIO, VALOR MÍNIMO E LIMITE DIÁRIO
 # ==================================================================================
 @login_required
+@throttling.idempotent('saque')
+@throttling.rate_limit('saque')
 def saque(request):
     # Valores de restrição conforme solicitado
     MIN_WITHDRAWAL_AMOUNT = 2500
     START_TIME = time(9, 0, 0) # 09:00:00 (Hora de Luanda, Angola)
     END_TIME = time(17, 0, 0) # 17:00:00 (Hora de Luanda, Angola)
 
-    withdrawal_instruction = PlatformSettings.objects.first().withdrawal_instruction if PlatformSettings.objects.first() else 'Instruções de saque não disponíveis.'
+    platform_settings = singletons.platform_settings()
+    withdrawal_instruction = platform_settings.withdrawal_instruction if platform_settings else 'Instruções de saque não disponíveis.'
     
     withdrawal_records = Withdrawal.objects.filter(user=request.user).order_by('-created_at')
     
@@ -218,11 +235,12 @@ def saque(request):
     today = timezone.localdate(timezone.now())
     is_time_to_withdraw = START_TIME <= now <= END_TIME
     
-    # ✅ NOVO FILTRO CORRIGIDO: Checa se já existe um pedido de saque (Pendente ou Aprovado) hoje
+    # ✅ NOVO FILTRO CORRIGIDO: Checa se já existe um pedido de saque (Pendente, Aprovado ou Pago) hoje
+    # Intervalo semiaberto do dia local (usa o índice user/status/created_at)
     withdrawals_today_count = Withdrawal.objects.filter(
         user=request.user,
-        created_at__date=today, # Filtra apenas pela data de criação
-        status__in=['Pendente', 'Aprovado']
+        status__in=Withdrawal.ACTIVE_STATUSES,
+        **day_filter('created_at', today)
     ).count()
 
     can_withdraw_today = withdrawals_today_count == 0
@@ -250,16 +268,17 @@ def saque(request):
             # 4. Checa o valor mínimo
             if amount < MIN_WITHDRAWAL_AMOUNT:
                 messages.error(request, f'O valor mínimo para saque é {MIN_WITHDRAWAL_AMOUNT:.2f} KZ.')
-            # 5. Checa o saldo
-            elif request.user.available_balance < amount:
-                messages.error(request, 'Saldo insuficiente.')
             else:
-                # Se tudo estiver ok
-                withdrawal = Withdrawal.objects.create(user=request.user, amount=amount)
-                request.user.available_balance -= amount
-                request.user.save()
-                messages.success(request, 'Saque solicitado com sucesso. Aguarde a aprovação. Você só poderá solicitar um novo saque amanhã.')
-                return redirect('saque')
+                # 5. Debita o saldo: o UPDATE condicional falha se o saldo não cobrir o valor
+                try:
+                    with transaction.atomic():
+                        balances.debit(request.user, LedgerEntry.WITHDRAWAL, amount)
+                        withdrawal = Withdrawal.objects.create(user=request.user, amount=amount)
+                except balances.InsufficientBalance:
+                    messages.error(request, 'Saldo insuficiente.')
+                else:
+                    messages.success(request, 'Saque solicitado com sucesso. Aguarde a aprovação. Você só poderá solicitar um novo saque amanhã.')
+                    return redirect('saque')
     else:
         form = WithdrawalForm()
 
@@ -280,16 +299,15 @@ def tarefa(request):
     user = request.user
     
     # Encontra o nível ativo do usuário
-    active_level = UserLevel.objects.filter(user=user, is_active=True).first()
+    active_level = UserLevel.objects.select_related('level').filter(user=user, is_active=True).first()
     has_active_level = active_level is not None
     
-    # Define o número de tarefas
-    max_tasks = 1
+    # Número de tarefas por dia definido no nível
+    max_tasks = active_level.level.max_tasks if has_active_level else 1
     tasks_completed_today = 0
     
     if has_active_level:
-        today = date.today()
-        tasks_completed_today = Task.objects.filter(user=user, completed_at__date=today).count()
+        tasks_completed_today = Task.objects.filter(user=user, task_day=timezone.localdate()).count()
     
     context = {
         'has_active_level': has_active_level,
@@ -299,93 +317,103 @@ def tarefa(request):
     }
     return render(request, 'tarefa.html', context)
 
-@login_required
-@require_POST
-def process_task(request):
-    user = request.user
-    active_level = UserLevel.objects.filter(user=user, is_active=True).first()
-
-    if not active_level:
-        return JsonResponse({'success': False, 'message': 'Você não tem um nível ativo para realizar tarefas.'})
-
-    today = date.today()
-    tasks_completed_today = Task.objects.filter(user=user, completed_at__date=today).count()
-    max_tasks = 1
-
-    if tasks_completed_today >= max_tasks:
-        return JsonResponse({'success': False, 'message': 'Você já concluiu todas as tarefas diárias.'})
-
-    earnings = active_level.level.daily_gain
-    Task.objects.create(user=user, earnings=earnings)
-    user.available_balance += earnings
-    user.save()
-
-    # --- Lógica 2: Subsídio de 100 KZ para o Patrocinador por Tarefa do Subordinado ---
-    invited_by_user = user.invited_by
-    if invited_by_user:
-        # Verifica se o patrocinador tem pelo menos um nível ativo para receber o subsídio
-        if UserLevel.objects.filter(user=invited_by_user, is_active=True).exists():
-            subsidy_amount = Decimal('100.00')
-            
-            # Adiciona o subsídio ao saldo e subsídio do patrocinador
-            invited_by_user.available_balance += subsidy_amount
-            invited_by_user.subsidy_balance += subsidy_amount
-            invited_by_user.save()
+def _complete_task(user_id, sponsor_id, earnings, max_tasks):
+    # A quota diária é a restrição única (user, task_day, slot): o INSERT tenta a
+    # posição seguinte às tarefas já feitas hoje e só avança se um clique
+    # simultâneo a tiver ocupado entretanto. Sem bloqueio do usuário, dois
+    # cliques simultâneos nunca passam do limite.
+    today = timezone.localdate()
+    with transaction.atomic():
+        slot = Task.objects.filter(user_id=user_id, task_day=today).count()
+        while slot < max_tasks:
+            try:
+                with transaction.atomic():
+                    Task.objects.create(user_id=user_id, earnings=earnings, task_day=today, slot=slot)
+                break
+            except IntegrityError:
+                slot += 1
+        else:
+            return False
+        balances.credit(user_id, LedgerEntry.TASK_EARNING, earnings)
+
+        # --- Lógica 2: Subsídio de 100 KZ para o Patrocinador por Tarefa do Subordinado ---
+        # Apenas regista o evento: o worker process_commissions verifica se o
+        # patrocinador tem nível ativo e credita o subsídio em lote
+        if sponsor_id:
+            commissions.emit(sponsor_id, user_id, CommissionEvent.TASK_SUBSIDY, commissions.TASK_SUBSIDY_AMOUNT)
             
             # Nota: Não usamos messages aqui pois é uma função JsonResponse
             # O subsídio é dado de forma silenciosa para o patrocinador
             # (Você pode implementar um sistema de notificação em outro lugar se quiser)
-    # --- Fim da Lógica 2 ---
+        # --- Fim da Lógica 2 ---
+    return True
+
+# Views assíncronas (servidas pelo davenport_downs.asgi): as leituras usam o ORM
+# assíncrono e só a transação de escrita passa por sync_to_async
+@login_required
+@require_POST
+@throttling.idempotent('process_task')
+@throttling.rate_limit('process_task', json=True)
+async def process_task(request):
+    user = await request.auser()
+    async with user_locks.hold(user.pk):
+        active_level = await UserLevel.objects.select_related('level').filter(user=user, is_active=True).afirst()
+
+        if not active_level:
+            return JsonResponse({'success': False, 'message': 'Você não tem um nível ativo para realizar tarefas.'})
+
+        earnings = active_level.level.daily_gain
+        if not await sync_to_async(_complete_task)(user.pk, user.invited_by_id, earnings, active_level.level.max_tasks):
+            return JsonResponse({'success': False, 'message': 'Você já concluiu todas as tarefas diárias.'})
 
     return JsonResponse({'success': True, 'daily_gain': earnings})
 
 @login_required
+@throttling.idempotent('nivel')
+@throttling.rate_limit('nivel')
 def nivel(request):
-    levels = Level.objects.all().order_by('deposit_value')
-    user_levels = UserLevel.objects.filter(user=request.user, is_active=True).values_list('level__id', flat=True)
+    # Catálogo e níveis do usuário vêm do cache (sem consultas no caso comum)
+    levels = singletons.levels()
+    user_levels = user_cache.active_level_ids(request.user.pk)
     
     if request.method == 'POST':
+        # O nível comprado sai do catálogo já carregado (evita uma consulta por compra)
         level_id = request.POST.get('level_id')
-        level_to_buy = get_object_or_404(Level, id=level_id)
+        level_to_buy = next((level for level in levels if str(level.id) == level_id), None)
+        if level_to_buy is None:
+            raise Http404('Nível não encontrado.')
 
         if level_to_buy.id in user_levels:
             messages.error(request, 'Você já possui este nível.')
             return redirect('nivel')
         
-        if request.user.available_balance >= level_to_buy.deposit_value:
-            
-            # --- LÓGICA DE SUBSÍDIO DE 15% NA COMPRA DO NÍVEL (Patrocinador) ---
-            subordinate_user = request.user # O usuário que está comprando o nível (subordinado)
-            invited_by_user = subordinate_user.invited_by # O patrocinador (quem o convidou)
-            
-            if invited_by_user:
-                # 1. Verifica se o patrocinador tem pelo menos um nível ativo
-                if UserLevel.objects.filter(user=invited_by_user, is_active=True).exists():
+        subordinate_user = request.user # O usuário que está comprando o nível (subordinado)
+        sponsor_id = subordinate_user.invited_by_id # O patrocinador (quem o convidou)
+
+        try:
+            with transaction.atomic():
+                # Efetua a compra do nível: o débito falha se o saldo não cobrir o valor
+                balances.debit(subordinate_user, LedgerEntry.LEVEL_PURCHASE, level_to_buy.deposit_value)
+                UserLevel.objects.create(user=subordinate_user, level=level_to_buy, is_active=True)
+                CustomUser.objects.filter(pk=subordinate_user.pk).update(level_active=True)
+
+                # --- LÓGICA DE SUBSÍDIO DE 15% NA COMPRA DO NÍVEL (Patrocinador) ---
+                if sponsor_id:
                     commission_rate = Decimal('0.15') # 15%
-                    # 2. O cálculo é feito sobre o valor do nível comprado
+                    # 1. O cálculo é feito sobre o valor do nível comprado
                     commission_amount = level_to_buy.deposit_value * commission_rate 
                     
-                    # 3. Adiciona a comissão ao saldo e subsídio do patrocinador
-                    invited_by_user.available_balance += commission_amount
-                    invited_by_user.subsidy_balance += commission_amount
-                    invited_by_user.save()
-                    
-                    messages.success(request, f'🥳 Subsídio de {commission_amount:.2f} KZ concedido por {subordinate_user.phone_number} comprar o nível {level_to_buy.name}.')
-                else:
-                    messages.warning(request, 'Aviso: Seu patrocinador não recebeu comissão (Patrocinador sem nível ativo).')
-            
-            # ----------------------------------------------------------------------
-            
-            # Efetua a compra do nível
-            request.user.available_balance -= level_to_buy.deposit_value
-            UserLevel.objects.create(user=request.user, level=level_to_buy, is_active=True)
-            request.user.level_active = True
-            request.user.save()
-            
-            messages.success(request, f'Você comprou o nível {level_to_buy.name} com sucesso!')
-        else:
+                    # 2. Regista o evento; o worker só credita se o patrocinador tiver nível ativo
+                    commissions.emit(sponsor_id, subordinate_user, CommissionEvent.LEVEL_COMMISSION, commission_amount)
+                # ----------------------------------------------------------------------
+        except balances.InsufficientBalance:
             messages.error(request, 'Saldo insuficiente. Por favor, faça um depósito.')
+            return redirect('nivel')
+
+        if sponsor_id:
+            messages.success(request, f'🥳 Subsídio de {commission_amount:.2f} KZ enviado ao seu patrocinador (creditado se ele tiver um nível ativo).')
         
+        messages.success(request, f'Você comprou o nível {level_to_buy.name} com sucesso!')
         return redirect('nivel')
         
     context = {
@@ -394,54 +422,59 @@ def nivel(request):
     }
     return render(request, 'nivel.html', context)
 
+# Membros por página em cada aba da equipa
+TEAM_PAGE_SIZE = 20
+
 @login_required
 def equipa(request):
     user = request.user
 
-    # 1. Encontra todos os membros da equipe (convidados diretos)
-    team_members = CustomUser.objects.filter(invited_by=user).order_by('-date_joined')
-    team_count = team_members.count()
-
-    # 2. Obtém todos os Níveis disponíveis
-    all_levels = Level.objects.all().order_by('deposit_value')
-
-    # 3. Contabilização por Nível de Investimento
-    levels_data = []
+    # 1. Membros da equipe (convidados diretos) - ainda não avaliado
+    team_members = CustomUser.objects.filter(invited_by=user)
+    active_levels = UserLevel.objects.filter(user=OuterRef('pk'), is_active=True)
+
+    # 2. Totais da equipa numa única consulta (agregação condicional)
+    totals = team_members.annotate(invested=Exists(active_levels)).aggregate(
+        team_count=Count('pk'),
+        invested_count=Count('pk', filter=Q(invested=True)),
+    )
+    team_count = totals['team_count']
+    total_non_investors = team_count - totals['invested_count']
+
+    # 3. Contagem de membros por Nível ativo, agrupada na base de dados
+    counts_by_level = dict(
+        UserLevel.objects.filter(user__invited_by=user, is_active=True)
+        .values_list('level_id').annotate(members=Count('user_id', distinct=True)).order_by()
+    )
+
+    # 4. Abas: "Não Investido" primeiro, depois cada Nível
+    levels_data = [{'id': 0, 'name': 'Não Investido', 'count': total_non_investors}]
     total_investors = 0
-    
-    # Dicionário para armazenar membros por nível (para exibição no template)
-    members_by_level = {} 
-    
-    # Preenche os dados para cada nível
-    for level in all_levels:
-        # Filtra membros da equipe que possuem este nível ATIVO
-        members_with_level = team_members.filter(userlevel__level=level, userlevel__is_active=True).distinct()
-        
-        levels_data.append({
-            'name': level.name,
-            'count': members_with_level.count(),
-            'members': members_with_level, 
-        })
-        members_by_level[level.name] = members_with_level
-        total_investors += members_with_level.count()
-
-    # 4. Contabilização de Não Investidores GERAL
-    # Membros que NÃO têm NENHUM UserLevel ativo
-    non_invested_members = team_members.exclude(userlevel__is_active=True)
-    total_non_investors = non_invested_members.count()
-    
-    # Adiciona a contagem de não investidos na estrutura levels_data para a primeira aba
-    levels_data.insert(0, {
-        'name': 'Não Investido',
-        'count': total_non_investors,
-        'members': non_invested_members,
-    })
+    for level_id, level_name in Level.objects.order_by('deposit_value').values_list('id', 'name'):
+        count = counts_by_level.get(level_id, 0)
+        levels_data.append({'id': level_id, 'name': level_name, 'count': count})
+        total_investors += count
+
+    # 5. Apenas a página pedida da aba selecionada é carregada
+    try:
+        selected_tab = int(request.GET.get('aba', 0))
+    except ValueError:
+        selected_tab = 0
+    if selected_tab:
+        tab_members = team_members.filter(
+            Exists(active_levels.filter(level_id=selected_tab))
+        )
+    else:
+        tab_members = team_members.exclude(Exists(active_levels))
+    tab_members = tab_members.order_by('-date_joined').only('phone_number', 'date_joined')
+    members_page = Paginator(tab_members, TEAM_PAGE_SIZE).get_page(request.GET.get('pagina'))
 
     context = {
-        'team_members': team_members, # Membros totais
         'team_count': team_count, # Contagem total de membros
         'invite_link': request.build_absolute_uri(reverse('cadastro')) + f'?invite={user.invite_code}',
-        'levels_data': levels_data, # Dados detalhados por nível (para as abas)
+        'levels_data': levels_data, # Contagens por nível (para as abas)
+        'selected_tab': selected_tab,
+        'members_page': members_page, # Membros da aba selecionada (paginados)
         'total_investors': total_investors, # Contagem de investidores
         'total_non_investors': total_non_investors, # Contagem de não investidores
         'subsidy_balance': user.subsidy_balance, # Saldo de Subsídios
@@ -460,50 +493,41 @@ def roleta(request):
 
 @login_required
 @require_POST
-def spin_roulette(request):
-    user = request.user
+@throttling.idempotent('spin_roulette')
+@throttling.rate_limit('spin_roulette', json=True)
+async def spin_roulette(request):
+    user = await request.auser()
 
-    if not user.roulette_spins or user.roulette_spins <= 0:
-        return JsonResponse({'success': False, 'message': 'Você não tem giros disponíveis para a roleta.'})
-
-    user.roulette_spins -= 1
-    user.save()
-    
+    # Giro em lote (eventos promocionais): count giros num único pedido e numa única transação
     try:
-        roulette_settings = RouletteSettings.objects.first()
-        
-        if roulette_settings and roulette_settings.prizes:
-            prizes_from_admin = [Decimal(p.strip()) for p in roulette_settings.prizes.split(',')]
-            prizes_weighted = []
-            for prize in prizes_from_admin:
-                if prize <= 1000:
-                    prizes_weighted.extend([prize] * 3)
-                else:
-                    prizes_weighted.append(prize)
-            prize = random.choice(prizes_weighted)
-        else:
-            prizes = [Decimal('100'), Decimal('200'), Decimal('300'), Decimal('500'), Decimal('1000'), Decimal('2000')]
-            prize = random.choice(prizes)
-
-    except RouletteSettings.DoesNotExist:
-        prizes = [Decimal('100'), Decimal('200'), Decimal('300'), Decimal('500'), Decimal('1000'), Decimal('2000')]
-        prize = random.choice(prizes)
-
-    Roulette.objects.create(user=user, prize=prize, is_approved=True)
+        count = int(request.POST.get('count', 1))
+    except ValueError:
+        count = 0
+    if not 1 <= count <= settings.ROULETTE_MAX_SPINS_PER_REQUEST:
+        return JsonResponse({'success': False, 'message': 'Número de giros inválido.'}, status=400)
 
-    user.subsidy_balance += prize
-    user.available_balance += prize
-    user.save()
+    if not user.roulette_spins or user.roulette_spins < count:
+        return JsonResponse({'success': False, 'message': 'Você não tem giros disponíveis para a roleta.'})
 
-    return JsonResponse({'success': True, 'prize': prize, 'message': f'Parabéns! Você ganhou {prize} KZ.'})
+    # O giro é consumido com um UPDATE condicional na mesma transação do prêmio:
+    # cliques simultâneos nunca deixam os giros negativos nem perdem créditos
+    async with user_locks.hold(user.pk):
+        try:
+            prizes = await sync_to_async(roulette.spin)(user.pk, count)
+        except balances.NoSpinsAvailable:
+            return JsonResponse({'success': False, 'message': 'Você não tem giros disponíveis para a roleta.'})
+        except roulette.PrizesExhausted:
+            return JsonResponse({'success': False, 'message': 'Os prêmios de hoje esgotaram. Tente novamente amanhã.'})
+
+    prize = sum(prizes)
+    return JsonResponse({
+        'success': True, 'prize': prize, 'prizes': prizes, 'message': f'Parabéns! Você ganhou {prize} KZ.',
+    })
 
 @login_required
 def sobre(request):
-    try:
-        platform_settings = PlatformSettings.objects.first()
-        history_text = platform_settings.history_text if platform_settings else 'Histórico da plataforma não disponível.'
-    except PlatformSettings.DoesNotExist:
-        history_text = 'Histórico da plataforma não disponível.'
+    platform_settings = singletons.platform_settings()
+    history_text = platform_settings.history_text if platform_settings else 'Histórico da plataforma não disponível.'
 
     return render(request, 'sobre.html', {'history_text': history_text})
 
@@ -547,17 +571,14 @@ def perfil(request):
 def renda(request):
     user = request.user
     
-    active_level = UserLevel.objects.filter(user=user, is_active=True).first()
-
-    approved_deposit_total = Deposit.objects.filter(user=user, is_approved=True).aggregate(Sum('amount'))['amount__sum'] or 0
-    
-    today = date.today()
-    daily_income = Task.objects.filter(user=user, completed_at__date=today).aggregate(Sum('earnings'))['earnings__sum'] or 0
-
-    # A linha abaixo foi alterada para corrigir o status para 'Aprovado'
-    total_withdrawals = Withdrawal.objects.filter(user=user, status='Aprovado').aggregate(Sum('amount'))['amount__sum'] or 0
-
-    total_income = (Task.objects.filter(user=user).aggregate(Sum('earnings'))['earnings__sum'] or 0) + user.subsidy_balance
+    # Todos os indicadores vêm do resumo do usuário (uma consulta)
+    snapshot = dashboard.get(user)
+    active_level = snapshot.active_level
+    approved_deposit_total = snapshot.approved_deposit_total
+    daily_income = snapshot.today_income
+    total_withdrawals = snapshot.approved_withdrawal_total
+
+    total_income = snapshot.task_income_total + user.subsidy_balance
     
     context = {
         'user': user,
@@ -568,4 +589,17 @@ def renda(request):
         'total_income': total_income,
     }
     return render(request, 'renda.html', context)
-    
\ No newline at end of file
+    
+@staff_member_required
+def profiling_report(request):
+    # Histogramas por rota deste processo (consultas, tempo de BD, templates e Python)
+    return JsonResponse({'views': profiling.registry.snapshot()})
+
+@staff_member_required
+def metrics(request):
+    return HttpResponse(profiling.registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def roulette_exposure(request):
+    # Total pago pela roleta na hora e no dia correntes, a partir dos contadores (sem somar a tabela Roulette)
+    return JsonResponse(payouts.exposure())
@@ -0,0 +1,142 @@
+import csv
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import dashboard, ledger
+from .models import LedgerEntry, Withdrawal
+
+# ---
+# Processamento dos saques em lote (ações do admin).
+# As mudanças de estado seguem Withdrawal.TRANSITIONS e são feitas por
+# conjunto: os saques são bloqueados com SELECT ... FOR UPDATE SKIP LOCKED,
+# mudam de estado com um UPDATE condicional (só os que ainda estão num estado
+# de origem válido), e as devoluções dos rejeitados vão para o livro-razão em
+# bulk. O ficheiro de pagamentos é gerado em streaming, linha a linha, a
+# partir de um iterador da base de dados (sem carregar os saques em memória),
+# e só leva os aprovados ainda não exportados (marcados com exported_at); um
+# lote já marcado pode ser exportado de novo tal como estava (exported_batches).
+# ---
+
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+
+PAYOUT_HEADER = ('saque', 'telefone', 'titular', 'banco', 'iban', 'valor', 'pedido_em')
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+class ConcurrentProcessing(Exception):
+    # Outro pedido mudou o estado de parte dos saques ao mesmo tempo: a transação é desfeita
+    pass
+
+
+def sources_for(target):
+    return [status for status, targets in Withdrawal.TRANSITIONS.items() if target in targets]
+
+
+def transition(withdrawal_ids, target, batch_size=BATCH_SIZE):
+    sources = sources_for(target)
+    if not sources:
+        raise InvalidTransition(f"Nenhum saque pode passar para o estado {target}.")
+    withdrawal_ids = sorted(set(withdrawal_ids))
+    stats = {'requested': len(withdrawal_ids), 'changed': 0, 'users': 0, 'amount': Decimal('0.00')}
+
+    with transaction.atomic():
+        rows = []
+        for start in range(0, len(withdrawal_ids), batch_size):
+            rows += (
+                Withdrawal.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=withdrawal_ids[start:start + batch_size], status__in=sources)
+                .order_by('pk')
+                .values_list('pk', 'user_id', 'amount', 'status')
+            )
+        if not rows:
+            return stats
+
+        changed = 0
+        for start in range(0, len(rows), batch_size):
+            changed += Withdrawal.objects.filter(
+                pk__in=[pk for pk, _, _, _ in rows[start:start + batch_size]], status__in=sources,
+            ).update(status=target)
+        if changed != len(rows):
+            raise ConcurrentProcessing()
+
+        # Variação do total sacado de cada usuário (entra ou sai dos estados aprovados)
+        withdrawn = defaultdict(Decimal)
+        for _, user_id, amount, status in rows:
+            was_approved = status in Withdrawal.APPROVED_STATUSES
+            is_approved = target in Withdrawal.APPROVED_STATUSES
+            if was_approved != is_approved:
+                withdrawn[user_id] += amount if is_approved else -amount
+        dashboard.add_many('approved_withdrawal_total', {user_id: total for user_id, total in withdrawn.items() if total})
+
+        if target == Withdrawal.REJECTED:
+            # O valor foi debitado no pedido: volta ao saldo disponível
+            ledger.post_many(ledger.entry(user_id, LedgerEntry.WITHDRAWAL_REFUND, amount) for _, user_id, amount, _ in rows)
+
+    stats.update(
+        changed=len(rows),
+        users=len({user_id for _, user_id, _, _ in rows}),
+        amount=sum((amount for _, _, amount, _ in rows), Decimal('0.00')),
+    )
+    return stats
+
+
+def claim_for_export(queryset):
+    # Marca com um UPDATE condicional os aprovados ainda não exportados: dois
+    # pedidos a exportar os mesmos saques nunca recebem as mesmas linhas.
+    # Devolve quantos foram marcados e o queryset desse lote.
+    stamp = timezone.now()
+    claimed = queryset.filter(status=Withdrawal.APPROVED, exported_at__isnull=True).update(exported_at=stamp)
+    return claimed, queryset.filter(exported_at=stamp)
+
+
+def exported_batches(queryset):
+    # Lotes completos (mesmo exported_at) dos aprovados já exportados na seleção,
+    # para voltar a gerar um ficheiro que não chegou a ser descarregado. Não mexe
+    # em exported_at: o lote continua a ser o mesmo.
+    stamps = queryset.filter(status=Withdrawal.APPROVED, exported_at__isnull=False).values('exported_at')
+    return Withdrawal.objects.filter(status=Withdrawal.APPROVED, exported_at__in=stamps)
+
+
+class _Echo:
+    # Pseudo-ficheiro para o csv.writer: devolve a linha em vez de a guardar
+    def write(self, value):
+        return value
+
+
+def payout_rows(queryset):
+    # Saques aprovados do queryset, com os dados bancários no mesmo SELECT
+    withdrawals = (
+        queryset.filter(status=Withdrawal.APPROVED)
+        .select_related('user__bankdetails')
+        .only(
+            'pk', 'amount', 'created_at', 'user__phone_number',
+            'user__bankdetails__account_holder_name', 'user__bankdetails__bank_name', 'user__bankdetails__IBAN',
+        )
+        .order_by('pk')
+    )
+    for withdrawal in withdrawals.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        bank = getattr(withdrawal.user, 'bankdetails', None)
+        yield (
+            withdrawal.pk,
+            withdrawal.user.phone_number,
+            bank.account_holder_name if bank else '',
+            bank.bank_name if bank else '',
+            bank.IBAN if bank else '',
+            withdrawal.amount,
+            timezone.localtime(withdrawal.created_at).strftime('%Y-%m-%d %H:%M'),
+        )
+
+
+def payout_csv(queryset):
+    # Gerador de linhas CSV para um StreamingHttpResponse
+    writer = csv.writer(_Echo())
+    yield writer.writerow(PAYOUT_HEADER)
+    for row in payout_rows(queryset):
+        yield writer.writerow(row)
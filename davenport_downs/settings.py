@@ -2,8 +2,10 @@
 Django settings for davenport_downs project.
 """
 
+from decimal import Decimal
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 from decouple import config
 
@@ -64,8 +66,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    # WhiteNoise deve vir logo abaixo do SecurityMiddleware
-    'whitenoise.middleware.WhiteNoiseMiddleware', 
+    # WhiteNoise deve vir logo abaixo do SecurityMiddleware (versão que também funciona em ASGI, ver core/middleware.py)
+    'core.middleware.WhiteNoiseMiddleware',
+    # Consultas e tempos por rota (ver core/profiling.py); depois do WhiteNoise para ignorar os estáticos
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,7 +82,8 @@ ROOT_URLCONF = 'davenport_downs.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates com medição do tempo de renderização por pedido
+        'BACKEND': 'core.profiling.ProfiledDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -103,15 +108,117 @@ DATABASES = {
         # Render usa a variável de ambiente DATABASE_URL automaticamente.
         # Definimos um default seguro para o desenvolvimento local.
         default=config('DATABASE_URL', default=f'sqlite:///{BASE_DIR}/db.sqlite3'),
-        conn_max_age=600  # Adiciona conexão de pooling (opcional, mas recomendado)
+        # Servido por ASGI (Procfile): cada pedido corre numa thread própria do executor
+        # e as ligações persistentes ficariam presas a essas threads, por isso fecham
+        # no fim de cada pedido (recomendação do Django para ASGI)
+        conn_max_age=config('CONN_MAX_AGE', default=0, cast=int),
     )
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Transações de escrita pedem o lock logo no BEGIN: sem isto, duas transações
+    # que leem e depois escrevem falham com "database is locked" em vez de esperar
+    DATABASES['default'].setdefault('OPTIONS', {})['transaction_mode'] = 'IMMEDIATE'
+    # ... e esperam por ele até 30 s (os testes de concorrência abrem dezenas de ligações)
+    DATABASES['default']['OPTIONS']['timeout'] = 30
+    # Base de testes num ficheiro, não em memória: as threads dos testes de
+    # concorrência abrem ligações próprias e têm de ver os mesmos dados
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(tempfile.gettempdir(), 'davenport_downs_test.sqlite3')}
 if not DEBUG and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
     # Este é um erro comum, se estiver em produção, o DB deve ser PostgreSQL ou similar,
     # não o db.sqlite3 local. Apenas um aviso de segurança.
     print("AVISO: Usando SQLite em produção. O Render PostgreSQL é recomendado.")
 
 
+# ======================================================================
+# CACHE
+# ======================================================================
+# Em produção, REDIS_URL aponta para um cache partilhado por todos os workers
+# do gunicorn (as invalidações das configurações chegam a todos). Sem ele,
+# cada processo usa o seu próprio cache em memória.
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Tempo máximo (segundos) que uma cópia das configurações singleton fica em cache.
+# Limita a desatualização quando o cache não é partilhado entre processos.
+SINGLETON_CACHE_TIMEOUT = config('SINGLETON_CACHE_TIMEOUT', default=300, cast=int)
+
+# Sessões e request.user a partir do cache (core/user_cache.py). Só são seguros
+# com um cache partilhado: sem REDIS_URL cada worker teria a sua cópia, e uma
+# alteração feita num deles não invalidaria os outros. 'signed_cookies' também
+# evita a consulta da sessão sem Redis (mas a sessão não pode ser revogada).
+SESSION_ENGINE = config(
+    'SESSION_ENGINE',
+    default='django.contrib.sessions.backends.cached_db' if REDIS_URL else 'django.contrib.sessions.backends.db',
+)
+USER_CACHE_TIMEOUT = config('USER_CACHE_TIMEOUT', default=300 if REDIS_URL else 0, cast=int)
+
+
+# ======================================================================
+# INSTRUMENTAÇÃO (core/profiling.py)
+# ======================================================================
+# Regista consultas e tempos por rota, expostos em /profiling/ e /metrics/ (staff).
+REQUEST_PROFILING = config('REQUEST_PROFILING', default=True, cast=bool)
+
+# Com True, uma view acima do seu orçamento de consultas levanta erro (usado nos testes).
+QUERY_BUDGET_STRICT = config('QUERY_BUDGET_STRICT', default=False, cast=bool)
+
+
+# ======================================================================
+# SENHAS E LOGIN
+# ======================================================================
+# Algoritmo preferido: 'scrypt' (padrão, só biblioteca padrão), 'argon2'
+# (argon2-cffi) ou 'pbkdf2'. Os restantes continuam a verificar as
+# senhas antigas, que são recalculadas com o preferido no login seguinte.
+PASSWORD_HASHER_TIERS = {
+    'scrypt': 'core.hashers.TunedScryptPasswordHasher',
+    'argon2': 'core.hashers.TunedArgon2PasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHER_TIER = config('PASSWORD_HASHER_TIER', default='scrypt')
+PASSWORD_HASHERS = [PASSWORD_HASHER_TIERS[PASSWORD_HASHER_TIER]] + [
+    hasher for tier, hasher in PASSWORD_HASHER_TIERS.items() if tier != PASSWORD_HASHER_TIER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Tentativas de login falhadas toleradas por telefone e por IP dentro da janela (segundos)
+LOGIN_MAX_FAILURES_PER_PHONE = config('LOGIN_MAX_FAILURES_PER_PHONE', default=5, cast=int)
+LOGIN_MAX_FAILURES_PER_IP = config('LOGIN_MAX_FAILURES_PER_IP', default=30, cast=int)
+LOGIN_FAILURE_WINDOW = config('LOGIN_FAILURE_WINDOW', default=900, cast=int)
+
+# Limites de pedidos por usuário/IP nas ações (core.throttling.RATE_LIMITS) e
+# quanto tempo (segundos) a resposta de um pedido fica guardada para a sua chave de idempotência
+RATE_LIMITING = config('RATE_LIMITING', default=True, cast=bool)
+IDEMPOTENCY_KEY_TIMEOUT = config('IDEMPOTENCY_KEY_TIMEOUT', default=600, cast=int)
+
+# Proxies de confiança à frente da aplicação, para obter o IP real do X-Forwarded-For.
+# No Render (variável RENDER definida pela plataforma) há um; sem proxies configurados,
+# um pedido com X-Forwarded-For não tem IP conhecido e os limites por IP não se aplicam
+NUM_PROXIES = config('NUM_PROXIES', default=1 if config('RENDER', default=False, cast=bool) else 0, cast=int)
+
+# Máximo de giros da roleta consumidos num único pedido (giro em lote das promoções)
+ROULETTE_MAX_SPINS_PER_REQUEST = config('ROULETTE_MAX_SPINS_PER_REQUEST', default=100, cast=int)
+
+# Orçamento de prêmios da roleta por hora e por dia (KZ; 0 = sem limite). Esgotado,
+# só saem prêmios até ROULETTE_LOW_PRIZE_MAX. Os contadores são divididos em
+# ROULETTE_PAYOUT_SHARDS linhas por período (core/payouts.py).
+ROULETTE_HOURLY_BUDGET = config('ROULETTE_HOURLY_BUDGET', default='0', cast=Decimal)
+ROULETTE_DAILY_BUDGET = config('ROULETTE_DAILY_BUDGET', default='0', cast=Decimal)
+ROULETTE_LOW_PRIZE_MAX = config('ROULETTE_LOW_PRIZE_MAX', default='200', cast=Decimal)
+ROULETTE_PAYOUT_SHARDS = config('ROULETTE_PAYOUT_SHARDS', default=8, cast=int)
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -181,6 +288,9 @@ else:
     MEDIA_ROOT = BASE_DIR / 'media'
     MEDIA_URL = '/media/'
 
+# Tamanho máximo do comprovativo de depósito (bytes); pedidos maiores são recusados sem ler o corpo
+DEPOSIT_PROOF_MAX_UPLOAD_SIZE = config('DEPOSIT_PROOF_MAX_UPLOAD_SIZE', default=25 * 1024 * 1024, cast=int)
+
 # ======================================================================
 # FIM DA CONFIGURAÇÃO DE ARMAZENAMENTO
 # ======================================================================
@@ -192,6 +302,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # UKZ o modelo de usuário personalizado
 AUTH_USER_MODEL = 'core.CustomUser'
 
+# Carrega request.user de core.user_cache. O ModelBackend fica só para as sessões
+# iniciadas antes desta mudança (os logins novos ficam com o backend em cache);
+# enquanto estiver na lista, um login falhado calcula o hash nos dois. Pode sair
+# quando essas sessões expirarem (SESSION_COOKIE_AGE).
+AUTHENTICATION_BACKENDS = [
+    'core.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 LOGIN_URL = 'login'
 
 # Configuração de segurança adicional para produção